@@ -2,6 +2,7 @@ import numpy as np
 from PyQt5.QtCore import *
 
 from interpolators import *
+import frames
 import openpacking
 import solvepacking
 
@@ -16,9 +17,9 @@ class ControlCalculations(QObject):
     def __init__(self, d):
         super().__init__(parent=d)
         self.delegate = d
-        # thread instances
-        self.th_m = None
-        self.th_a = None
+        # running animations
+        self.mobius_animation = None
+        self.attribute_animation = None
 
         # set unified embedded circle packing holder
         self.uecp = self.delegate.uecp
@@ -63,11 +64,10 @@ class ControlCalculations(QObject):
         :param transformation:
         :return:
         """
-        # Create a new Animation Thread.  The new thread will insure our UI does not freeze.
-        # The Animation Thread time is in milliseconds
-        if self.th_m is None or self.th_m.isFinished():
-            self.th_m = MobiusAnimationThread(self, transformation, 500)
-            self.th_m.start()
+        # The animation is stepped by the frame scheduler, in the UI thread; its time is in milliseconds
+        if self.mobius_animation is None or self.mobius_animation.finished:
+            self.mobius_animation = MobiusAnimation(self, transformation, 500)
+            self.delegate.graphics.scheduler.animate(self.mobius_animation)
 
     def animate_attributes(self, attr_obj, changes):
         """
@@ -76,107 +76,79 @@ class ControlCalculations(QObject):
         :param changes:
         :return:
         """
-        if self.th_a is None or self.th_a.isFinished():
-            self.th_a = AttributeAnimationThread(self, attr_obj, changes, 500)
-            self.th_a.start()
+        if self.attribute_animation is None or self.attribute_animation.finished:
+            self.attribute_animation = AttributeAnimation(self, attr_obj, changes, 500)
+            self.delegate.graphics.scheduler.animate(self.attribute_animation)
 
 
-class MobiusAnimationThread(QThread):
+class MobiusAnimation(frames.Animation):
     """
-    A Thread designed to animate Mobius transformations
+    Animation of a Mobius transformation of the packing
     """
 
     def __init__(self, parent, transformation, tmill):
-        super().__init__(parent)
-        self.FPS = 48
+        super().__init__(tmill / 1000.0, parent.delegate.graphics.views())
 
         self.c_trans = parent.uecp.packing_trans
         self.orig_trans = np.copy(self.c_trans[0])
         self.trans = transformation
-        self.time = tmill
 
-        self.step = (np.array(self.trans, dtype='complex') - np.array(((1, 0), (0, 1)), dtype='complex'))
+        self.step_trans = (np.array(self.trans, dtype='complex') - np.array(((1, 0), (0, 1)), dtype='complex'))
 
-    
-    def run(self):
-        wait = 1000//self.FPS
-        counter = 0
-
-        while int(self.time/1000.0 * self.FPS) >= counter:
-            #before = time.time()
-            T = np.array(((1, 0), (0, 1)), dtype='complex') + self.step * swift_in_out(counter/(self.time/1000.0 * self.FPS))
-
-            self.c_trans[0] = self.orig_trans.dot(T)
-            # print(T, self.c_trans)
-            # print("Circle Calculation time: %s ms" % int(1000*(time.time()-before)))
-            # wait_time = wait - int(1000*(time.time()-before))
-
-            self.parent().draw_trigger.emit()
-            self.msleep(wait)
-            counter += 1
-
-        # update the last frame
-        self.c_trans[0] = self.orig_trans.dot(np.array(self.trans, dtype='complex'))
+    def update(self, t):
+        if t < 1:
+            T = np.array(((1, 0), (0, 1)), dtype='complex') + self.step_trans * swift_in_out(t)
+        else:
+            # the last frame
+            T = np.array(self.trans, dtype='complex')
         # No need to force optimization because a change in the mobius transformation will automatically
         # trigger it to re-optimize.
-        # Tell the UI to redraw
-        self.parent().draw_trigger.emit()
+        self.c_trans[0] = self.orig_trans.dot(T)
 
 
-class AttributeAnimationThread(QThread):
+class AttributeAnimation(frames.Animation):
     def __init__(self, parent, attr_obj, changes, tmill):
         """
-        AttributeAnimationThread animates properties within a dictionary
-        :param parent: parent QObject
+        AttributeAnimation animates properties within a dictionary
+        :param parent: the calculations controller
         :param attr_obj: reference to dictionary object with floating point properties
         :param changes: a dictionary with final values
         :param tmill: time in milliseconds
         """
-        super().__init__(parent)
-        self.FPS = 30
+        super().__init__(tmill / 1000.0, parent.delegate.graphics.views())
+        self.delegate = parent.delegate
 
         self.attr_obj = attr_obj
         self.orig_attr_obj = dict(attr_obj)
         self.attr_changes = changes
-        self.time = tmill
         # a dictionary that holds each step for each parameter
-        self.step = {}
+        self.attr_step = {}
 
         for k in self.attr_changes:
             if isinstance(self.attr_changes[k], list) or isinstance(self.attr_changes[k], tuple):
                 self.orig_attr_obj[k] = self.orig_attr_obj[k].copy()
-                self.step[k] = []
+                self.attr_step[k] = []
                 for i, v in enumerate(self.attr_changes[k]):
-                    self.step[k].append(v - self.attr_obj[k][i])
-
-                print(self.attr_obj[k], self.attr_changes[k], self.step[k])
+                    self.attr_step[k].append(v - self.attr_obj[k][i])
             else:
-                self.step[k] = float(self.attr_changes[k] - self.attr_obj[k])
-
-    def run(self):
-        wait = 1000 // self.FPS
-        counter = 0
-
-        while int(self.time / 1000.0 * self.FPS) >= counter:
-            # before = time.time()
-            for k in self.step:
-                if isinstance(self.step[k], list):
-                    for i, v in enumerate(self.step[k]):
-                        T = self.step[k][i] * swift_in_out(counter / (self.time / 1000.0 * self.FPS))
-                        self.attr_obj[k][i] = self.orig_attr_obj[k][i] + T
-                else:
-                    T = self.step[k] * swift_in_out(counter / (self.time / 1000.0 * self.FPS))
-                    self.attr_obj[k] = self.orig_attr_obj[k] + T
-
-            self.parent().draw_trigger.emit()
-            self.msleep(wait)
-            counter += 1
-
-        # update the last frame
-        for k in self.attr_changes:
-            self.attr_obj[k] = self.attr_changes[k]
+                self.attr_step[k] = float(self.attr_changes[k] - self.attr_obj[k])
+
+    def update(self, t):
+        if t >= 1:
+            # the last frame
+            for k in self.attr_changes:
+                self.attr_obj[k] = self.attr_changes[k]
+            return
+
+        for k in self.attr_step:
+            if isinstance(self.attr_step[k], list):
+                for i, v in enumerate(self.attr_step[k]):
+                    T = self.attr_step[k][i] * swift_in_out(t)
+                    self.attr_obj[k][i] = self.orig_attr_obj[k][i] + T
+            else:
+                T = self.attr_step[k] * swift_in_out(t)
+                self.attr_obj[k] = self.orig_attr_obj[k] + T
 
+    def done(self):
         # Force update will require the UI to optimize the circle packing for snappy interaction
-        self.parent().delegate.graphics.force_update()
-        # Tell the UI to redraw
-        self.parent().draw_trigger.emit()
+        self.delegate.graphics.force_update()
@@ -2,16 +2,23 @@
 
 # Based on circles.c from lim by Curtis McMullen
 
+from collections import defaultdict
+from math import floor
+
 import numpy as np
 
-from mobius import sl2inv
+from mobius import det2, sl2inv
 
 _LINE_EPS = 1e-8
 
 class Circle:
-    def __init__(self,m):
-        """Circle in CP^1 represented by its inversion anti-mobius map"""
-        self.m = np.array(m,dtype='complex')
+    def __init__(self,m,copy=True):
+        """Circle in CP^1 represented by its inversion anti-mobius map
+        (with copy=False, an existing complex array is used as is)"""
+        if copy:
+            self.m = np.array(m,dtype='complex')
+        else:
+            self.m = np.asarray(m,dtype='complex')
         assert self.m.shape == (2,2)
 
     @property
@@ -59,6 +66,166 @@ class Circle:
             return 'Circle(m={}; c={}, r={})'.format(s,self.center,self.radius)
 
 
+class CircleArray:
+    """Array of circles in CP^1, represented by an (N,2,2) array of
+    inversion anti-mobius maps.  The properties of Circle are computed
+    for all circles at once, as arrays of shape (N,).  A CircleArray is
+    also a sequence of Circle objects (which share its memory), so it
+    can be used in place of a list of circles."""
+    def __init__(self,m,copy=True):
+        if copy:
+            self.m = np.array(m,dtype='complex').reshape((-1,2,2))
+        else:
+            self.m = np.asarray(m,dtype='complex').reshape((-1,2,2))
+
+    @classmethod
+    def from_circles(cls,circles):
+        circles = list(circles)
+        if not circles:
+            return cls(np.zeros((0,2,2)))
+        return cls(np.array([c.m for c in circles],dtype='complex'),copy=False)
+
+    def __len__(self):
+        return len(self.m)
+
+    def __getitem__(self,i):
+        """Circle i, or a CircleArray for a slice, index array or mask"""
+        if isinstance(i,(int,np.integer)):
+            return Circle(self.m[i],copy=False)
+        return CircleArray(self.m[i],copy=False)
+
+    def __iter__(self):
+        for m in self.m:
+            yield Circle(m,copy=False)
+
+    @property
+    def contains_infinity(self):
+        return np.abs(np.imag(self.m[:,1,0])) < _LINE_EPS
+
+    @property
+    def center(self):
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return self.m[:,0,0] / self.m[:,1,0]
+
+    @property
+    def radius(self):
+        with np.errstate(divide='ignore'):
+            return 1.0 / np.imag(self.m[:,1,0])
+
+    @property
+    def line_base(self):
+        return 0.5 * self.m[:,0,0] * self.m[:,0,1]
+
+    @property
+    def line_angle(self):
+        return np.angle(self.m[:,0,0])
+
+    def transform_gl2(self,T):
+        T = np.array(T,dtype='complex')
+        T = T / np.sqrt(det2(T))[...,None,None]
+        return self.transform_sl2(T)
+
+    def transform_sl2(self,T):
+        """Image under T, a matrix in SL(2,C) or an (N,2,2) array of them"""
+        T = np.array(T,dtype='complex')
+        M = np.matmul(T,self.m)
+        return CircleArray(np.matmul(M,np.conj(sl2inv(T)),out=M),copy=False)
+
+    def __repr__(self):
+        return 'CircleArray(<{} circles>)'.format(len(self))
+
+
+class CircleSet:
+    """Set of circles and lines, considered equal if their parameters
+    agree within a tolerance.  Lookups go through a spatial hash on the
+    center (circles) or the point nearest the origin (lines), so adding
+    a circle costs O(1) regardless of the size of the set."""
+    def __init__(self,tol=1e-5):
+        self.tol = tol
+        self._cells = defaultdict(list)
+        self._n = 0
+
+    @staticmethod
+    def _params(c):
+        """(kind, hashed point, other parameter) for a circle or line"""
+        if c.contains_infinity:
+            # Nearest point to the origin, and the direction squared
+            # (which does not depend on the orientation of the line)
+            d = np.exp(1j*c.line_angle)
+            p = c.line_base - (np.conj(d)*c.line_base).real * d
+            return 1, complex(p), complex(d*d)
+        return 0, complex(c.center), float(c.radius)
+
+    def _cell(self,kind,p):
+        return (kind, floor(p.real/self.tol), floor(p.imag/self.tol))
+
+    def _find(self,kind,p,q):
+        k, i, j = self._cell(kind,p)
+        for di in (-1,0,1):
+            for dj in (-1,0,1):
+                for p2, q2 in self._cells.get((k,i+di,j+dj),()):
+                    if abs(p2.real-p.real) <= self.tol and abs(p2.imag-p.imag) <= self.tol and abs(q2-q) <= self.tol:
+                        return True
+        return False
+
+    def add(self,c):
+        """Add c unless an equal circle is already present; return True if it was added"""
+        kind, p, q = self._params(c)
+        if self._find(kind,p,q):
+            return False
+        self._cells[self._cell(kind,p)].append((p,q))
+        self._n += 1
+        return True
+
+    def __contains__(self,c):
+        return self._find(*self._params(c))
+
+    def __len__(self):
+        return self._n
+
+
+class CircleIndex:
+    """Index of a CircleArray by position and size, for finding the
+    circles whose bounding boxes meet a rectangle.  Circles are grouped
+    into levels by radius (between consecutive powers of 2), and each
+    level is sorted by center.real, so a query is a binary search per
+    level followed by a filter of the circles in a vertical strip.
+    Levels of circles that are too small are skipped altogether.
+
+    Lines meet every rectangle, so they are always returned."""
+    def __init__(self,circles):
+        self.circles = circles
+        lines = circles.contains_infinity
+        self.lines = np.flatnonzero(lines)
+        idx = np.flatnonzero(~lines)
+        c = circles.center[idx]
+        r = np.abs(circles.radius[idx])
+        level = np.floor(np.log2(r)).astype(int)
+        self.levels = []
+        for L in np.unique(level):
+            sel = level == L
+            order = np.argsort(c[sel].real, kind='stable')
+            self.levels.append((2.0**(L+1), idx[sel][order], c[sel][order], r[sel][order]))
+
+    def __len__(self):
+        return len(self.circles)
+
+    def query(self,xmin,xmax,ymin,ymax,min_radius=0.0):
+        """Sorted indices of the lines and of the circles with |radius| >
+        min_radius whose bounding boxes meet [xmin,xmax] x [ymin,ymax]"""
+        found = [self.lines]
+        for rmax, idx, c, r in self.levels:
+            if rmax <= min_radius:
+                continue
+            lo = np.searchsorted(c.real,xmin-rmax,side='left')
+            hi = np.searchsorted(c.real,xmax+rmax,side='right')
+            c1, r1 = c[lo:hi], r[lo:hi]
+            hit = ((r1 > min_radius) & (c1.real - r1 <= xmax) & (c1.real + r1 >= xmin)
+                   & (c1.imag - r1 <= ymax) & (c1.imag + r1 >= ymin))
+            found.append(idx[lo:hi][hit])
+        return np.sort(np.concatenate(found))
+
+
 def from_center_radius(center,radius):
     c = center
     r = radius
@@ -0,0 +1,150 @@
+"""On-disk cache of the circles computed for circle packings"""
+
+# Each entry is a directory named by a hash of its key, holding
+#   mats.npy  -- (N,2,2) complex inversion matrices of the circles
+#   verts.npy -- (N,) vertex index (in the DCEL) of each circle
+#   dual.npy  -- (N,) whether each circle is part of the dual graph
+#   key.json  -- the key, for reference
+# Arrays are memory-mapped when an entry is loaded.  The directory as a
+# whole is kept below a size limit by removing the least recently used
+# entries (by modification time, which load() updates).
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import circle
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+def default_cache_dir():
+    """$BUBBLE_WRAP_CACHE, or bubble-wrap/circles in the user cache directory"""
+    if os.environ.get('BUBBLE_WRAP_CACHE'):
+        return os.environ['BUBBLE_WRAP_CACHE']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bubble-wrap', 'circles')
+
+def packing_key(D, packing, digest, word_source, budget):
+    """
+    Key of a cached circle set
+    :param D: the IndexedDCEL (its uuid identifies the triangulation)
+    :param packing: key of the packing in the file
+    :param digest: packing_hash() of the packing; files of the same triangulation share its
+        uuid, and may use the same keys ("Packing 0", ...) for different packings
+    :param word_source: description of the words used (see word_source())
+    :param budget: depth or pixel/circle budget of the search, e.g. a tuple (min_radius, max_circles)
+    :return: tuple of strings
+    """
+    return str(D.uuid), str(packing), digest, str(word_source), repr(budget)
+
+def packing_hash(X, Rho, normalization):
+    """
+    Hash of the values of a packing, and of its holonomy and normalization (which depend on
+    the edge chains of the file)
+    :param Rho: fgrep.FreeGroup; only its generators are hashed
+    """
+    h = hashlib.sha1(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+    for k in sorted(k for k in Rho if len(k) == 1 and k.islower()):
+        h.update(k.encode('ascii'))
+        h.update(np.ascontiguousarray(Rho[k], dtype='complex').tobytes())
+    h.update(np.ascontiguousarray(normalization, dtype='complex').tobytes())
+    return h.hexdigest()
+
+def word_source(words):
+    """
+    Description of a word source for packing_key(): a file (by name, size and modification
+    time), a collection of words (by a hash of its contents), or None for a best-first search
+    """
+    if words is None:
+        return 'best-first'
+    if isinstance(words, str):
+        st = os.stat(words)
+        return 'file:%s:%d:%d' % (os.path.basename(words), st.st_size, int(st.st_mtime))
+    h = hashlib.sha1('\n'.join(sorted(words)).encode('ascii'))
+    return 'words:%d:%s' % (len(words), h.hexdigest())
+
+class CircleCache:
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param path: cache directory (default: default_cache_dir()); created when needed
+        :param max_bytes: size limit for the cache directory
+        """
+        self.path = path or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _entry(self, key):
+        return os.path.join(self.path, hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest())
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry(key))
+
+    def load(self, key, D):
+        """
+        Circles stored under key
+        :param D: the DCEL whose vertices the circles belong to
+        :return: list of [circle, vertex, dual_graph_part], or None if there is no (readable) entry
+        """
+        d = self._entry(key)
+        try:
+            mats = np.load(os.path.join(d, 'mats.npy'), mmap_mode='r')
+            verts = np.load(os.path.join(d, 'verts.npy'), mmap_mode='r')
+            dual = np.load(os.path.join(d, 'dual.npy'), mmap_mode='r')
+            os.utime(d)
+        except (OSError, ValueError):
+            return None
+        V = D.V
+        # the circles are views of the memory-mapped matrices
+        cs = circle.CircleArray(mats, copy=False)
+        return [[c, V[v], b] for c, v, b in zip(cs, verts.tolist(), dual.tolist())]
+
+    def store(self, key, circles):
+        """
+        Store circles (list of [circle, vertex, dual_graph_part]) under key, replacing any
+        earlier entry, and evict old entries if the cache is over its size limit
+        """
+        os.makedirs(self.path, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        try:
+            np.save(os.path.join(tmp, 'mats.npy'),
+                    np.array([c.m for c, v, d in circles], dtype='complex').reshape((-1, 2, 2)))
+            np.save(os.path.join(tmp, 'verts.npy'), np.array([v.idx for c, v, d in circles], dtype=np.int32))
+            np.save(os.path.join(tmp, 'dual.npy'), np.array([d for c, v, d in circles], dtype=bool))
+            with open(os.path.join(tmp, 'key.json'), 'w') as f:
+                json.dump(key, f)
+            d = self._entry(key)
+            shutil.rmtree(d, ignore_errors=True)
+            os.rename(tmp, d)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict()
+
+    def entries(self):
+        """List of (path, size in bytes, modification time) of the entries, least recently used first"""
+        result = []
+        if not os.path.isdir(self.path):
+            return result
+        for name in os.listdir(self.path):
+            d = os.path.join(self.path, name)
+            if name.startswith('.') or not os.path.isdir(d):
+                continue
+            size = sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d))
+            result.append((d, size, os.path.getmtime(d)))
+        return sorted(result, key=lambda e: e[2])
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within its size limit"""
+        entries = self.entries()
+        total = sum(size for d, size, t in entries)
+        for d, size, t in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -74,14 +74,37 @@ class IndexedDCEL(ImmutableDCEL):
         for k,f in enumerate(self.F):
             f.idx = k
         UE = []
+        # (a set alongside UE, for fast membership tests)
+        seen = set()
         for k,e in enumerate(self.E):
             e.idx = k
-            if e not in UE and e.twin not in UE:
+            if e not in seen and e.twin not in seen:
                 e.uidx = len(UE)
                 if e.twin:
                     e.twin.uidx = len(UE)
                 UE.append(e)
+                seen.add(e)
         self.UE = tuple(UE)
+        self._stats = None
+
+    @property
+    def stats(self):
+        """Summary of the DCEL, computed on first use (the DCEL is immutable):
+
+        vertices, half_edges, edges, faces -- counts (edges are unoriented)
+        valences -- dict mapping each valence to its number of vertices
+        topology -- as returned by oriented_manifold_type()
+        """
+        if self._stats is None:
+            self._stats = {
+                'vertices': len(self.V),
+                'half_edges': len(self.E),
+                'edges': len(self.UE),
+                'faces': len(self.F),
+                'valences': valence_histogram(self.V),
+                'topology': oriented_manifold_type(self),
+            }
+        return self._stats
 
 class Vertex:
     """Vertex object for use with DCEL.
@@ -347,6 +370,13 @@ def manifold_boundary_components(D):
             cpnts.add( (e,k) )
     return cpnts
 
+def valence_histogram(V):
+    """Dict mapping each valence of the vertices V to the number of vertices of that valence"""
+    hist = dict()
+    for v in V:
+        hist[v.valence] = hist.get(v.valence,0) + 1
+    return dict(sorted(hist.items()))
+
 def oriented_manifold_type(D):
     # TODO: DON'T ASSUME CONNECTEDNESS
     topo = dict()
@@ -20,9 +20,128 @@ lcase = 'abcdefghijklmnopqrstuvwxyz'
 ucase = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 wordre = re.compile(r'[A-Za-z]+')
 
+def inverse_word(w):
+    '''Inverse of a word, e.g. aBc -> CbA'''
+    return w[::-1].swapcase()
+
+def free_reduce(w):
+    '''Cancel adjacent pairs of inverse letters, e.g. abBc -> ac'''
+    out = []
+    for x in w:
+        if out and out[-1] == x.swapcase():
+            out.pop()
+        else:
+            out.append(x)
+    return ''.join(out)
+
+class RewritingSystem:
+    '''Shortlex-ordered string rewriting system for a group presentation.
+
+    The rules are obtained from free cancellation and the given
+    relators by Knuth-Bendix completion.  If completion finishes
+    within maxrules rules the system is confluent, and the irreducible
+    words are unique normal forms (the shortlex least representative
+    of each group element).  Otherwise the rules found so far are kept;
+    they still only rewrite words into equal, shortlex smaller ones.
+
+    Presentations such as abABcdCD have no finite shortlex system.
+    For those, maxlen discards rules with longer left hand sides; only
+    words longer than maxlen can then have more than one normal form.'''
+    def __init__(self,order,relators=(),maxrules=1000,maxlen=None):
+        self.order = order
+        self._pos = { x:i for i,x in enumerate(order) }
+        self.rules = {}
+        self._lengths = []
+        self.maxlen = maxlen
+        self.confluent = self._complete(relators,maxrules)
+
+    def key(self,w):
+        '''Shortlex sort key of a word'''
+        return (len(w),[ self._pos[x] for x in w ])
+
+    def reduce(self,w):
+        '''Rewrite w until no left hand side of a rule occurs in it'''
+        out = []
+        todo = list(reversed(w))
+        while todo:
+            out.append(todo.pop())
+            # out was irreducible, so any match is a suffix
+            for n in self._lengths:
+                if n > len(out):
+                    break
+                r = self.rules.get(''.join(out[-n:]))
+                if r is not None:
+                    del out[-n:]
+                    todo.extend(reversed(r))
+                    break
+        return ''.join(out)
+
+    def is_reduced_extension(self,w,x):
+        '''Assuming w is irreducible, decide whether w+x is irreducible'''
+        wx = w + x
+        for n in self._lengths:
+            if n > len(wx):
+                break
+            if wx[-n:] in self.rules:
+                return False
+        return True
+
+    def _add_rule(self,u,v,pending):
+        # Drop rules that the new one makes redundant and requeue them as equations
+        for l in [ l for l in self.rules if u in l ]:
+            pending.append((l,self.rules.pop(l)))
+        self.rules[u] = v
+        self._lengths = sorted({ len(l) for l in self.rules })
+        for l in self.rules:
+            self.rules[l] = self.reduce(self.rules[l])
+
+    def _complete(self,relators,maxrules):
+        '''Knuth-Bendix completion; returns True if the result is confluent'''
+        pending = [ (x+x.swapcase(),'') for x in self.order ]
+        for r in relators:
+            # Cyclic conjugates are consequences, but listing them speeds things up
+            for w in (r,inverse_word(r)):
+                pending += [ (w[i:]+w[:i],'') for i in range(len(w)) ]
+        added = []
+        truncated = False
+        i = 0
+        while True:
+            while pending:
+                u,v = pending.pop()
+                u,v = self.reduce(u),self.reduce(v)
+                if u == v:
+                    continue
+                if self.key(u) < self.key(v):
+                    u,v = v,u
+                if self.maxlen and len(u) > self.maxlen:
+                    truncated = True
+                    continue
+                self._add_rule(u,v,pending)
+                added.append(u)
+                if len(self.rules) > maxrules:
+                    return False
+            if i == len(added):
+                return not truncated
+            # Resolve critical pairs between rule number i and all earlier rules
+            l1 = added[i]
+            i += 1
+            if l1 not in self.rules:
+                continue
+            for l2 in added[:i]:
+                if l2 not in self.rules:
+                    continue
+                for a,b in ((l1,l2),(l2,l1)):
+                    for k in range(1,min(len(a),len(b))):
+                        if a[-k:] == b[:k]:
+                            pending.append((self.rules[a]+b[k:],a[:-k]+self.rules[b]))
+
 class FreeGroup(dict):
-    '''Matrix group class where generators are represented by lower-case letters'''
-    def __init__(self,gens,inverter=linalg.inv):
+    '''Matrix group class where generators are represented by lower-case letters
+
+    If relators (words that map to the identity) are given, a shortlex
+    rewriting system is built from them and used by the word
+    enumeration methods so that each group element is generated once.'''
+    def __init__(self,gens,inverter=linalg.inv,relators=None,maxrules=1000,maxlen=None):
         self.n = None
         for k in gens:
             if isinstance(k,str) and len(k)==1 and k in lcase:
@@ -41,7 +160,40 @@ class FreeGroup(dict):
         keys.sort()
         ukeys = [ k.upper() for k in keys ]
         self.alphabet = ''.join(keys + ukeys)
+        # Shortlex order a < A < b < B < ..., as used for the word lists in data/words
+        self.order = ''.join(k + k.upper() for k in keys)
         self.inverter = inverter
+        if relators:
+            self.rws = RewritingSystem(self.order,relators,maxrules=maxrules,maxlen=maxlen)
+        else:
+            self.rws = None
+
+    def normal_form(self,w):
+        '''Free reduction of w, or its normal form if there are relators'''
+        if self.rws:
+            return self.rws.reduce(w)
+        return free_reduce(w)
+
+    def extensions(self,w,alphabet=None):
+        '''Generate the reduced words w+x for letters x of alphabet (default: self.order).
+        Assumes w itself is reduced.'''
+        for x in alphabet or self.order:
+            if self.rws:
+                if self.rws.is_reduced_extension(w,x):
+                    yield w + x
+            elif not w or w[-1] != x.swapcase():
+                yield w + x
+
+    def reduced_words(self,depth,alphabet=None):
+        '''Generate the reduced words of length at most depth in shortlex
+        order, starting with the empty word.  No word contains a letter
+        followed by its inverse.'''
+        level = ['']
+        yield ''
+        for n in range(depth):
+            level = [ v for w in level for v in self.extensions(w,alphabet) ]
+            for v in level:
+                yield v
 
     def __getitem__(self, k):
         if k=='':
@@ -68,4 +220,6 @@ if __name__ == '__main__':
     print(F.keys())
     for w in words:
         print('%s = %s' % (w,matstr(F[w])))
+    Z2 = FreeGroup(gens,relators=['abAB'])
+    print('Reduced words of length <= 2 in Z^2:',list(Z2.reduced_words(2)))
 
@@ -0,0 +1,204 @@
+"""Frame scheduling: coalesced repaints and clock-driven animations"""
+
+# Repaint requests (from mouse handlers, worker thread signals and
+# animations) are collected by a FrameScheduler and served together, at
+# most once per display refresh: requests arriving before the next frame
+# is due only add their widget to the set repainted by that frame.
+#
+# Animations are stepped at each frame with the time elapsed on a
+# monotonic clock since they started, rather than by counting fixed
+# sleeps, so a slow frame makes the next step larger instead of
+# stretching the animation.  The duration of each frame (stepping the
+# animations and repainting) is recorded in frame_times.
+#
+# PaintTimings breaks the paints of a view down into stages, when
+# enabled, keeping the durations of the last frames for percentiles.
+
+import json
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, QTimer, Qt
+from PyQt5.QtGui import QGuiApplication
+
+DEFAULT_REFRESH_RATE = 60
+# number of frames whose durations are kept
+FRAME_HISTORY = 120
+# percentiles reported by PaintTimings
+PERCENTILES = (50, 90, 99)
+
+class Animation:
+    """
+    Change of some state over a duration, stepped by a FrameScheduler.
+    Subclasses implement update(t).
+    """
+    def __init__(self, duration, widgets=()):
+        """
+        :param duration: length in seconds
+        :param widgets: widgets to repaint at each step
+        """
+        self.duration = duration
+        self.widgets = list(widgets)
+        self.start_time = None
+        self.finished = False
+
+    def update(self, t):
+        """Apply the state at time t, a fraction (0 to 1) of the duration"""
+        raise NotImplementedError
+
+    def done(self):
+        """Called after the last step"""
+        pass
+
+    def step(self, now):
+        """Update to the monotonic time now; return False once the animation is over"""
+        if self.start_time is None:
+            self.start_time = now
+        t = min(1.0, (now - self.start_time) / self.duration) if self.duration > 0 else 1.0
+        self.update(t)
+        if t >= 1.0:
+            self.finished = True
+            self.done()
+        return not self.finished
+
+class FrameScheduler(QObject):
+    """
+    Repaints widgets and steps animations at most once per display refresh (see module comment).
+    Must be used from the GUI thread; worker threads reach it through queued signals.
+    """
+    def __init__(self, parent=None, refresh_rate=None):
+        """
+        :param refresh_rate: frames per second (default: that of the primary screen)
+        """
+        super().__init__(parent)
+        if refresh_rate is None:
+            screen = QGuiApplication.primaryScreen()
+            refresh_rate = screen.refreshRate() if screen is not None else 0
+            if not refresh_rate > 0:
+                refresh_rate = DEFAULT_REFRESH_RATE
+        self.interval = 1.0 / refresh_rate
+
+        # widgets to repaint at the next frame, in order of request
+        self.pending = []
+        self.animations = []
+        # durations (seconds) of the last frames, and the monotonic start time of the last one
+        self.frame_times = deque(maxlen=FRAME_HISTORY)
+        self.last_frame = None
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.frame)
+
+    def request(self, widget):
+        """Repaint widget at the next frame"""
+        if widget not in self.pending:
+            self.pending.append(widget)
+        self.schedule()
+
+    def animate(self, animation):
+        """Run animation, starting with the next frame"""
+        self.animations.append(animation)
+        self.schedule()
+
+    def schedule(self):
+        """Start the timer for the next frame, one frame interval after the last one"""
+        if self.timer.isActive():
+            return
+        delay = 0.0
+        if self.last_frame is not None:
+            delay = self.last_frame + self.interval - time.monotonic()
+        self.timer.start(max(0, int(1000 * delay)))
+
+    def frame(self):
+        now = time.monotonic()
+        self.last_frame = now
+
+        for animation in list(self.animations):
+            if not animation.step(now):
+                self.animations.remove(animation)
+            for w in animation.widgets:
+                if w not in self.pending:
+                    self.pending.append(w)
+
+        widgets, self.pending = self.pending, []
+        for w in widgets:
+            w.repaint()
+
+        self.frame_times.append(time.monotonic() - now)
+        if self.animations or self.pending:
+            self.schedule()
+
+    @property
+    def frame_time(self):
+        """Mean duration (seconds) of the recent frames, or None before the first frame"""
+        if not self.frame_times:
+            return None
+        return sum(self.frame_times) / len(self.frame_times)
+
+    def timings(self):
+        """The recent frame times, as the stage 'frame' of a PaintTimings"""
+        pt = PaintTimings()
+        pt.samples['frame'] = deque(self.frame_times, maxlen=pt.history)
+        return pt
+
+class PaintTimings:
+    """
+    Durations of the stages of the paints of a view, over the last frames.  Timing is off
+    (and costs next to nothing) unless enabled is set.
+
+    Usage, in a paint event:
+        with timings.stage('widgets'):
+            ...
+    """
+    def __init__(self, history=FRAME_HISTORY):
+        self.enabled = False
+        self.history = history
+        # stage -> durations in seconds, in the order stages were first seen
+        self.samples = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        if name not in self.samples:
+            self.samples[name] = deque(maxlen=self.history)
+        self.samples[name].append(seconds)
+
+    def clear(self):
+        self.samples = OrderedDict()
+
+    def percentiles(self, q=PERCENTILES):
+        """OrderedDict stage -> list of the q-th percentiles of its durations, in milliseconds"""
+        return OrderedDict((name, [float(x) for x in 1000 * np.percentile(np.array(s), q)])
+                           for name, s in self.samples.items() if s)
+
+    def summary(self, q=PERCENTILES):
+        """List of (stage, text) for an InfoWidget, e.g. ('frame', 'p50 3.1 p90 4.0 p99 7.2 ms')"""
+        return [(name, ' '.join('p%d %.1f' % (k, v) for k, v in zip(q, ms)) + ' ms')
+                for name, ms in self.percentiles(q).items()]
+
+    def state(self, q=PERCENTILES):
+        """Percentiles and raw durations (both in milliseconds), as a JSON serializable dict"""
+        return {name: {'percentiles': dict(zip(('p%d' % k for k in q), ms)),
+                       'samples_ms': [1000 * x for x in self.samples[name]]}
+                for name, ms in self.percentiles(q).items()}
+
+def dump_timings(fn, timings):
+    """
+    Write the state of several PaintTimings to a JSON file
+    :param timings: dict name -> PaintTimings
+    """
+    with open(fn, 'w') as f:
+        json.dump({name: pt.state() for name, pt in timings.items()}, f, indent=2)
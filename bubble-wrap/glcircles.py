@@ -0,0 +1,303 @@
+"""Instanced OpenGL rendering of circles"""
+
+# Each circle is one instance of a quad, with its center and radius and a
+# style id as per-instance vertex attributes; the vertex shader maps the
+# circle into the view and spans the quad over it, and the fragment shader
+# draws an antialiased disc with a one pixel outline.
+#
+# The circles are uploaded once, in a frame of reference: their images
+# under the transformation T of the view at that time, with the centers
+# relative to an anchor point near the view center (computed in double
+# precision, then stored as floats).  The vertex shader applies the
+# transformation from the frame to the current view, relative to the view
+# center, so panning, zooming and Mobius transformations of the view only
+# change uniforms.  Relative to the anchor, single precision is enough for
+# the circles in view; when the view moves too far from the anchor (see
+# CircleRenderer.frame_offset), the frame is moved and the circles are
+# uploaded again.
+#
+# Circles less than a pixel across are dropped in the vertex shader, and
+# so are lines (which contain infinity) and circles of more than
+# MAX_RADIUS pixels, whose outlines single precision can't place; those
+# are drawn separately.
+#
+# Requires OpenGL 3.3, which Mesa's software renderer (llvmpipe) provides.
+
+import ctypes
+
+import numpy as np
+from OpenGL import GL
+
+import mobius
+
+# style id -> (pen, brush) as RGBA; the brush is only used for circles of
+# positive radius.  These match the QPainter styles of the packing view:
+# black, or red for vertices of valence > 6.
+STYLES = (
+    ((0.0, 0.0, 0.0, 1.0), (0.0, 0.0, 0.0, 50 / 255)),
+    ((1.0, 0.0, 0.0, 1.0), (1.0, 0.0, 0.0, 100 / 255)),
+)
+
+# radius in pixels of the largest circles drawn
+MAX_RADIUS = 2.0 ** 20
+# distance in pixels from the view center up to which the anchor of the frame is kept;
+# with MAX_RADIUS, this keeps the outlines within a tenth of a pixel
+MAX_FRAME_OFFSET = 2.0 ** 16
+
+_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec2 corner;
+layout(location = 1) in vec3 disc;  // center (relative to the anchor) and signed radius, in the frame
+layout(location = 2) in float style;    // negative for lines, which are not drawn
+
+uniform vec4 S0;        // rows of the transformation from the frame to the view
+uniform vec4 S1;        // (relative to the anchor and the view center), in SL(2,C)
+uniform float zoom;
+uniform vec2 origin;    // view center in pixels
+uniform vec2 viewport;  // size in pixels
+uniform float max_radius;
+uniform vec4 pen[2];
+uniform vec4 brush[2];
+
+out vec2 offset;
+flat out float radius;
+flat out vec4 v_pen;
+flat out vec4 v_brush;
+
+vec2 cmul(vec2 a, vec2 b) { return vec2(a.x * b.x - a.y * b.y, a.x * b.y + a.y * b.x); }
+vec2 cconj(vec2 a) { return vec2(a.x, -a.y); }
+
+void main() {
+    vec2 a = S0.xy, b = S0.zw, c = S1.xy, d = S1.zw;
+    vec2 u = disc.xy;
+    float r2 = disc.z * disc.z;
+    // image of the circle: the center is the image of the reflection of the pole in it
+    vec2 q = cmul(c, u) + d;
+    float den = dot(q, q) - dot(c, c) * r2;
+    vec2 center = (cmul(cmul(a, u) + b, cconj(q)) - r2 * cmul(a, cconj(c))) / den;
+    float r = zoom * disc.z / den;
+
+    radius = abs(r);
+    if (style < 0.0 || !(radius > 1.0) || !(radius <= max_radius)) {
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+        return;
+    }
+    int s = int(style);
+    v_pen = pen[s];
+    v_brush = r > 0.0 ? brush[s] : vec4(0.0);
+    offset = corner * (radius + 1.0);
+    vec2 p = origin + zoom * center + offset;
+    gl_Position = vec4(2.0 * p.x / viewport.x - 1.0, 1.0 - 2.0 * p.y / viewport.y, 0.0, 1.0);
+}
+"""
+
+_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 offset;
+flat in float radius;
+flat in vec4 v_pen;
+flat in vec4 v_brush;
+
+out vec4 color;
+
+void main() {
+    float d = length(offset);
+    float outline = v_pen.a * clamp(1.0 - abs(d - radius), 0.0, 1.0);
+    float fill = v_brush.a * clamp(radius - d + 0.5, 0.0, 1.0);
+    // outline over fill
+    float alpha = outline + fill * (1.0 - outline);
+    if (alpha <= 0.0)
+        discard;
+    color = vec4((v_pen.rgb * outline + v_brush.rgb * fill * (1.0 - outline)) / alpha, alpha);
+}
+"""
+
+# floats per instance: center, radius, style id
+_INSTANCE_FLOATS = 4
+
+def _compile(source, kind):
+    shader = GL.glCreateShader(kind)
+    GL.glShaderSource(shader, source)
+    GL.glCompileShader(shader)
+    if not GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS):
+        raise RuntimeError('shader compilation failed: %s' % GL.glGetShaderInfoLog(shader).decode())
+    return shader
+
+def _link(*shaders):
+    program = GL.glCreateProgram()
+    for s in shaders:
+        GL.glAttachShader(program, s)
+    GL.glLinkProgram(program)
+    for s in shaders:
+        GL.glDeleteShader(s)
+    if not GL.glGetProgramiv(program, GL.GL_LINK_STATUS):
+        raise RuntimeError('shader linking failed: %s' % GL.glGetProgramInfoLog(program).decode())
+    return program
+
+def _translation(w):
+    return np.array(((1, w), (0, 1)), dtype='complex')
+
+def instance_data(circles, styles, T, anchor):
+    """
+    Per-instance attributes for circles, in a frame of reference: only the conversion of
+    these (relative to the anchor) loses precision
+    :param circles: circle.CircleArray
+    :param styles: style id (index into STYLES) of each circle
+    :param T: transformation of the frame, in SL(2,C)
+    :param anchor: complex, point of the frame the centers are relative to
+    :return: float32 array of shape (N, 4); lines get the style id -1
+    """
+    styles = np.asarray(styles, dtype=np.float64).reshape(-1)
+    cs = circles.transform_sl2(T)
+    lines = cs.contains_infinity
+    c = np.where(lines, 0, cs.center - anchor)
+    data = np.empty((len(cs), _INSTANCE_FLOATS), dtype=np.float32)
+    data[:, 0] = c.real
+    data[:, 1] = c.imag
+    data[:, 2] = np.where(lines, 0, cs.radius)
+    data[:, 3] = np.where(lines, -1, styles)
+    return data
+
+class CircleRenderer:
+    """
+    Draws circles with instancing.  The OpenGL objects are created in the
+    constructor, so it (and all methods) must be called with the OpenGL
+    context current.
+    """
+    def __init__(self, capacity=4096):
+        self.program = _link(_compile(_VERTEX_SHADER, GL.GL_VERTEX_SHADER),
+                             _compile(_FRAGMENT_SHADER, GL.GL_FRAGMENT_SHADER))
+        self.uniforms = {name: GL.glGetUniformLocation(self.program, name)
+                         for name in ('S0', 'S1', 'zoom', 'origin', 'viewport', 'max_radius', 'pen', 'brush')}
+        # (transformation, anchor) of the frame of reference, see set_frame()
+        self.frame = None
+        self.count = 0
+        self.capacity = 0
+        # indices of the circles that are lines in the frame (and not drawn)
+        self.lines = np.zeros(0, dtype=int)
+
+        self.vao = GL.glGenVertexArrays(1)
+        GL.glBindVertexArray(self.vao)
+        self.quad = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.quad)
+        corners = np.array(((-1, -1), (1, -1), (-1, 1), (1, 1)), dtype=np.float32)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, corners.nbytes, corners, GL.GL_STATIC_DRAW)
+        GL.glEnableVertexAttribArray(0)
+        GL.glVertexAttribPointer(0, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, None)
+        self.instances = None
+        self._allocate(capacity)
+        GL.glBindVertexArray(0)
+
+    def _allocate(self, capacity):
+        """Replace the instance buffer by one of the given capacity, keeping its instances"""
+        stride = _INSTANCE_FLOATS * 4
+        buf = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buf)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, capacity * stride, None, GL.GL_DYNAMIC_DRAW)
+        if self.instances is not None:
+            if self.count:
+                GL.glBindBuffer(GL.GL_COPY_READ_BUFFER, self.instances)
+                GL.glCopyBufferSubData(GL.GL_COPY_READ_BUFFER, GL.GL_ARRAY_BUFFER, 0, 0, self.count * stride)
+                GL.glBindBuffer(GL.GL_COPY_READ_BUFFER, 0)
+            GL.glDeleteBuffers(1, [self.instances])
+        self.instances = buf
+        self.capacity = capacity
+
+        # attributes 1-2 are per instance, from the new buffer
+        for loc, size, start in ((1, 3, 0), (2, 1, 3)):
+            GL.glEnableVertexAttribArray(loc)
+            GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(start * 4))
+            GL.glVertexAttribDivisor(loc, 1)
+
+    def clear(self):
+        """Drop all circles"""
+        self.count = 0
+        self.lines = np.zeros(0, dtype=int)
+
+    def set_frame(self, T, anchor):
+        """
+        Start a new frame of reference (dropping all circles), for circles appended from now on
+        :param T: transformation of the view, a 2x2 complex matrix
+        :param anchor: complex, point of the view (after T) that the centers are relative to
+        """
+        self.frame = mobius.make_sl2(T), complex(anchor)
+        self.clear()
+
+    def append(self, circles, styles):
+        """
+        Add circles, in the current frame
+        :param circles: circle.CircleArray, in packing coordinates (before the transformation)
+        :param styles: style id (index into STYLES) of each circle
+        """
+        data = instance_data(circles, styles, *self.frame)
+        if not len(data):
+            return
+        self.lines = np.concatenate((self.lines, self.count + np.flatnonzero(data[:, 3] < 0)))
+        GL.glBindVertexArray(self.vao)
+        if self.count + len(data) > self.capacity:
+            self._allocate(max(2 * self.capacity, self.count + len(data)))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instances)
+        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, self.count * data.itemsize * _INSTANCE_FLOATS, data.nbytes, data)
+        GL.glBindVertexArray(0)
+        self.count += len(data)
+
+    def transformation(self, T, center):
+        """
+        The transformation from the frame to the view, relative to the anchor and the view center
+        :param T: transformation of the view, a 2x2 complex matrix
+        :param center: complex, view center (after T)
+        :return: 2x2 complex matrix in SL(2,C)
+        """
+        T0, anchor = self.frame
+        M = np.matmul(mobius.make_sl2(T), mobius.sl2inv(T0))
+        return _translation(-center) @ M @ _translation(anchor)
+
+    def frame_offset(self, T, zoom, center):
+        """
+        How far the anchor is from the view center, in pixels at the view center: the
+        circles in view are placed to about float32 precision times this (infinite without
+        a frame)
+        """
+        if self.frame is None:
+            return np.inf
+        (a, b), (c, d) = self.transformation(T, center)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # the point of the frame at the view center, relative to the anchor
+            p = -b / a
+            offset = zoom * abs(p) / abs(c * p + d) ** 2
+        return offset if np.isfinite(offset) else np.inf
+
+    def draw(self, T, zoom, center, origin, viewport):
+        """
+        Draw the circles into the current framebuffer
+        :param T: transformation of the view, a 2x2 complex matrix
+        :param zoom: pixels per unit
+        :param center: complex, view center (after T)
+        :param origin: (x, y) position of the view center in pixels, from the top left corner
+        :param viewport: (width, height) in pixels
+        """
+        if not self.count:
+            return
+        S = self.transformation(T, center)
+        GL.glUseProgram(self.program)
+        GL.glUniform4fv(self.uniforms['S0'], 1, S[0].view(np.float64).astype(np.float32))
+        GL.glUniform4fv(self.uniforms['S1'], 1, S[1].view(np.float64).astype(np.float32))
+        GL.glUniform1f(self.uniforms['zoom'], zoom)
+        GL.glUniform2f(self.uniforms['origin'], origin[0], origin[1])
+        GL.glUniform2f(self.uniforms['viewport'], viewport[0], viewport[1])
+        GL.glUniform1f(self.uniforms['max_radius'], MAX_RADIUS)
+        GL.glUniform4fv(self.uniforms['pen'], len(STYLES), np.array([p for p, b in STYLES], dtype=np.float32))
+        GL.glUniform4fv(self.uniforms['brush'], len(STYLES), np.array([b for p, b in STYLES], dtype=np.float32))
+
+        GL.glEnable(GL.GL_BLEND)
+        # (the alpha of the framebuffer stays opaque where it was)
+        GL.glBlendFuncSeparate(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA, GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA)
+        GL.glBindVertexArray(self.vao)
+        GL.glDrawArraysInstanced(GL.GL_TRIANGLE_STRIP, 0, 4, self.count)
+        GL.glBindVertexArray(0)
+        GL.glUseProgram(0)
+
+    def delete(self):
+        GL.glDeleteBuffers(2, [self.quad, self.instances])
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteProgram(self.program)
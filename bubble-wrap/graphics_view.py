@@ -1,6 +1,7 @@
 # Installation command:
 # pip3 install PyOpenGL PyOpenGL_accelerate
 
+import os
 from math import sqrt, sin, cos
 
 import numpy as np
@@ -10,7 +11,12 @@ from PyQt5.QtOpenGL import *
 from PyQt5.QtWidgets import *
 import PyQt5.QtCore as QtCore
 
+import circle
+import frames
+import glcircles
 import mobius
+import openpacking
+import orbits
 import tools
 from widgets import *
 
@@ -21,6 +27,11 @@ class GLWidget(QGLWidget):
         super(GLWidget, self).__init__(QGLFormat(QGL.SampleBuffers), None)
 
         self.v_to_c = None
+        # segments of the dual graph (QLineF), and the (DCEL, circles, number of circles) they are for
+        self.dual_segments = []
+        self.dual_key = None
+        # (DCEL, vertex buffer, index buffer, number of indices) of the uploaded surface
+        self.surface = None
 
         self.display_params = {"zoom": 100, "pos": [0, 0], "start_pos": [0, 0]}
 
@@ -43,11 +54,18 @@ class GLWidget(QGLWidget):
         self.izoom = PlusWidget()
         self.ozoom = MinusWidget()
         self.dgraphTog = DualGraphToggleWidget()
+        # paint stage timings, shown in an info panel when enabled
+        self.timings = frames.PaintTimings()
+        self.infoPanel = InfoWidget()
 
         # set unified embedded circle packing holder
         self.uecp = self.delegate.uecp
 
     def paintEvent(self, event):
+        with self.timings.stage('frame'):
+            self.paintFrame()
+
+    def paintFrame(self):
         self.makeCurrent()
 
         GL.glMatrixMode(GL.GL_MODELVIEW)
@@ -69,26 +87,27 @@ class GLWidget(QGLWidget):
         GL.glRotate(self.rY, 0, 1, 0)
         GL.glRotate(self.rZ, 0, 0, 1)
 
-        if not self.pure_dual_graph and self.uecp.opened_metadata is not None and float(self.uecp.opened_metadata["schema_version"]) >= 0.2:
-            if self.uecp.opened_dcel is not None:
-                try:
-                    #GL.glColor4f(0.0, 0.0, 0.0, 0.2)
-                    self.qglColor(QColor(0,0,0, 50))
+        with self.timings.stage('surface'):
+            if not self.pure_dual_graph and self.uecp.opened_metadata is not None and float(self.uecp.opened_metadata["schema_version"]) >= 0.2:
+                if self.uecp.opened_dcel is not None:
+                    try:
+                        #GL.glColor4f(0.0, 0.0, 0.0, 0.2)
+                        self.qglColor(QColor(0,0,0, 50))
 
-                    GL.glPolygonMode(GL.GL_FRONT, GL.GL_FILL)
-                    GL.glPolygonMode(GL.GL_BACK, GL.GL_LINE)
-                    self.draw_shape(self.uecp.opened_dcel)
+                        GL.glPolygonMode(GL.GL_FRONT, GL.GL_FILL)
+                        GL.glPolygonMode(GL.GL_BACK, GL.GL_LINE)
+                        self.draw_shape(self.uecp.opened_dcel)
 
-                    #GL.glColor4f(0.0, 0.0, 0.0, 1)
-                    self.qglColor(QColor(0,0,0, 255))
+                        #GL.glColor4f(0.0, 0.0, 0.0, 1)
+                        self.qglColor(QColor(0,0,0, 255))
 
-                    GL.glPolygonMode(GL.GL_FRONT, GL.GL_LINE)
+                        GL.glPolygonMode(GL.GL_FRONT, GL.GL_LINE)
 
-                    self.draw_shape(self.uecp.opened_dcel)
-                except(Exception):
-                    pass # print(self.delegate.opened_dcel)
-        elif not self.pure_dual_graph:
-            print("Unable to display shape because there is no correct embedding in the opened file")
+                        self.draw_shape(self.uecp.opened_dcel)
+                    except(Exception):
+                        pass # print(self.delegate.opened_dcel)
+            elif not self.pure_dual_graph:
+                print("Unable to display shape because there is no correct embedding in the opened file")
 
 
         GL.glPolygonMode(GL.GL_FRONT, GL.GL_FILL)
@@ -102,25 +121,48 @@ class GLWidget(QGLWidget):
 
         qp.save()
         if self.pure_dual_graph:
-            self.drawDualGraph(qp)
-        self.drawWidgets(qp)
+            with self.timings.stage('dual graph'):
+                self.drawDualGraph(qp)
+        with self.timings.stage('widgets'):
+            self.drawWidgets(qp)
         qp.restore()
         GL.glFlush()
 
+    def upload_shape(self, D):
+        """Pack the surface of D into a vertex and an index buffer, replacing those of the last DCEL"""
+        if self.surface is not None:
+            GL.glDeleteBuffers(2, self.surface[1:3])
+            self.surface = None
+        coords, indices = surface_arrays(D)
+        vbo, ibo = GL.glGenBuffers(2)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, coords.nbytes, coords, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, ibo)
+        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+        self.surface = D, vbo, ibo, len(indices)
+
     def draw_shape(self, D):
-        GL.glBegin(GL.GL_TRIANGLES)
-        for face in D.F:
-            e0 = face.edge
-            GL.glVertex3f(e0.src.coordinates[0], e0.src.coordinates[1], e0.src.coordinates[2])
-            e_n = e0.next
-            while e_n is not e0:
-                GL.glVertex3f(e_n.src.coordinates[0], e_n.src.coordinates[1], e_n.src.coordinates[2])
-                e_n = e_n.next
-        GL.glEnd()
+        if self.surface is None or self.surface[0] is not D:
+            self.upload_shape(D)
+        D, vbo, ibo, count = self.surface
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, vbo)
+        GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glVertexPointer(3, GL.GL_FLOAT, 0, None)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, ibo)
+        GL.glDrawElements(GL.GL_TRIANGLES, count, GL.GL_UNSIGNED_INT, None)
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
         # needed for qpainter to draw dual graph correctly
         GL.glBegin(GL.GL_QUADS)
         GL.glEnd()
 
+    def scheduleUpdate(self):
+        """Repaint at the next frame of the frame scheduler"""
+        self.delegate.graphics.scheduler.request(self)
+
     def resizeGL(self, width, height):
         self.setupViewport(width, height)
 
@@ -141,25 +183,22 @@ class GLWidget(QGLWidget):
         zoom = self.display_params["zoom"]
         offset = self.display_params["pos"]
 
-        v_to_v_drawn = []
         if self.uecp.opened_dcel is not None:
-            self.v_to_c = parse_circles(self.uecp.pure_dual_graph_circles)
-            for edg in self.uecp.opened_dcel.UE:
-                v = edg.src
-                v2 = edg.next.src
-
-                if v not in self.v_to_c:
-                    continue
-                cir = self.v_to_c[v]
-                if v2 in self.v_to_c:
-                    cir2 = self.v_to_c[v2]
-                else:
-                    cir2 = None
-
-                if cir2 is not None and not cir.contains_infinity and not cir2.contains_infinity and (
-                v, v2) not in v_to_v_drawn and (v2, v) not in v_to_v_drawn:
-                    v_to_v_drawn.append((v, v2))
-                    draw_dual_graph_seg(cir, cir2, zoom, offset, self.center, qp, (0, 0))
+            # the segments only change with the circles (a new list, or more of them) or the DCEL;
+            # these are compared by identity, as comparing the circles would cost as much as a rebuild
+            D, circles = self.uecp.opened_dcel, self.uecp.pure_dual_graph_circles
+            key = self.dual_key
+            if key is None or key[0] is not D or key[1] is not circles or key[2] != len(circles):
+                self.v_to_c = parse_circles(circles)
+                self.dual_segments = segment_lines(dual_graph_segments(D, self.v_to_c))
+                self.dual_key = D, circles, len(circles)
+
+            qp.save()
+            qp.translate(self.center[0] + offset[0], self.center[1] + offset[1])
+            qp.scale(zoom, zoom)
+            qp.setPen(DUAL_GRAPH_PEN)
+            qp.drawLines(self.dual_segments)
+            qp.restore()
 
     def drawWidgets(self, qp):
         # Update widget positions and draw them
@@ -174,6 +213,11 @@ class GLWidget(QGLWidget):
         self.dgraphTog.setPos(self.width - 55, self.height - 55)
         self.dgraphTog.draw(qp)
 
+        if self.timings.enabled:
+            show_timings(self.infoPanel, self.timings)
+            self.infoPanel.setPos(0, self.height - self.infoPanel.height)
+            self.infoPanel.draw(qp)
+
     def mousePressEvent(self, mouse):
         if not self.pure_dual_graph:
             self.mouse_pos[0:1] = mouse.pos().x(), mouse.pos().y()
@@ -201,7 +245,7 @@ class GLWidget(QGLWidget):
                 d.calculations.animate_attributes(self.display_params, {"zoom": 100, "pos": [0, 0]})
 
         self.pure_dual_graph = self.dgraphTog.isActive(mouse)
-        self.repaint()
+        self.scheduleUpdate()
 
     def mouseReleaseEvent(self, mouse):
         if not self.pure_dual_graph:
@@ -212,7 +256,7 @@ class GLWidget(QGLWidget):
             self.ozoom.release()
             self.recenter.release()
 
-        self.repaint()
+        self.scheduleUpdate()
 
     def mouseMoveEvent(self, mouse):
         if not self.pure_dual_graph:
@@ -225,7 +269,7 @@ class GLWidget(QGLWidget):
         else:
             self.display_params["pos"][0] = self.display_params["start_pos"][0] + mouse.pos().x()
             self.display_params["pos"][1] = self.display_params["start_pos"][1] + mouse.pos().y()
-        self.repaint()
+        self.scheduleUpdate()
 
     def wheelEvent(self, event):
         wheel_point = event.angleDelta()/60
@@ -238,7 +282,7 @@ class GLWidget(QGLWidget):
             self.display_params["pos"][0] *= 1.2**wheel_point.y()
             self.display_params["pos"][1] *= 1.2**wheel_point.y()
 
-        self.repaint()
+        self.scheduleUpdate()
 
     @property
     def width(self):
@@ -252,8 +296,11 @@ class GLWidget(QGLWidget):
     def center(self):
         return self.width / 2, self.height / 2
 
-class CirclePackingView(QWidget):
-    draw_trigger = pyqtSignal()
+class PackingView:
+    """
+    The 2D view of the circle packing, without the widget: mixed into CirclePackingView
+    (drawn with QPainter) and GLCirclePackingView (circles drawn with OpenGL)
+    """
 
     def __init__(self, delegate, parent=None):
         super().__init__(parent)
@@ -277,22 +324,47 @@ class CirclePackingView(QWidget):
         self.ozoom = MinusWidget()
         self.infoPanel = InfoWidget()
         self.infoPanel.addInfo("Valences", "(work in progress)")
+        # the DCEL whose summary the info panel shows
+        self.info_dcel = None
+        # paint stage timings, added to the info panel when enabled
+        self.timings = frames.PaintTimings()
 
         self.lT = None
         self.force_update = True
 
+        # repaint now and then while an optimization runs, to show its progress
+        self.progress_timer = QtCore.QTimer(self)
+        self.progress_timer.setInterval(100)
+        self.progress_timer.timeout.connect(self.scheduleUpdate)
+
+        # circles taken from uecp.circle_stream (append-only), and the generation they belong to
+        self.stream_generation = None
+        self.streamed = tools.CircleStore()
+        # result holder of the running optimization thread, and how many streamed circles it covers
+        self.recull = [None]
+        self.recull_count = 0
+        # transformed circles, indexed by the last optimization thread (see tools.OptimizeCirclesThread)
+        self.circle_index = None
+
         # cached circle transformations
         self.m_circles = []
         self.v_to_c = None
+        # cached drawing of m_circles (see circlePaths), and segments of the dual graph
+        self.circle_paths = None
+        self.dual_segments = []
 
         self.mp = -1e10, -1e10
 
-        self.draw_trigger.connect(self.update)
+        self.draw_trigger.connect(self.scheduleUpdate)
 
         self.installEventFilter(self)
         self.setToolTipDuration(1500)
 
     def paintEvent(self, QPaintEvent):
+        with self.timings.stage('frame'):
+            self.paintFrame()
+
+    def paintFrame(self):
         # update sizes
         self.display_params["center"] = self.center
         self.display_params["width"] = self.width
@@ -303,30 +375,53 @@ class CirclePackingView(QWidget):
 
         qp.fillRect(QRect(0, 0, self.width, self.height), QColor(230, 230, 230, 255))
 
-        # Detect if circle packing optimization is needed
-        sameT = False
-        try:
-            if self.lT != self.uecp.packing_trans:
+        with self.timings.stage('cull'):
+            # take in the circles found since the last paint
+            self.consumeStream()
+
+            # Detect if circle packing optimization is needed
+            sameT = False
+            try:
+                if self.lT != self.uecp.packing_trans:
+                    self.force_update = True
+                else:
+                    sameT = True
+            except(Exception):
                 self.force_update = True
-            else:
-                sameT = True
-        except(Exception):
-            self.force_update = True
 
-        if self.force_update:
-            self.force_update = False
-            # If so, optimize circles
+            if self.force_update:
+                self.force_update = False
+                # If so, optimize circles
 
-            # cancel old thread
-            if self.optimize_thread is not None and self.optimize_thread.isRunning():
-                self.optimize_thread.cancel = True
+                # cancel old thread
+                if self.optimize_thread is not None and self.optimize_thread.isRunning():
+                    self.optimize_thread.cancel = True
 
-            # begin new optimization thread
-            self.optimize_thread = tools.OptimizeCirclesThread(self, self.uecp.circles, self.uecp.circles_optimize, self.uecp.packing_trans[0], self.display_params)
-            self.optimize_thread.start(priority=QThread.LowestPriority)
+                # begin new optimization thread, on the circles streamed so far
+                self.recull = [None]
+                self.recull_count = len(self.streamed)
+                self.optimize_thread = tools.OptimizeCirclesThread(self, self.streamed.snapshot(), self.recull,
+                                                                   self.uecp.packing_trans[0], self.display_params,
+                                                                   index=self.circle_index)
+                self.optimize_thread.start(priority=QThread.LowestPriority)
+                self.progress_timer.start()
 
-            # reset (dual graph)
-            self.v_to_c = None
+                # reset (dual graph)
+                self.v_to_c = None
+
+                self.requestDetail()
+
+            if self.recull[0] is not None:
+                # optimization done; add the circles that were streamed in meanwhile
+                self.uecp.circles_optimize[0] = self.recull[0] + tools.cull_circles(
+                    self.streamed[self.recull_count:], self.uecp.packing_trans[0], self.display_params)
+                self.recull[0] = None
+                self.circle_index = self.optimize_thread.index
+                self.m_circles = []
+                self.circle_paths = None
+
+            if self.progress_timer.isActive() and not self.optimize_thread.isRunning():
+                self.progress_timer.stop()
 
         # >>>                                             <<<
         # >>> ALL circles beyond this point are optimized <<<
@@ -335,93 +430,147 @@ class CirclePackingView(QWidget):
         # transform circles only if there is a transformation change
         T = mobius.make_sl2(self.uecp.packing_trans[0])
         if not sameT or len(self.m_circles) != len(self.uecp.circles_optimize[0]):
-            self.m_circles = []
-            for ci in self.uecp.circles_optimize[0]:
-                # print(ci[0])
-                self.m_circles.append((ci[0].transform_sl2(T), ci[1], ci[2]))
+            with self.timings.stage('transform'):
+                self.m_circles = tools.transform_circles(self.uecp.circles_optimize[0], T)
+            self.circle_paths = None
+            self.v_to_c = None
             self.lT = self.uecp.packing_trans.copy()
 
         # draw the circles
         self.drawCircles(qp)
 
         # draw dual graph
-        self.drawDualGraph(qp)
+        with self.timings.stage('dual graph'):
+            self.drawDualGraph(qp)
 
         # Update widget positions and draw them
-        self.drawWidgets(qp)
+        with self.timings.stage('widgets'):
+            self.drawWidgets(qp)
 
         qp.end()
 
-    def drawCircles(self, qp):
+    def scheduleUpdate(self):
+        """Repaint at the next frame of the frame scheduler"""
+        self.delegate.graphics.scheduler.request(self)
+
+    def requestDetail(self):
+        """
+        Ask the word search for smaller circles in view if the view now shows circles (of a
+        pixel across) much smaller than those computed; new circles arrive through the stream
+        """
         zoom = self.display_params["zoom"]
-        offset = self.display_params["pos"].copy()
+        pos = self.display_params["pos"]
+        T = mobius.make_sl2(self.uecp.packing_trans[0])
+        # point of the packing at the center of the view (before the transformation),
+        # and the scale factor of the transformation there
+        z = mobius.transform_point(mobius.sl2inv(T), complex(-pos[0] / zoom, -pos[1] / zoom))
+        scale = 1 / abs(T[1, 0] * z + T[1, 1]) ** 2
+        if 0 < scale < np.inf:
+            # the part of the packing in view (and its margin), and its area at that scale
+            xmin, xmax, ymin, ymax = tools.visible_rect(zoom, pos, self.display_params["center"],
+                                                        self.display_params["width"], self.display_params["height"])
+            region = orbits.view_region((xmin, xmax, ymin, ymax), T)
+            area = np.pi * ((xmax - xmin) ** 2 + (ymax - ymin) ** 2) / 4 / scale ** 2
+            openpacking.refine_word_search(self.delegate, orbits.pixel_radius(zoom) / scale, region,
+                                           None if region is None else area)
+
+    def consumeStream(self):
+        """
+        Cull and transform the batches of circles waiting in uecp.circle_stream, appending them
+        to the optimized circles; the circles already there are left alone
+        """
+        stream = self.uecp.circle_stream
+        if self.stream_generation != stream.generation:
+            # a new packing or search: drop the old circles
+            self.stream_generation = stream.generation
+            self.streamed = tools.CircleStore()
+            self.uecp.circles_optimize[0] = []
+            self.m_circles = []
+            self.circle_paths = None
+            self.v_to_c = None
+            # results of an optimization still running are for the old circles
+            self.recull = [None]
+            self.circle_index = None
 
-        for c in self.m_circles:
-            cir = c[0]
-            v = c[1]
-            # only draw circles with radius > 1
-            if not cir.contains_infinity and np.abs(zoom * cir.radius) > 1:
-                if v.valence > 6:
-                    qp.setPen(Qt.red)
-                    if cir.radius > 0:
-                        qp.setBrush(QColor(255, 0, 0, 100))
-                else:
-                    if cir.radius > 0:
-                        qp.setBrush(QColor(0, 0, 0, 50))
-                    qp.setPen(Qt.black)
-
-                qp.drawEllipse(self.center[0] + offset[0] + zoom * (cir.center.real - cir.radius),
-                               self.center[1] + offset[1] + zoom * (cir.center.imag - cir.radius),
-                               zoom * (cir.radius * 2), zoom * (cir.radius * 2))
-            elif cir.contains_infinity:
-                # create a straight line
-                x = self.center[0] + offset[0] + cir.line_base.real
-                y = self.center[1] + offset[1] + cir.line_base.imag
-                size = 3 * sqrt((offset[0] + cir.line_base.real) ** 2 + (offset[1] + cir.line_base.imag) ** 2)
-                scrSizeAvg = (self.width + self.height) / 2
-                size = scrSizeAvg if size < scrSizeAvg else size  # Makes sure the line will be long enough to fill the screen
-                # Draw the line out from the line_base in either direction
-                qp.drawLine(x - size * cos(cir.line_angle), y - size * sin(cir.line_angle),
-                            x + size * cos(cir.line_angle), y + size * sin(cir.line_angle))
-                print(x, y, ":", size)
-                print(cir.line_base, cir.line_angle)
-            qp.setBrush(QColor(0, 0, 0, 0))
+        T = mobius.make_sl2(self.uecp.packing_trans[0])
+        for generation, batch in stream.drain():
+            if generation != self.stream_generation:
+                continue
+            self.streamed.extend(batch)
+            culled = tools.cull_circles(batch, T, self.display_params)
+            self.uecp.circles_optimize[0].extend(culled)
+            if len(self.m_circles) + len(culled) == len(self.uecp.circles_optimize[0]):
+                # (drawn by extending the cached paths, see circlePaths)
+                self.m_circles.extend(tools.transform_circles(culled, T))
+            if any(ci[2] for ci in culled):
+                # reset (dual graph)
+                self.v_to_c = None
+
+    def circlePaths(self):
+        """
+        The circles of m_circles as QPainterPaths (see build_circle_paths), in packing
+        coordinates, and the lines among them; the circles appended to m_circles are added
+        to the cached paths, which are rebuilt only when m_circles is replaced
+        :return: (dict style -> dict size -> QPainterPath, list of (line, style))
+        """
+        cached = self.circle_paths
+        if cached is None or cached[0] is not self.m_circles:
+            # [circles, zoom when built, number of circles drawn, paths, lines]
+            paths, lines = build_circle_paths([], [])
+            cached = self.circle_paths = [self.m_circles, self.display_params["zoom"], 0, paths, lines]
+        n = cached[2]
+        if n < len(self.m_circles):
+            new = self.paintedCircles(self.m_circles[n:])
+            add_circle_paths(cached[3], cached[4], circle.CircleArray.from_circles(c[0] for c in new),
+                             [c[1].valence > 6 for c in new])
+            cached[2] = len(self.m_circles)
+        return cached[3], cached[4]
+
+    def paintedCircles(self, circles):
+        """Those of circles (items of m_circles) drawn with QPainter"""
+        return circles
+
+    def drawCircles(self, qp):
+        with self.timings.stage('paths'):
+            paths, lines = self.circlePaths()
+
+        with self.timings.stage('rasterize'):
+            self.drawPaths(qp, paths, lines)
+
+    def drawPaths(self, qp, paths, lines):
+        draw_circle_paths(qp, paths, lines, self.display_params["zoom"], self.display_params["pos"],
+                          (self.width, self.height))
 
     def drawDualGraph(self, qp):
         zoom = self.display_params["zoom"]
         offset = self.display_params["pos"].copy()
 
-        v_to_v_drawn = []
         if self.uecp.dual_graph and self.uecp.opened_dcel is not None:
             if self.v_to_c is None:
                 self.v_to_c = parse_circles(self.m_circles)
-            for edg in self.uecp.opened_dcel.UE:
-                v = edg.src
-                v2 = edg.next.src
-
-                if v not in self.v_to_c:
-                    continue
-                cir = self.v_to_c[v]
-                if v2 in self.v_to_c:
-                    cir2 = self.v_to_c[v2]
-                else:
-                    cir2 = None
+                # segments between centers of tangent circles, in packing coordinates
+                self.dual_segments = segment_lines(dual_graph_segments(self.uecp.opened_dcel, self.v_to_c))
 
-                if cir2 is not None and not cir.contains_infinity and not cir2.contains_infinity and (
-                v, v2) not in v_to_v_drawn and (v2, v) not in v_to_v_drawn:
-                    v_to_v_drawn.append((v, v2))
-                    draw_dual_graph_seg(cir, cir2, zoom, offset, self.center, qp, self.mp)
+            qp.save()
+            qp.translate(self.center[0] + offset[0], self.center[1] + offset[1])
+            qp.scale(zoom, zoom)
+            qp.setPen(DUAL_GRAPH_PEN)
+            qp.drawLines(self.dual_segments)
+            qp.restore()
 
     def drawWidgets(self, qp):
-        # update valence info
-        if self.uecp.opened_dcel is not None:
+        # update valence info (when the DCEL changes)
+        if self.info_dcel is not self.uecp.opened_dcel or self.info_dcel is None:
+            self.info_dcel = self.uecp.opened_dcel
             self.infoPanel.clearInfo()
-            valences = valence_dict(self.uecp.opened_dcel.V)
-            for k in valences:
-                self.infoPanel.addInfo("Valence %s" % k, "%s vertices" % valences[k])
-        else:
-            self.infoPanel.clearInfo()
-            self.infoPanel.addInfo("Status", "no packing visible")
+            if self.info_dcel is not None:
+                valences = self.info_dcel.stats['valences']
+                for k in valences:
+                    self.infoPanel.addInfo("Valence %s" % k, "%s vertices" % valences[k])
+            else:
+                self.infoPanel.addInfo("Status", "no packing visible")
+        if self.timings.enabled:
+            show_timings(self.infoPanel, self.timings)
 
         # Update widget positions and draw them
         self.izoom.setPos(self.width - 55, 30)
@@ -526,13 +675,13 @@ class CirclePackingView(QWidget):
         zoom = self.display_params["zoom"]
 
         if self.uecp.mobius_trans_mode and not (self.fixed_points["fp1_move"] or self.fixed_points["fp2_move"]):
-            # Find each fixed point under the mapping of the current mobius transformation
-            fixed_point1 = mobius.transform_point(mobius.sl2inv(self.mobius_history["current"]),
-                                                  complex(-pos_x / zoom, -pos_y / zoom) + self.fixed_points["fixed_point1"] / zoom)
-            fixed_point2 = mobius.transform_point(mobius.sl2inv(self.mobius_history["current"]),
-                                                  complex(-pos_x / zoom, -pos_y / zoom) + self.fixed_points["fixed_point2"] / zoom)
-            mouse_point = mobius.transform_point(mobius.sl2inv(self.mobius_history["current"]), complex((mouse.pos().x() - self.center[0] - pos_x) / self.display_params["zoom"],
-                                  (mouse.pos().y() - self.center[1] - pos_y) / self.display_params["zoom"]))
+            # Find each fixed point (and the mouse) under the mapping of the current mobius transformation
+            fixed_point1, fixed_point2, mouse_point = mobius.transform_point(
+                mobius.sl2inv(self.mobius_history["current"]),
+                np.array((complex(-pos_x / zoom, -pos_y / zoom) + self.fixed_points["fixed_point1"] / zoom,
+                          complex(-pos_x / zoom, -pos_y / zoom) + self.fixed_points["fixed_point2"] / zoom,
+                          complex((mouse.pos().x() - self.center[0] - pos_x) / zoom,
+                                  (mouse.pos().y() - self.center[1] - pos_y) / zoom))))
 
             # Then apply a three to three calculation
             if self.fixed_points["fp1"] is not None:
@@ -553,7 +702,7 @@ class CirclePackingView(QWidget):
             # move packing around with cursor
             self.display_params["pos"][0] = self.display_params["start_pos"][0] + mouse.pos().x()
             self.display_params["pos"][1] = self.display_params["start_pos"][1] + mouse.pos().y()
-        self.update()
+        self.scheduleUpdate()
 
     def wheelEvent(self, event):
         # zoom in and out of the packing
@@ -565,7 +714,7 @@ class CirclePackingView(QWidget):
         self.display_params["pos"][1] *= 1.2**wheel_point.y()
 
         self.force_update = True
-        self.update()
+        self.scheduleUpdate()
 
     def eventFilter(self, object, event):
         if event.type() == QtCore.QEvent.ToolTip:
@@ -603,6 +752,232 @@ class CirclePackingView(QWidget):
     def center(self):
         return self.width / 2, self.height / 2
 
+class CirclePackingView(PackingView, QWidget):
+    draw_trigger = pyqtSignal()
+
+class GLCirclePackingView(PackingView, QOpenGLWidget):
+    """
+    Packing view drawing the circles with OpenGL (see glcircles): the streamed circles are
+    uploaded as they arrive, and the view and its transformation are passed to the shaders.
+    Lines and circles too large for the renderer, the dual graph and the widgets are still
+    drawn with QPainter, on top.  Needs OpenGL 3.3.
+    """
+    draw_trigger = pyqtSignal()
+
+    def __init__(self, delegate, parent=None):
+        super().__init__(delegate, parent)
+        fmt = QSurfaceFormat()
+        fmt.setVersion(3, 3)
+        fmt.setProfile(QSurfaceFormat.CompatibilityProfile)
+        fmt.setSamples(4)
+        self.setFormat(fmt)
+
+        self.renderer = None
+        # CircleStore whose circles the renderer has
+        self.rendered = None
+        # (CircleStore, style ids of its circles so far)
+        self.styles = None, np.zeros(0)
+
+    # QOpenGLWidget paints in paintGL, with its framebuffer bound
+    paintEvent = QOpenGLWidget.paintEvent
+
+    def initializeGL(self):
+        self.renderer = glcircles.CircleRenderer()
+        self.rendered = None
+        self.context().aboutToBeDestroyed.connect(self.cleanupGL)
+
+    def cleanupGL(self):
+        self.makeCurrent()
+        self.renderer.delete()
+        self.renderer = None
+        self.doneCurrent()
+
+    def paintGL(self):
+        PackingView.paintEvent(self, None)
+
+    def resizeEvent(self, event):
+        PackingView.resizeEvent(self, event)
+        QOpenGLWidget.resizeEvent(self, event)
+
+    def circleStyles(self):
+        """Style ids (see glcircles.STYLES) of the streamed circles, computed once per circle"""
+        store, styles = self.styles
+        if store is not self.streamed:
+            store, styles = self.streamed, np.zeros(0)
+        if len(styles) < len(store):
+            new = [c[1].valence > 6 for c in store[len(styles):len(store)]]
+            styles = np.concatenate((styles, new))
+        self.styles = store, styles
+        return styles
+
+    def circlePaths(self):
+        # which circles are left to QPainter depends on the zoom
+        if self.circle_paths is not None and self.circle_paths[1] != self.display_params["zoom"]:
+            self.circle_paths = None
+        return super().circlePaths()
+
+    def paintedCircles(self, circles):
+        # the renderer draws the other circles; only lines and circles too large for it are
+        # left to QPainter
+        zoom = self.display_params["zoom"]
+        return [c for c in circles if c[0].contains_infinity or abs(zoom * c[0].radius) > glcircles.MAX_RADIUS]
+
+    def drawCircles(self, qp):
+        zoom = self.display_params["zoom"]
+        offset = self.display_params["pos"]
+        T = self.uecp.packing_trans[0]
+        # the view center, after the transformation
+        center = complex(-offset[0], -offset[1]) / zoom
+        renderer = self.renderer
+
+        # upload the circles streamed in since the last frame; all of them only for new
+        # circles, or when the view is too far from the frame of the uploaded ones
+        with self.timings.stage('upload'):
+            if (self.rendered is not self.streamed
+                    or renderer.frame_offset(T, zoom, center) > glcircles.MAX_FRAME_OFFSET):
+                renderer.set_frame(T, center)
+                self.rendered = self.streamed
+            if renderer.count < len(self.streamed):
+                renderer.append(self.streamed.matrices()[renderer.count:],
+                                self.circleStyles()[renderer.count:])
+
+        with self.timings.stage('gl circles'):
+            qp.beginNativePainting()
+            renderer.draw(T, zoom, center, self.center, (self.width, self.height))
+            qp.endNativePainting()
+
+        super().drawCircles(qp)
+
+        # circles that are lines in the frame of the renderer, but not in the view
+        if len(renderer.lines) and not np.array_equal(mobius.make_sl2(T), renderer.frame[0]):
+            cs = self.streamed.matrices()[renderer.lines].transform_sl2(mobius.make_sl2(T))
+            keep = ~cs.contains_infinity
+            keep[keep] = np.abs(zoom * cs.radius[keep]) <= glcircles.MAX_RADIUS
+            red = self.circleStyles()[renderer.lines][keep] > 0
+            paths, lines = build_circle_paths(cs[keep], red.tolist())
+            self.drawPaths(qp, paths, lines)
+
+def surface_arrays(D):
+    """
+    Vertex coordinates and triangles of an embedded DCEL, for glDrawElements (faces with
+    more than three edges are split into fans)
+    :param D: DCEL whose vertices have coordinates
+    :return: (float32 array of shape (N, 3), uint32 array of 3 vertex indices per triangle)
+    """
+    index = {v: k for k, v in enumerate(D.V)}
+    coords = np.array([np.ravel(v.coordinates) for v in D.V], dtype=np.float32).reshape((-1, 3))
+    triangles = []
+    for face in D.F:
+        e0 = face.edge
+        first, prev = index[e0.src], index[e0.next.src]
+        e_n = e0.next.next
+        while e_n is not e0:
+            k = index[e_n.src]
+            triangles.append((first, prev, k))
+            prev = k
+            e_n = e_n.next
+    return coords, np.array(triangles, dtype=np.uint32).reshape(-1)
+
+def show_timings(panel, timings):
+    """Add (or update) a line per paint stage of timings to an InfoWidget"""
+    for stage, text in timings.summary():
+        if stage in panel.info_panels:
+            panel.updateInfo(stage, text)
+        else:
+            panel.addInfo(stage, text)
+
+def _cosmetic_pen(color):
+    """Pen one pixel wide at any scale of the painter"""
+    pen = QPen(color)
+    pen.setWidth(0)
+    pen.setCosmetic(True)
+    return pen
+
+# (valence > 6, positive radius) -> (pen, brush) of circles; circles of negative
+# radius (the outside of a disk) are not filled
+CIRCLE_STYLES = {
+    (False, True): (_cosmetic_pen(Qt.black), QBrush(QColor(0, 0, 0, 50))),
+    (False, False): (_cosmetic_pen(Qt.black), QBrush(Qt.NoBrush)),
+    (True, True): (_cosmetic_pen(Qt.red), QBrush(QColor(255, 0, 0, 100))),
+    (True, False): (_cosmetic_pen(Qt.red), QBrush(Qt.NoBrush)),
+}
+
+DUAL_GRAPH_PEN = _cosmetic_pen(Qt.blue)
+
+def build_circle_paths(circles, red):
+    """
+    The circles as QPainterPaths in packing coordinates, one per style (see CIRCLE_STYLES)
+    and size: the circles of size k have radii in [2**(k-1), 2**k), so that those too small
+    to draw at a zoom are left out as whole paths (see draw_circle_paths); and the lines
+    among the circles
+    :param circles: circle.CircleArray, after the transformation of the view
+    :param red: whether each circle is drawn in red (its vertex has valence > 6)
+    :return: (dict style -> dict size -> QPainterPath, list of (line, style))
+    """
+    # (styles in the order of CIRCLE_STYLES, which is the drawing order)
+    paths = {style: {} for style in CIRCLE_STYLES}
+    lines = []
+    add_circle_paths(paths, lines, circles, red)
+    return paths, lines
+
+def add_circle_paths(paths, lines, circles, red):
+    """Add circles to the paths and lines of build_circle_paths() (same parameters)"""
+    if len(circles):
+        inf = circles.contains_infinity
+        center = np.where(inf, 0, circles.center)
+        radius = np.where(inf, 0, circles.radius)
+        size = np.frexp(radius)[1]
+        for i, (rd, line, z, r, k) in enumerate(zip(red, inf.tolist(), center.tolist(), radius.tolist(),
+                                                     size.tolist())):
+            if line:
+                lines.append((circles[i], (rd, False)))
+                continue
+            sized = paths[(rd, r > 0)]
+            if k not in sized:
+                sized[k] = QPainterPath()
+                sized[k].setFillRule(Qt.WindingFill)
+            ar = abs(r)
+            sized[k].addEllipse(QRectF(z.real - ar, z.imag - ar, 2 * ar, 2 * ar))
+
+def line_segment(line, offset, size):
+    """
+    Segment of a line (a circle through infinity) long enough to cross a view
+    :param offset: position of 0 relative to the center of the view, in pixels
+    :param size: (width, height) of the view
+    :return: QLineF
+    """
+    x = size[0] / 2 + offset[0] + line.line_base.real
+    y = size[1] / 2 + offset[1] + line.line_base.imag
+    length = 3 * sqrt((offset[0] + line.line_base.real) ** 2 + (offset[1] + line.line_base.imag) ** 2)
+    # make sure the line is long enough to fill the view
+    length = max(length, (size[0] + size[1]) / 2)
+    # out from the line_base in either direction
+    return QLineF(x - length * cos(line.line_angle), y - length * sin(line.line_angle),
+                  x + length * cos(line.line_angle), y + length * sin(line.line_angle))
+
+def draw_circle_paths(qp, paths, lines, zoom, offset, size):
+    """
+    Draw the paths and lines of build_circle_paths()
+    :param offset: position of 0 relative to the center of the view, in pixels
+    :param size: (width, height) of the view
+    """
+    qp.save()
+    qp.translate(size[0] / 2 + offset[0], size[1] / 2 + offset[1])
+    qp.scale(zoom, zoom)
+    for style, sized in paths.items():
+        qp.setPen(CIRCLE_STYLES[style][0])
+        qp.setBrush(CIRCLE_STYLES[style][1])
+        for k, path in sized.items():
+            # leave out the sizes whose circles are all less than a pixel in radius
+            if zoom * 2.0 ** k > 1:
+                qp.drawPath(path)
+    qp.restore()
+
+    for line, style in lines:
+        qp.setPen(CIRCLE_STYLES[style][0])
+        qp.drawLine(line_segment(line, offset, size))
+    qp.setBrush(QColor(0, 0, 0, 0))
+
 def parse_circles(circles):
     """
     Used for Dual Graph
@@ -616,26 +991,35 @@ def parse_circles(circles):
 
     return v_to_c
 
-def draw_dual_graph_seg(cir, cir2, zoom, offset, center, qp, mp):
-    if (cir.center.real - cir2.center.real) ** 2 + (cir.center.imag - cir2.center.imag) ** 2 <= (cir.radius + cir2.radius + 0.01) ** 2:
-
-        ax, ay, bx, by, mx, my = center[0] + offset[0] + zoom * cir.center.real, center[1] + offset[1] + zoom * cir.center.imag, \
-                                 center[0] + offset[0] + zoom * cir2.center.real, center[1] + offset[1] + zoom * cir2.center.imag, mp[0] + center[0], mp[1] + \
-                                 center[1]
-        qp.setPen(Qt.blue)
-        qp.drawLine(ax, ay, bx, by)
-
-def valence_dict(verts):
+def dual_graph_segments(D, v_to_c):
     """
-    Finds the valences of the vertices supplied
-    :param verts:
-    :return: a dict of valences with their count
+    Edges of the dual graph: segments between the centers of the circles of adjacent vertices
+    that are (nearly) tangent; edges to lines are left out
+    :param D: the DCEL
+    :param v_to_c: dict vertex -> circle (see parse_circles)
+    :return: array of shape (N, 4) of the endpoints x1, y1, x2, y2
     """
-    from collections import defaultdict
-    verts_of_valence = defaultdict(int)
-    for v in verts:
-        verts_of_valence[v.valence] += 1
-    return dict(verts_of_valence)
+    pairs = set()
+    for edg in D.UE:
+        v = edg.src
+        v2 = edg.next.src
+        if v in v_to_c and v2 in v_to_c and (v2, v) not in pairs:
+            pairs.add((v, v2))
+    if not pairs:
+        return np.zeros((0, 4))
+
+    cs = circle.CircleArray.from_circles(v_to_c[v] for pair in pairs for v in pair)
+    with np.errstate(invalid='ignore'):
+        centers = cs.center.reshape((-1, 2))
+        radii = cs.radius.reshape((-1, 2))
+        keep = ~cs.contains_infinity.reshape((-1, 2)).any(axis=1)
+        keep &= np.abs(centers[:, 0] - centers[:, 1]) ** 2 <= (radii.sum(axis=1) + 0.01) ** 2
+    centers = centers[keep]
+    return np.column_stack((centers.real[:, 0], centers.imag[:, 0], centers.real[:, 1], centers.imag[:, 1]))
+
+def segment_lines(segments):
+    """QLineF for each row x1, y1, x2, y2 of segments"""
+    return [QLineF(*s) for s in segments.tolist()]
 
 class ControlGraphics:
     """
@@ -644,10 +1028,16 @@ class ControlGraphics:
 
     def __init__(self, delegate):
         self.delegate = delegate
+        # all repaints go through the scheduler (see frames)
+        self.scheduler = frames.FrameScheduler(self.delegate)
 
         self.delegate.opengl = GLWidget(self.delegate)
         self.delegate.opengl.setContentsMargins(0, 0, 0, 0)
-        self.delegate.scene2 = CirclePackingView(self.delegate)
+        # set $BUBBLE_WRAP_OPENGL to draw the packing with OpenGL
+        if os.environ.get('BUBBLE_WRAP_OPENGL'):
+            self.delegate.scene2 = GLCirclePackingView(self.delegate)
+        else:
+            self.delegate.scene2 = CirclePackingView(self.delegate)
         self.delegate.scene2.setContentsMargins(0, 0, 0, 0)
 
         self.delegate.gv2.addWidget(self.delegate.scene2)
@@ -656,10 +1046,29 @@ class ControlGraphics:
     def force_update(self):
         self.delegate.scene2.force_update = True
 
+    def views(self):
+        return self.delegate.opengl, self.delegate.scene2
+
+    def set_instrumented(self, on):
+        """Turn the timing of paint stages (shown in the info panels) on or off"""
+        for view in self.views():
+            view.timings.enabled = on
+            view.timings.clear()
+            view.infoPanel.clearInfo()
+        # rebuild the packing view's info panel without the timings
+        self.delegate.scene2.info_dcel = None
+        self.draw()
+
+    def save_timings(self, fn):
+        """Write the paint stage timings of the views, and the frame times of the scheduler, to a JSON file"""
+        frames.dump_timings(fn, {'surface view': self.delegate.opengl.timings,
+                                 'packing view': self.delegate.scene2.timings,
+                                 'scheduler': self.scheduler.timings()})
+
     def draw(self, view=-1):
         if view == -1 or view == 0:
-            self.delegate.opengl.update()
+            self.scheduler.request(self.delegate.opengl)
 
         if view == -1 or view == 1:
-            self.delegate.scene2.update()
+            self.scheduler.request(self.delegate.scene2)
 
@@ -52,7 +52,7 @@ class Form(QMainWindow):
 
     def setup_actions(self):
         """
-        Setup `File` actions
+        Setup `File` and `View` actions
         """
         exitAction = QAction('&Exit', self)
         exitAction.setShortcut('Ctrl+Q')
@@ -69,6 +69,15 @@ class Form(QMainWindow):
         newAction.setStatusTip('Create a New Object')
         newAction.triggered.connect(self.createNew)
 
+        timingsAction = QAction('Frame &Timings', self)
+        timingsAction.setCheckable(True)
+        timingsAction.setStatusTip('Time the stages of each paint and show them in the info panels')
+        timingsAction.toggled.connect(self.toggleTimings)
+
+        saveTimingsAction = QAction('&Save Frame Timings...', self)
+        saveTimingsAction.setStatusTip('Save the recent paint stage timings to a JSON file')
+        saveTimingsAction.triggered.connect(self.saveTimings)
+
         menu_bar = self.menuBar()
         menu_bar.setNativeMenuBar(False)
         file_menu = menu_bar.addMenu('&File')
@@ -77,11 +86,23 @@ class Form(QMainWindow):
         file_menu.addAction(openAction)
         file_menu.addAction(exitAction)
 
+        view_menu = menu_bar.addMenu('&View')
+        view_menu.addAction(timingsAction)
+        view_menu.addAction(saveTimingsAction)
+
     # >>> Action Methods <<<
 
     def openNew(self):
         openPacking(self, self.mainWidget, lambda: self.mainWidget.graphics.draw())
 
+    def toggleTimings(self, on):
+        self.mainWidget.graphics.set_instrumented(on)
+
+    def saveTimings(self):
+        fn, _ = QFileDialog.getSaveFileName(self, 'Save Frame Timings', 'timings.json', 'JSON (*.json)')
+        if fn:
+            self.mainWidget.graphics.save_timings(fn)
+
     def createNew(self):
         uecp = self.mainWidget.uecp
         surfaces = ("Cylinder", "Torus", "Genus 2 Surface")
@@ -1,35 +1,63 @@
 """Utility functions related to mobius transformations"""
 
+import cmath
+
 import numpy as np
 
-def sl2inv(m):
-    return np.array( [[ m[1,1], -m[0,1] ],
-                      [ -m[1,0], m[0,0] ]] )
+# The functions below accept a single 2x2 matrix or an (...,2,2) stack of
+# them (and points or arrays of points), broadcasting over the leading
+# axes.  Those returning one array take an optional out= array to write
+# the result to, which may be the input itself.
+
+def _result(x):
+    """Unwrap 0-d arrays, so that scalar arguments give scalar results"""
+    return x[()] if isinstance(x, np.ndarray) and x.ndim == 0 else x
+
+def det2(m):
+    """Determinant of a 2x2 matrix, or of each matrix of a stack"""
+    m = np.asarray(m)
+    return _result(m[...,0,0]*m[...,1,1] - m[...,0,1]*m[...,1,0])
+
+def sl2inv(m, out=None):
+    """Inverse of an element of SL(2,C) (the adjugate matrix)"""
+    m = np.asarray(m)
+    if out is None:
+        out = np.empty_like(m)
+    a = m[...,0,0].copy()
+    out[...,0,0] = m[...,1,1]
+    out[...,1,1] = a
+    np.negative(m[...,0,1], out=out[...,0,1])
+    np.negative(m[...,1,0], out=out[...,1,0])
+    return out
 
-def make_sl2(m):
-    return np.array(m)/np.sqrt(np.linalg.det(m))
+def make_sl2(m, out=None):
+    """Scale a matrix (or each matrix of a stack) to have determinant 1"""
+    m = np.asarray(m)
+    return np.divide(m, np.sqrt(det2(m))[...,None,None], out=out)
 
-def chi(z1,z2,z3,z4):
-    return (z1-z3)*(z2-z4)/((z1-z4)*(z2-z3))
+def chi(z1,z2,z3,z4,out=None):
+    return np.divide((z1-z3)*(z2-z4), (z1-z4)*(z2-z3), out=out)
 
-def center_four_points(pa,pb,qa,qb):
+def center_four_points(pa,pb,qa,qb,out=None):
     w = chi(pa,pb,qa,qb)
     z = (2 + 2*np.sqrt(1 - w) - w)/w
-    if abs(z) < 1.0:
-        z = 1/z
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(np.abs(z) < 1.0, 1/z, z)
     a = -pa + qa - (pa - 2*pb + qa)*z
     b = -pb*qa*(1 + z) + pa*(pb - pb*z + 2*qa*z)
     c = 2*pb + qa*(-1 + z) - pa*(1 + z)
     d = pa*(2*qa + pb*(-1 + z)) - pb*qa*(1 + z)
-    return make_sl2([[a,b],[c,d]])
+    return make_sl2(np.stack((np.stack((a,b),axis=-1), np.stack((c,d),axis=-1)),axis=-2), out=out)
 
 def fix(m):
-    a = m[0,0]
-    b = m[0,1]
-    c = m[1,0]
-    d = m[1,1]
+    """Fixed points of a mobius transformation (or of each one of a stack)"""
+    m = np.asarray(m)
+    a = m[...,0,0]
+    b = m[...,0,1]
+    c = m[...,1,0]
+    d = m[...,1,1]
     disc = 4*b*c + (a-d)**2
-    return ((a-d) - np.sqrt(disc))/(2*c), ((a-d) + np.sqrt(disc))/(2*c)
+    return _result(((a-d) - np.sqrt(disc))/(2*c)), _result(((a-d) + np.sqrt(disc))/(2*c))
 
 def center_two_hyperbolics(A,B,configuration='X'):
     fa = fix(A)
@@ -41,35 +69,67 @@ def center_two_hyperbolics(A,B,configuration='X'):
     else:
         raise ValueError('Unknown configuraiton "%s"; known types are "X" and "II".' % configuration)
 
-def sl2_rho(m):
+def sl2_rho(m, out=None):
     """Spectral radius of element of SL(2,C)"""
-    t = np.trace(m)
+    m = np.asarray(m)
+    t = m[...,0,0] + m[...,1,1]
     d = np.sqrt(t*t - 4.0)
-    rho = abs(0.5*(t+d))
-    if rho < 1.0:
-        rho = 1 / rho
-    return rho
+    rho = np.asarray(np.abs(0.5*(t+d), out=out))
+    np.divide(1, rho, out=rho, where=rho < 1.0)
+    return _result(rho)
 
-def three_point_sl2(p1, p2, p3, q1, q2, q3):
-    """Transformation from p1 -> q1, p2 -> q2, p3 -> q3"""
-    a = np.linalg.det(np.array(((p1 * q1, q1, 1),
-                                (p2 * q2, q2, 1),
-                                (p3 * q3, q3, 1))))
+_SCALAR_TYPES = (int, float, complex, np.number)
 
-    b = np.linalg.det(np.array(((p1 * q1, p1, q1),
-                                (p2 * q2, p2, q2),
-                                (p3 * q3, p3, q3))))
+def _zero_one_infinity(z1, z2, z3):
+    """Entries (a, b, c, d) of zero_one_infinity() for complex numbers"""
+    if cmath.isinf(z1):
+        return 0, z2 - z3, 1, -z3
+    if cmath.isinf(z2):
+        return 1, -z1, 1, -z3
+    if cmath.isinf(z3):
+        return 1, -z1, 0, z2 - z1
+    return z2 - z3, -z1*(z2 - z3), z2 - z1, -z3*(z2 - z1)
 
-    c = np.linalg.det(np.array(((p1, q1, 1),
-                                (p2, q2, 1),
-                                (p3, q3, 1))))
+def zero_one_infinity(z1, z2, z3):
+    """
+    Matrix (not normalized) of the map (z-z1)(z2-z3)/((z-z3)(z2-z1)) taking z1, z2, z3 to 0, 1, infinity,
+    or a stack of them for arrays of points; one of the points may be infinite (np.inf)
+    """
+    if np.ndim(z1) == np.ndim(z2) == np.ndim(z3) == 0:
+        a, b, c, d = _zero_one_infinity(complex(z1), complex(z2), complex(z3))
+        return np.array(((a, b), (c, d)), dtype='complex')
 
-    d = np.linalg.det(np.array(((p1 * q1, p1, 1),
-                                (p2 * q2, p2, 1),
-                                (p3 * q3, p3, 1))))
+    z1, z2, z3 = np.broadcast_arrays(*(np.asarray(z, dtype='complex') for z in (z1, z2, z3)))
+    i1, i2, i3 = np.isinf(z1), np.isinf(z2), np.isinf(z3)
+    # infinite points are replaced by 0 and handled by the cases below
+    z1, z2, z3 = np.where(i1, 0, z1), np.where(i2, 0, z2), np.where(i3, 0, z3)
+    cases = (i1, i2, i3)
+    m = np.empty(z1.shape + (2, 2), dtype='complex')
+    m[...,0,0] = np.select(cases, (0, 1, 1), z2 - z3)
+    m[...,0,1] = np.select(cases, (z2 - z3, -z1, -z1), -z1*(z2 - z3))
+    m[...,1,0] = np.select(cases, (1, 1, 0), z2 - z1)
+    m[...,1,1] = np.select(cases, (-z3, -z3, z2 - z1), -z3*(z2 - z1))
+    return m
 
-    return make_sl2([[a, b], [c, d]])
+def three_point_sl2(p1, p2, p3, q1, q2, q3, out=None):
+    """
+    Transformation from p1 -> q1, p2 -> q2, p3 -> q3, or a stack of them for arrays of points;
+    the composition of the maps taking p1, p2, p3 and q1, q2, q3 to 0, 1, infinity
+    (which therefore preserves cross ratios).  Points may be infinite (np.inf).
+    """
+    points = (p1, p2, p3, q1, q2, q3)
+    if out is None and all(isinstance(z, _SCALAR_TYPES) for z in points):
+        # a single transformation, as cheaply as possible (e.g. for each mouse move)
+        a, b, c, d = _zero_one_infinity(*(complex(z) for z in points[:3]))
+        e, f, g, h = _zero_one_infinity(*(complex(z) for z in points[3:]))
+        # adjugate of the second map, times the first
+        m = (h*a - f*c, h*b - f*d, e*c - g*a, e*d - g*b)
+        s = cmath.sqrt(m[0]*m[3] - m[1]*m[2])
+        return np.array(((m[0]/s, m[1]/s), (m[2]/s, m[3]/s)))
+    return make_sl2(np.matmul(sl2inv(zero_one_infinity(q1, q2, q3)), zero_one_infinity(p1, p2, p3)), out=out)
 
 
-def transform_point(T, p):
-    return (T[0][0]*p + T[0][1]) / (T[1][0]*p + T[1][1])
\ No newline at end of file
+def transform_point(T, p, out=None):
+    """Image of a point (or array of points) under T, a matrix or a stack broadcasting against the points"""
+    T = np.asarray(T)
+    return _result(np.divide(T[...,0,0]*p + T[...,0,1], T[...,1,0]*p + T[...,1,1], out=out))
\ No newline at end of file
@@ -3,16 +3,24 @@ Open a Circle Packing from a *.cpz file
 """
 
 import bz2
-from collections import OrderedDict
+from collections.abc import Mapping
 
 import circle
+import circlecache
 import cocycles
 import dcel
+import orbits
 import serialization as ser
 from tools import *
 
 import assets
 
+# Relators of the surface group presentations used for the holonomy
+# representations below (see data/words/README); upper case letters
+# are inverses.  In genus 2, k = [a1,b1] is an extra generator.
+GENUS2_RELATORS = ('KabAB', 'kcdCD')
+GENUS1_RELATORS = ('abAB',)
+
 def openPacking(parent, delegate, ondone):
     """
     Open a circle packing with genus 1 or 2
@@ -23,23 +31,24 @@ def openPacking(parent, delegate, ondone):
     # set unified embedded circle packing holder
     uecp = delegate.uecp
 
-    file = QFileDialog.getOpenFileName(parent=parent, initialFilter="CPZ (*.cpz)")
+    file = QFileDialog.getOpenFileName(parent=parent, filter="Circle packings (*.cpz *.cpj *.cpb)")
     if file[0] is None or len(file[0]) < 5:
         return
     print(len(file[0]))
     print("Open a new file: %s" % str(file[0]))
     try:
-        meta, D, chains, P = ser.zloadfn(file[0], cls=cocycles.InterstitialDCEL)
+        # (the packings of a CPB file are memory-mapped, and read as they are selected)
+        meta, D, chains, P = ser.zloadfn(file[0], cls=cocycles.InterstitialDCEL, lazy=True)
     except(Exception):
-        print("Unable to open file.  Is the file a *.cpz?")
+        print("Unable to open file.  Is the file a *.cpz, *.cpj or *.cpb?")
         return
 
-    odict = ordered_packing_list(P)
+    keys = ordered_packing_keys(P)
 
     # displays a drop down menu with all available circle packings
-    mkey = showDropdownDialog(parent, odict, "Select a Packing")
+    mkey = showDropdownDialog(parent, keys, "Select a Packing")
 
-    model = standardModelFromDict(parent, odict)
+    model = standardModelFromDict(parent, keys)
     delegate.select_packing_dropdown.setModel(model)
 
     uecp.opened_metadata = meta
@@ -47,31 +56,29 @@ def openPacking(parent, delegate, ondone):
     uecp.all_packings = P
     uecp.chains = chains
 
-    find_simplest_packing_for_pure_dual_graph(delegate, odict)
+    find_simplest_packing_for_pure_dual_graph(delegate, keys)
 
     from_select_packing(parent, delegate, mkey, ondone)
 
-def find_simplest_packing_for_pure_dual_graph(delegate, odict):
+def find_simplest_packing_for_pure_dual_graph(delegate, keys):
     uecp = delegate.uecp
     closest_xratio = None
     closest_id = None
-    for key in odict:
-        xratio2_sum = 0
-        for xratio in list(odict[key]):
-            xratio2_sum += (xratio-1.7320508)**2
-        xratio2_avg = xratio2_sum / len(list(odict[key]))
+    for key in keys:
+        xratio2_avg = np.mean((np.asarray(packing_by_key(uecp.all_packings, key)) - 1.7320508) ** 2)
         if closest_xratio is None or closest_xratio > xratio2_avg:
             closest_xratio = xratio2_avg
             closest_id = key
 
     # start building fundamental domain
-    X0 = odict[closest_id]
+    X0 = packing_by_key(uecp.all_packings, closest_id)
 
     # SOLVE
-    if dcel.oriented_manifold_type(uecp.opened_dcel)['genus'] == 2:
+    genus = uecp.opened_dcel.stats['topology']['genus']
+    if genus == 2:
         # genus 2
         pure_fund_domain_genus2(delegate, uecp.opened_dcel, uecp.chains, X0)
-    elif dcel.oriented_manifold_type(uecp.opened_dcel)['genus'] == 1:
+    elif genus == 1:
         # genus 1 (torus)
         pure_fund_domain_genus1(delegate, uecp.opened_dcel, uecp.chains, X0)
 
@@ -83,44 +90,56 @@ def from_select_packing(parent, delegate, mkey, ondone):
     # set unified embedded circle packing holder
     uecp = delegate.uecp
 
-    pared_wordlist = {x.strip() for x in bz2.open(assets.wordfile, 'rt')}
-
-    odict = ordered_packing_list(uecp.all_packings)
+    keys = ordered_packing_keys(uecp.all_packings)
 
     if isinstance(mkey, int) and mkey == -1:
         return
-    elif isinstance(uecp.all_packings, dict):
-        X0 = uecp.all_packings[str(list(odict.keys())[mkey])]
+    elif isinstance(uecp.all_packings, Mapping):
+        packing = str(keys[mkey])
+        X0 = uecp.all_packings[packing]
     else:
+        packing = mkey
         X0 = uecp.all_packings[mkey]
 
     print(X0)
 
     # SOLVE
-    if dcel.oriented_manifold_type(uecp.opened_dcel)['genus'] == 2:
+    genus = uecp.opened_dcel.stats['topology']['genus']
+    if genus == 2:
         # genus 2
-        open_genus2(parent, delegate, uecp.opened_dcel, uecp.chains, X0, ondone=ondone, words=pared_wordlist)
-    elif dcel.oriented_manifold_type(uecp.opened_dcel)['genus'] == 1:
+        # the word list is only read if the circles are not cached
+        open_genus2(parent, delegate, uecp.opened_dcel, uecp.chains, X0, ondone=ondone, words=assets.wordfile,
+                    packing=packing)
+    elif genus == 1:
         # genus 1 (torus)
-        open_genus1(parent, delegate, uecp.opened_dcel, uecp.chains, X0, ondone=ondone)
+        open_genus1(parent, delegate, uecp.opened_dcel, uecp.chains, X0, ondone=ondone, packing=packing)
 
-def ordered_packing_list(P):
-    # SHOW Packing DIALOG
+def ordered_packing_keys(P):
+    """
+    Keys of the packings of a file, for the packing dropdown: in numerical order if they are
+    numbers, and "Packing 0", ... if the packings are a list.  The packings are not read.
+    :param P: dict, serialization.PackingStore or list of packings
+    """
     if isinstance(P, list):
-        tempP = P.copy()
-        P = {}
-        for i in range(len(tempP)):
-            P[str("Packing %d" % i)] = tempP[i]
+        return ["Packing %d" % i for i in range(len(P))]
+    if getattr(P, 'listed', False):
+        return list(P)
     try:
-        odict = OrderedDict.fromkeys(sorted(P, key=lambda x: float(x)))
+        return sorted(P, key=lambda x: float(x))
     except(Exception):
-        odict = OrderedDict.fromkeys(sorted(P))
+        return sorted(P)
 
-    for key in odict:
-        odict[key] = list(P[key])
-    return odict
+def packing_by_key(P, key):
+    """The packing of P with a key of ordered_packing_keys()"""
+    if isinstance(P, list):
+        return P[int(key.split()[-1])]
+    return P[key]
+
+def load_words(fn):
+    """Words of a (bz2 compressed) word list, in shortlex order"""
+    return sorted({x.strip() for x in bz2.open(fn, 'rt')}, key=lambda w: (len(w), w))
 
-def open_genus2(parent, delegate, D, chains, X0, ondone, words=None):
+def open_genus2(parent, delegate, D, chains, X0, ondone, words=None, packing=None):
     """
     Find a circle packing for a genus 2 surface
     :param parent:
@@ -128,62 +147,31 @@ def open_genus2(parent, delegate, D, chains, X0, ondone, words=None):
     :param chains:
     :param X0:
     :param ondone:
-    :param words:
+    :param words: words, or the file name of a word list
+    :param packing: key of the packing X0, to cache the circles under (None: no caching)
     :return:
     """
+    Rho, mnormKAT = genus2_group(D, chains, X0)
 
-    rho0 = {k: D.hol(chains[k], X0) for k in ['a1', 'a2', 'b1', 'b2']}
-
-    def commutator(a, b):
-        return a.dot(b).dot(mobius.sl2inv(a)).dot(mobius.sl2inv(b))
-
-    def conjugate(inner, outer):
-        return mobius.sl2inv(outer).dot(inner).dot(outer)
-
-    rho = {'a1': rho0['a1'],
-           'b1': rho0['b1'],
-           'a2': conjugate(rho0['a2'], rho0['b2']),
-           'b2': rho0['b2']}
-
-    print("RHO:", rho0['a1'])
+    print("RHO:", Rho['a'])
 
     print('This should be the identity matrix:')
-    print(commutator(rho['a1'], rho['b1']).dot(commutator(rho['a2'], rho['b2'])))
+    print(Rho['abAB'].dot(Rho['cdCD']))
 
-    from collections import defaultdict
-    verts_of_valence = defaultdict(int)
-    for v in D.V:
-        verts_of_valence[v.valence] += 1
-    for k in verts_of_valence:
-        print(verts_of_valence[k], 'vertices of valence', k)
-
-    recip = np.array([[0, 1j], [1j, 0]])
-    fc = mobius.fix(commutator(rho['a1'], rho['b1']))
-    fa1 = mobius.fix(rho['a1'])
-    fa2 = mobius.fix(rho['a2'])
-    mnormKAT = mobius.center_four_points(fc[0], fa1[0], fc[1], fa2[0])
-    mnormKAT = recip.dot(mnormKAT)
-
-    import fgrep as fgrep
-    Rho = fgrep.FreeGroup({'a': rho['a1'], 'b': rho['b1'], 'c': rho['a2'], 'd': rho['b2'],
-                           'k': commutator(rho['a1'], rho['b1'])}, inverter=mobius.sl2inv)
+    valences = D.stats['valences']
+    for k in valences:
+        print(valences[k], 'vertices of valence', k)
 
     print('Computing circle positions...')
 
-    echains = dcel.edge_chain_dfs(D, chains['t1'][0])
-    vchains = set()
-    vert_seen = set()
-    for ch in echains:
-        if ch[-1].src not in vert_seen:
-            vert_seen.add(ch[-1].src)
-            vchains.add(ch)
+    vchains = vertex_chains(D, chains)
 
-    findwords = FindWordsThread(parent, delegate, vchains, D, X0, Rho, mnormKAT, known_words=words)
-    findwords.start()
+    findwords = FindWordsThread(parent, delegate, vchains, D, X0, Rho, mnormKAT, known_words=words, packing=packing)
+    start_word_search(delegate, findwords)
 
     ondone()
 
-def open_genus1(parent, delegate, D, chains, X0, ondone, words=None):
+def open_genus1(parent, delegate, D, chains, X0, ondone, words=None, packing=None):
     """
     Find a circle packing for a genus 1 surface (torus)
     :param parent:
@@ -192,51 +180,83 @@ def open_genus1(parent, delegate, D, chains, X0, ondone, words=None):
     :param X0:
     :param ondone:
     :param words:
+    :param packing: key of the packing X0, to cache the circles under (None: no caching)
     :return:
     """
+    Rho, ident = genus1_group(D, chains, X0)
 
-    rho0 = {k: D.hol(chains[k], X0) for k in ['a1', 'b1']}
+    print("RHO:", Rho['a'])
 
-    def commutator(a, b):
-        return a.dot(b).dot(mobius.sl2inv(a)).dot(mobius.sl2inv(b))
+    print('This should be the identity matrix:')
+    print(Rho['abAB'])
 
-    def conjugate(inner, outer):
-        return mobius.sl2inv(outer).dot(inner).dot(outer)
+    valences = D.stats['valences']
+    for k in valences:
+        print(valences[k], 'vertices of valence', k)
 
-    rho = {'a1': rho0['a1'],
-           'b1': rho0['b1']}
+    print('Computing circle positions...')
 
-    print("RHO:", rho0['a1'])
+    vchains = vertex_chains(D, chains)
 
-    print('This should be the identity matrix:')
-    print(commutator(rho['a1'], rho['b1']))
+    findwords = FindWordsThread(parent, delegate, vchains, D, X0, Rho, ident, char_list="aAbB", packing=packing)
+    start_word_search(delegate, findwords)
 
-    from collections import defaultdict
-    verts_of_valence = defaultdict(int)
-    for v in D.V:
-        verts_of_valence[v.valence] += 1
-    for k in verts_of_valence:
-        print(verts_of_valence[k], 'vertices of valence', k)
+    ondone()
 
-    # recip = np.array([[0, 1j], [1j, 0]])
-    # fc = mobius.fix(commutator(rho['a1'], rho['b1']))
-    # fa1 = mobius.fix(rho['a1'])
-    # mnormKAT = mobius.center_four_points(fc[0], fa1[0], fc[1], fa2[0])
-    # mnormKAT = recip.dot(mnormKAT)
-    ident = np.array([[1, 0], [0, 1]])
-    # normalize the circle packing to the viewport
-    mob_zoom = np.array(((100, 0), (0, 0.01)), dtype='complex')
+def genus2_group(D, chains, X0):
+    """
+    Holonomy of a genus 2 packing
+    :return: (Rho, mnormKAT): fgrep.FreeGroup with generators a, b, c, d (for a1, b1, a2, b2)
+        and k = [a, b], and the normalization taking the circles to the "KAT" picture
+    """
+    rho0 = {k: D.hol(chains[k], X0) for k in ['a1', 'a2', 'b1', 'b2']}
 
-    import fgrep as fgrep
-    Rho = fgrep.FreeGroup({'a': rho['a1'], 'b': rho['b1']}, inverter=mobius.sl2inv)
+    def commutator(a, b):
+        return a.dot(b).dot(mobius.sl2inv(a)).dot(mobius.sl2inv(b))
 
-    print('Computing circle positions...')
+    def conjugate(inner, outer):
+        return mobius.sl2inv(outer).dot(inner).dot(outer)
 
-    # pared_wordlist = ["%s%s%s"%(a, b, c) for a in possi for b in possi for c in possi] + ["%s%s"%(a, b) for a in possi for b in possi] + ["%s"%a for a in possi]
-    # pared_wordlist = ["kK", "C", "D", "CC", "Cd", "CD", "CB"]
+    rho = {'a1': rho0['a1'],
+           'b1': rho0['b1'],
+           'a2': conjugate(rho0['a2'], rho0['b2']),
+           'b2': rho0['b2']}
 
-    # print(pared_wordlist)
+    recip = np.array([[0, 1j], [1j, 0]])
+    fc = mobius.fix(commutator(rho['a1'], rho['b1']))
+    fa1 = mobius.fix(rho['a1'])
+    fa2 = mobius.fix(rho['a2'])
+    mnormKAT = mobius.center_four_points(fc[0], fa1[0], fc[1], fa2[0])
+    mnormKAT = recip.dot(mnormKAT)
 
+    import fgrep as fgrep
+    Rho = fgrep.FreeGroup({'a': rho['a1'], 'b': rho['b1'], 'c': rho['a2'], 'd': rho['b2'],
+                           'k': commutator(rho['a1'], rho['b1'])}, inverter=mobius.sl2inv,
+                          relators=GENUS2_RELATORS)
+    return Rho, mnormKAT
+
+def genus1_group(D, chains, X0):
+    """
+    Holonomy of a genus 1 packing
+    :return: (Rho, identity): fgrep.FreeGroup with generators a, b (for a1, b1); the circles
+        are not normalized
+    """
+    import fgrep as fgrep
+    Rho = fgrep.FreeGroup({'a': D.hol(chains['a1'], X0), 'b': D.hol(chains['b1'], X0)}, inverter=mobius.sl2inv,
+                          relators=GENUS1_RELATORS)
+    return Rho, np.array([[1, 0], [0, 1]])
+
+def surface_group(D, chains, X0):
+    """Holonomy group and normalization of a packing (see genus2_group(), genus1_group())"""
+    genus = D.stats['topology']['genus']
+    if genus == 2:
+        return genus2_group(D, chains, X0)
+    elif genus == 1:
+        return genus1_group(D, chains, X0)
+    raise ValueError('Unsupported genus %s' % genus)
+
+def vertex_chains(D, chains):
+    """Edge chains from the base triangle to each vertex of D, one per vertex"""
     echains = dcel.edge_chain_dfs(D, chains['t1'][0])
     vchains = set()
     vert_seen = set()
@@ -244,11 +264,7 @@ def open_genus1(parent, delegate, D, chains, X0, ondone, words=None):
         if ch[-1].src not in vert_seen:
             vert_seen.add(ch[-1].src)
             vchains.add(ch)
-
-    findwords = FindWordsThread(parent, delegate, vchains, D, X0, Rho, ident, char_list="aAbB")
-    findwords.start()
-
-    ondone()
+    return vchains
 
 def pure_fund_domain_genus2(delegate, D, chains, X0):
     """
@@ -279,12 +295,9 @@ def pure_fund_domain_genus2(delegate, D, chains, X0):
     print('This should be the identity matrix:')
     print(commutator(rho['a1'], rho['b1']).dot(commutator(rho['a2'], rho['b2'])))
 
-    from collections import defaultdict
-    verts_of_valence = defaultdict(int)
-    for v in D.V:
-        verts_of_valence[v.valence] += 1
-    for k in verts_of_valence:
-        print(verts_of_valence[k], 'vertices of valence', k)
+    valences = D.stats['valences']
+    for k in valences:
+        print(valences[k], 'vertices of valence', k)
 
     recip = np.array([[0, 1j], [1j, 0]])
     fc = mobius.fix(commutator(rho['a1'], rho['b1']))
@@ -345,12 +358,9 @@ def pure_fund_domain_genus1(delegate, D, chains, X0):
     print('This should be the identity matrix:')
     print(commutator(rho['a1'], rho['b1']))
 
-    from collections import defaultdict
-    verts_of_valence = defaultdict(int)
-    for v in D.V:
-        verts_of_valence[v.valence] += 1
-    for k in verts_of_valence:
-        print(verts_of_valence[k], 'vertices of valence', k)
+    valences = D.stats['valences']
+    for k in valences:
+        print(valences[k], 'vertices of valence', k)
 
     # recip = np.array([[0, 1j], [1j, 0]])
     # fc = mobius.fix(commutator(rho['a1'], rho['b1']))
@@ -391,115 +401,392 @@ def pure_fund_domain_genus1(delegate, D, chains, X0):
 class FindWordsThread(QThread):
     """
     Find and Display the words of a circle packing in a separate thread so that the UI is not bogged down
+
+    The thread is a cancellable, pausable search job (see cancel(), pause(), resume()).  Its
+    progress through the enumeration is kept in resume_point, and resumed() gives a new job
+    that continues from there:
+    * best-first search: number of circles reported by the orbit enumerator (or merged from
+      the workers of a parallel search)
+    * known words: number of (vertex chain, word) pairs processed, or of vertex chains done
+      by a parallel search
+
+    New circles are appended to uecp.circles and handed to the view in batches through
+    uecp.circle_stream, so that they are drawn while the search goes on.
+
+    If a packing key is given, the circles of a finished search are stored in uecp.circle_cache,
+    and a later search for the same packing, words and budget loads them instead of searching.
+
+    A refining job (see refined()) adds to the circles found so far instead of replacing them,
+    delivering only circles that are new; it searches a region (the part of the packing in
+    view) rather than the whole packing.  If it then misses circles that the search of the
+    whole packing found there (see orbits.missed_circles), it searches the region again with
+    the next of orbits.REGION_MARGINS.
     """
-    def __init__(self, parent, delegate, vchains, D, X0, Rho, mnormKAT, char_list="", known_words=None):
+    def __init__(self, parent, delegate, vchains, D, X0, Rho, mnormKAT, char_list="", known_words=None,
+                 min_radius=None, max_circles=orbits.DEFAULT_MAX_CIRCLES, tolerance=1e-5, processes=None, start=0,
+                 packing=None, refine=False, region=None, full_radius=None, margin=orbits.REGION_MARGIN):
+        """
+        :param known_words: words to apply to the base circles, or the file name of a word list
+            (read when the search runs); None for a best-first search
+        :param packing: key of the packing X0 in its file, for the circle cache (None: no caching)
+        :param refine: add to the circles in uecp.circles rather than starting afresh
+        :param region: for a best-first search, the region (see orbits.meets_region) of the circles
+            to search for; None for the whole packing
+        :param full_radius: radius down to which the whole packing has been searched (default:
+            min_radius, if region is None)
+        :param margin: margin of the region (see orbits.OrbitEnumerator)
+        """
         super().__init__(parent)
 
-        self.vchains = vchains
+        # fixed orders, so that the enumeration (and a resume point in it) is deterministic
+        self.vchains = sorted(vchains, key=lambda ch: ch[-1].src.idx)
         self.D = D
         self.X0 = X0
         self.Rho = Rho
         self.mnormKAT = mnormKAT
         self.char_list = char_list
-        self.known_words = known_words
+        if known_words is None or isinstance(known_words, str):
+            self.known_words = known_words
+        else:
+            self.known_words = sorted(known_words, key=lambda w: (len(w), w))
+        # without known words, search down to circles one pixel across at the current zoom
+        if min_radius is None:
+            min_radius = orbits.pixel_radius(delegate.scene2.display_params["zoom"])
+        self.min_radius = min_radius
+        self.max_circles = max_circles
+        self.region = region
+        if full_radius is None and region is None:
+            full_radius = min_radius
+        self.full_radius = full_radius
+        self.margin = margin
+        # circles whose centers and radii agree to within this are considered the same
+        self.tolerance = tolerance
+        # number of worker processes for the search (None: see orbits.worker_count, 1: search in this thread)
+        self.processes = processes
+
+        self.packing = packing
+        if packing is None:
+            self.cache_key = None
+        elif self.known_words is None:
+            budget = (min_radius, max_circles, char_list, tolerance)
+            if region is not None:
+                budget += (region.m.ravel().tolist(),)
+            self.cache_key = circlecache.packing_key(D, packing, circlecache.packing_hash(X0, Rho, mnormKAT),
+                                                     circlecache.word_source(None), budget)
+        else:
+            self.cache_key = circlecache.packing_key(D, packing, circlecache.packing_hash(X0, Rho, mnormKAT),
+                                                     circlecache.word_source(self.known_words), tolerance)
+
+        self.refine = refine
+        self.start_point = start
+        self.resume_point = start
+        self.control = orbits.SearchControl()
+        self.generation = None
 
         # set unified embedded circle packing holder
         self.uecp = delegate.uecp
         self.delegate = delegate
 
-    def run(self):
-
-        def getNormCenter(c):
-            """
-            Normalizes circle center by rounding it's coordinates
-            :param c:
-            :return:
-            """
-            if c.contains_infinity:
-                return None
-            return complex(int(c.center.real * 100000) / 100000, int(c.center.imag * 100000) / 100000)
+    def cancel(self):
+        """Ask the search to stop as soon as possible; use wait() to wait for it"""
+        self.control.cancel()
+
+    def pause(self):
+        self.control.pause()
+
+    def resume(self):
+        self.control.resume()
+
+    @property
+    def cancelled(self):
+        return self.control.cancelled
+
+    def deliver(self, batch):
+        """
+        Hand a batch of new circles to the view (and uecp.circles)
+        :param batch: list of [circle, vertex, dual_graph_part]
+        :return: False if the search was cancelled, in which case nothing is delivered
+        """
+        if not self.uecp.circle_stream.put(self.generation, batch, self.control):
+            return False
+        self.uecp.circles.extend(batch)
+        self.parent().draw_trigger.emit()
+        return True
+
+    def resumed(self):
+        """A new (not yet started) job that continues this one from its resume point"""
+        return FindWordsThread(self.parent(), self.delegate, self.vchains, self.D, self.X0, self.Rho, self.mnormKAT,
+                               char_list=self.char_list, known_words=self.known_words, min_radius=self.min_radius,
+                               max_circles=self.max_circles, tolerance=self.tolerance, processes=self.processes,
+                               start=self.resume_point, packing=self.packing, refine=self.refine,
+                               region=self.region, full_radius=self.full_radius, margin=self.margin)
+
+    def refined(self, min_radius, region=None, max_circles=None):
+        """
+        A new (not yet started) best-first job adding the circles of a region down to a smaller radius
+        :param region: see orbits.meets_region; None for the whole packing
+        :param max_circles: circle budget (default: grown with the area scale, since the number of
+            circles above a radius r grows at most like 1/r^2)
+        """
+        if max_circles is None:
+            max_circles = int(min(self.max_circles * (self.min_radius / min_radius) ** 2, MAX_REFINED_CIRCLES))
+        return FindWordsThread(self.parent(), self.delegate, self.vchains, self.D, self.X0, self.Rho, self.mnormKAT,
+                               char_list=self.char_list, min_radius=min_radius, max_circles=max_circles,
+                               tolerance=self.tolerance, processes=self.processes, packing=self.packing,
+                               refine=True, region=region,
+                               full_radius=None if region is None else self.full_radius)
 
+    def run(self):
         c0 = circle.from_point_angle(0, 0)  # Real line is C0 in the "standard interstice"
 
-        # TODO: maybe use a reset function for these?
-        self.uecp.circles = []  # Will store circles for the Fuchsian (KAT) picture
-        self.uecp.circles_optimize = [[]]
-
-        centers = []
-        omit_circles = []
-
         # solve fundamental domain first (for dual graph)
+        fundamental = []
         for ch in self.vchains:
             h = self.D.hol(ch, self.X0)
             c1 = c0.transform_gl2(h).transform_sl2(self.mnormKAT)
             v0 = ch[-1].src
-            self.uecp.circles.append([c1, v0, True])
-            omit_circles.append(getNormCenter(c1))
+            fundamental.append([c1, v0, True])
+
+        if self.start_point == 0 and not self.refine:
+            # TODO: maybe use a reset function for these?
+            self.uecp.circles = []  # Will store circles for the Fuchsian (KAT) picture
+            self.generation = self.uecp.circle_stream.reset()
+
+            cached = self.load_cached()
+            if cached is not None:
+                for i in range(0, len(cached), 5000):
+                    if not self.deliver(cached[i:i + 5000]):
+                        return
+                self.uecp.progressValue[0] = 100
+                self.parent().draw_trigger.emit()
+                return
 
-        # If there are no known words, calculate them here
-        if self.known_words is None:
-            # Then find the surrounding circles through holonomy
-            for i, ch in enumerate(self.vchains):
-                h = self.D.hol(ch, self.X0)
-                c1 = c0.transform_gl2(h)
-
-                def testConfig(w):
-                    """
-                    Given a word `w`, find whether or not the circle belongs in the packing
-                    :param w: a word
-                    :return:
-                    """
-                    c = c1.transform_sl2(self.Rho[w]).transform_sl2(self.mnormKAT)
-                    norm = getNormCenter(c)
-                    if norm not in omit_circles and (norm is None or norm not in centers):
-                        if norm is not None:
-                            centers.append(norm)
-                        else:
-                            print("line")
-                        if not c.contains_infinity and np.abs(c.radius) >= 0.005 or c.contains_infinity:
-                            v0 = ch[-1].src
-                            self.uecp.circles.append([c, v0, False])
-
-                        if not c.contains_infinity and np.abs(c.radius) < 0.00025:
-                            return False
-
-                        return True
-
-                    return False
-
-                def find_word(w_list="aAbBcCdD", w="", n=7):
-                    """
-                    finds as many 'words' as possible to fill the circle packing
-                    :param w_list: list of word elements to build the words
-                    :param w: current word
-                    :param n: recursion depth
-                    """
-                    if n > 0:
-                        for w_n in w_list:
-                            if testConfig(w + w_n):
-                                find_word(w_list, w + w_n, n - 1)
-
-                find_word(w_list=self.char_list)
+            if not self.deliver(fundamental):
+                return
+        else:
+            # this job continues an earlier one, whose circles are kept
+            self.generation = self.uecp.circle_stream.generation
+
+        # circles (and lines) found so far, for deduplication
+        known = circle.CircleSet(tol=self.tolerance)
+        for c, v0, d in self.uecp.circles:
+            known.add(c)
+        # a refining job caches the circles it finds (those after this)
+        self.first_circle = len(self.uecp.circles)
+
+        if self.refine and self.start_point == 0:
+            cached = self.load_cached()
+            if cached is not None:
+                self.deliver([ci for ci in cached if known.add(ci[0])])
+                self.uecp.progressValue[0] = 100
+                self.parent().draw_trigger.emit()
+                return
+
+        base = orbits.base_circles(self.D, self.vchains, self.X0, c0)
+
+        words = self.known_words
+        if isinstance(words, str):
+            words = load_words(words)
+
+        prior = circle.CircleArray.from_circles(c for c, v0, d in self.uecp.circles[:self.first_circle])
+        repeated = self.search(fundamental, base, words, known, prior)
+        while repeated is not None and self.margin is not None and self.full_radius is not None:
+            missed = orbits.missed_circles(prior, repeated, self.region, self.full_radius, tol=self.tolerance)
+            if not missed:
+                break
+            # some words lead back into the region from further out than the margin
+            self.margin = [m for m in orbits.REGION_MARGINS if m is None or m > self.margin][0]
+            print("Missed %d circles in the region, searching it again with margin %s" % (len(missed), self.margin))
+            self.resume_point = 0
+            repeated = self.search(fundamental, base, words, known, prior)
+
+        if self.control.cancelled:
+            # a newer search owns the view now
+            return
+
+        self.store_cached()
+
+        self.uecp.progressValue[0] = 100
+        # The view culls each batch as it arrives, so no full update is needed here.
+        # Tell the UI to redraw
+        self.parent().draw_trigger.emit()
 
+    def expected_circles(self, words, prior):
+        """
+        Rough number of circles this job will find (see orbits.worker_count), or None if unknown
+        :param prior: circle.CircleArray of the circles found before
+        """
+        if words is not None:
+            return len(self.vchains) * len(words)
+        if self.region is None or self.full_radius is None:
+            return self.max_circles
+        # the number of circles above a radius r grows at most like 1/r^2
+        estimate = (len(orbits.region_circles(prior, self.region, self.full_radius)) + 1) * \
+            (self.full_radius / self.min_radius) ** 2
+        return estimate if self.max_circles is None else min(estimate, self.max_circles)
+
+    def search(self, fundamental, base, words, known, prior):
+        """
+        Search for the circles of this job (from start_point), delivering those not in known
+        :param prior: circle.CircleArray of the circles found before this job
+        :return: for a search of a region that ran to the end, from the start, within its circle
+            budget, the circles it found that were in known; otherwise None
+        """
+        if orbits.worker_count(self.processes, self.expected_circles(words, prior)) > 1:
+            # Search the vertex chains in worker processes, merging the results as they arrive
+            # (into the circles the serial search below would find)
+            search = orbits.ParallelOrbitSearch(self.Rho, base, self.mnormKAT, known=known, words=words,
+                                                processes=self.processes, min_radius=self.min_radius,
+                                                max_circles=self.max_circles, alphabet=self.char_list or None,
+                                                region=self.region, margin=self.margin, tol=self.tolerance,
+                                                start=self.start_point, control=self.control)
+            for batch in search:
                 # reflect progress on progress bar
-                self.uecp.progressValue[0] = int((i + 1) / len(self.vchains) * 100)
-                self.parent().draw_trigger.emit()
+                self.uecp.progressValue[0] = int(search.progress * 100)
+                if not self.deliver([[c, v0, False] for c, v0, w in batch]):
+                    return None
+                self.resume_point = search.resume_point
+            repeated, count = search.repeated, search.count
+        # If there are no known words, calculate them here
+        elif words is None:
+            # Then find the surrounding circles through holonomy, largest circles first.
+            # Deduplication decides which words are expanded, so it is replayed from the
+            # fundamental domain when resuming, and the circles already delivered are skipped.
+            seen = circle.CircleSet(tol=self.tolerance)
+            for c, v0, d in fundamental:
+                seen.add(c)
+
+            def accept(c, v0, w):
+                """
+                Given the circle of a word `w`, find whether or not it belongs in the packing
+                :param c: normalized circle
+                :param v0: vertex of the circle
+                :param w: a word
+                :return:
+                """
+                if w == "":
+                    # fundamental domain, already added above
+                    return True
+                return seen.add(c)
+
+            engine = orbits.OrbitEnumerator(self.Rho, base, self.mnormKAT, min_radius=self.min_radius,
+                                            max_circles=self.max_circles, alphabet=self.char_list or None,
+                                            accept=accept, region=self.region, margin=self.margin)
+            # circles are delivered in batches of 500 (or fewer, at the end)
+            pending = []
+            repeated = []
+            for c, v0, w in engine:
+                if not self.control.checkpoint():
+                    return None
+                if engine.count <= self.start_point:
+                    continue
+                if self.refine and not known.add(c):
+                    repeated.append(c)
+                elif w != "":
+                    pending.append([c, v0, False])
+
+                if engine.count % 500 == 0:
+                    # reflect progress on progress bar
+                    self.uecp.progressValue[0] = int(engine.progress * 100)
+                    if not self.deliver(pending):
+                        return None
+                    pending = []
+                    self.resume_point = engine.count
+            if not self.deliver(pending):
+                return None
+            self.resume_point = count = engine.count
+        else:
+            # If the words are known, iterate over all (vertex chain, word) pairs
+            # circles are delivered in one batch per vertex chain
+            pending = []
+            for k in range(self.start_point, len(base) * len(words)):
+                if not self.control.checkpoint():
+                    break
+                i, j = divmod(k, len(words))
+                c1, v0 = base[i]
+                c = c1.transform_sl2(self.Rho[words[j]]).transform_sl2(self.mnormKAT)
+                if known.add(c):
+                    pending.append([c, v0, False])
+
+                if j == len(words) - 1:
+                    # reflect progress on progress bar
+                    self.uecp.progressValue[0] = int((i + 1) / len(base) * 100)
+                    if not self.deliver(pending):
+                        break
+                    pending = []
+                    self.resume_point = k + 1
+            return None
+
+        if self.control.cancelled or self.region is None or self.start_point != 0 or \
+                (self.max_circles is not None and count >= self.max_circles):
+            return None
+        return repeated
+
+    def load_cached(self):
+        """Circles of this search from the circle cache, or None"""
+        if self.cache_key is None:
+            return None
+        circles = self.uecp.circle_cache.load(self.cache_key, self.D)
+        if circles is not None:
+            print("Loaded %d circles from the cache." % len(circles))
+        return circles
+
+    def store_cached(self):
+        if self.cache_key is None:
+            return
+        if self.refine:
+            # only a complete refining job knows all of its circles
+            if self.start_point != 0:
+                return
+            circles = self.uecp.circles[self.first_circle:]
         else:
-            # If the words are known, iterate over all words
-            for i, ch in enumerate(self.vchains):
-                h = self.D.hol(ch, self.X0)
-                c1 = c0.transform_gl2(h)
-                for w in self.known_words:
-                    c = c1.transform_sl2(self.Rho[w]).transform_sl2(self.mnormKAT)
-                    if getNormCenter(c) not in omit_circles:
-                        v0 = ch[-1].src
-                        self.uecp.circles.append([c, v0, False])
+            circles = self.uecp.circles
+        try:
+            self.uecp.circle_cache.store(self.cache_key, circles)
+        except OSError as e:
+            print("Unable to cache circles:", e)
 
-                # reflect progress on progress bar
-                        self.uecp.progressValue[0] = int((i + 1) / len(self.vchains) * 100)
-                self.parent().draw_trigger.emit()
+# A finished search is refined once the view needs circles this much smaller than it found
+REFINE_FACTOR = 0.5
+MAX_REFINED_CIRCLES = 1000000
 
-        # Force update will require the UI to optimize the circle packing for snappy interaction
-        self.delegate.graphics.force_update()
-        # Tell the UI to redraw
-        self.parent().draw_trigger.emit()
+def refine_word_search(delegate, min_radius, region=None, area=None):
+    """
+    Start a search for the circles of a region down to min_radius (in the normalized coordinates
+    of the search) if the last search stopped at circles much larger than that there, e.g. after
+    zooming in or panning
+    :param region: region in view (see orbits.view_region); None for the whole packing
+    :param area: area of the region in view; the circles of a packing do not overlap, so at most
+        area / (pi min_radius^2) circles of at least min_radius fit in it (default: as many as
+        the last search found, scaled by the change in radius)
+    :return: the new job, or None
+    """
+    job = delegate.uecp.search_job
+    if job is None or job.isRunning() or job.cancelled:
+        return None
+    if job.full_radius is not None and min_radius >= REFINE_FACTOR * job.full_radius:
+        # all of the packing is known to this radius
+        return None
+    if min_radius >= REFINE_FACTOR * job.min_radius and orbits.region_contains(job.region, region):
+        return None
+    print("Refining the packing to circles of radius %g" % min_radius)
+    max_circles = None
+    if area is not None:
+        max_circles = int(min(area / (np.pi * min_radius ** 2), MAX_REFINED_CIRCLES))
+    refined = job.refined(min_radius, region, max_circles)
+    start_word_search(delegate, refined)
+    return refined
+
+def start_word_search(delegate, job):
+    """
+    Cancel the running word search job (if any) and start `job` in its place
+    :param delegate:
+    :param job: a FindWordsThread, not yet started
+    """
+    uecp = delegate.uecp
+    old = uecp.search_job
+    if old is not None and old.isRunning():
+        old.cancel()
+        old.wait()
+    uecp.search_job = job
+    job.start()
@@ -0,0 +1,513 @@
+"""Best-first enumeration of circles in the orbit of a circle packing"""
+
+# The circles of a packing on a closed surface are images of finitely
+# many "base" circles (one per vertex of the DCEL) under the holonomy
+# group.  Rather than visiting all words up to a fixed length, the
+# enumerator keeps a priority queue of words keyed on the radius of the
+# corresponding circle after normalization, and always expands the
+# largest circle next.  The search stops once the largest remaining
+# circle is below a radius threshold (e.g. one pixel) or a circle
+# budget is used up, so detail is only computed where it is visible.
+
+import collections
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+
+import numpy as np
+
+import circle
+import mobius
+
+DEFAULT_MAX_CIRCLES = 50000
+
+# A search restricted to a region expands the words whose circles, enlarged this many times
+# (about their centers), meet the region.  The images of a circle under the words extending
+# its word can lie far from it (on the genus 2 sample, up to about 200 radii away for short
+# words, about 15 for longer ones), and nothing bounds this for every packing; so this margin
+# is only a first guess, and a search that turns out to have missed circles (see
+# missed_circles) is repeated with the next of REGION_MARGINS, the last of which (None)
+# expands all words.
+REGION_MARGIN = 128
+REGION_MARGINS = (REGION_MARGIN, 16 * REGION_MARGIN, None)
+
+def pixel_radius(zoom, pixels=1.0):
+    """Radius (in normalized coordinates) of a circle that is `pixels` pixels across at a display zoom"""
+    return pixels / abs(zoom)
+
+def meets_region(c, region, margin=1.0):
+    """
+    Whether a circle (not a line), enlarged `margin` times about its center, meets a region
+    (for a circle.CircleArray, an array of these)
+    :param region: circle.Circle bounding the region; a negative radius means the outside of the circle
+    """
+    d = abs(c.center - region.center)
+    r = margin * abs(c.radius)
+    R = region.radius
+    return d - r < R if R > 0 else d + r > -R
+
+def region_circles(cs, region, radius):
+    """Indices of the circles (not lines) of a circle.CircleArray of at least a radius that meet a region"""
+    lines = cs.contains_infinity
+    radii = np.abs(np.where(lines, np.inf, cs.radius))
+    keep = np.flatnonzero(~lines & (radii >= radius))
+    return keep[meets_region(cs[keep], region)]
+
+def missed_circles(prior, found, region, radius, tol=1e-5):
+    """
+    Circles that a search of a region down to radius (not stopped by its budget) missed: it must
+    find every circle of at least that radius meeting the region, which includes those of a search
+    of the whole packing down to radius
+    :param prior: circles (or a circle.CircleArray) found before the search, e.g. by a search of
+        the whole packing down to radius
+    :param found: the circles the search found (those in prior, at least)
+    :param tol: tolerance of the comparison (see circle.CircleSet)
+    :return: list of the circles of prior that should have been found
+    """
+    cs = prior if isinstance(prior, circle.CircleArray) else circle.CircleArray.from_circles(prior)
+    expected = region_circles(cs, region, radius)
+    if not len(expected):
+        return []
+    found_set = circle.CircleSet(tol=tol)
+    for c in found:
+        found_set.add(c)
+    return [c for c in cs[expected] if c not in found_set]
+
+def region_contains(outer, inner):
+    """Whether a region (see meets_region) contains another one; None is the whole plane"""
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    d = abs(outer.center - inner.center)
+    R, r = outer.radius, inner.radius
+    if R > 0:
+        return r > 0 and d + r <= R
+    # outside of a circle: contains a disc outside it, or the outside of a larger circle
+    return d - r >= -R if r > 0 else d - R <= -r
+
+def view_region(rect, T):
+    """
+    Region (see meets_region) covering a rectangle of a view, in the coordinates before the view's
+    transformation
+    :param rect: (xmin, xmax, ymin, ymax), e.g. from tools.visible_rect()
+    :param T: SL(2,C) transformation of the view
+    :return: circle.Circle, or None if the region would be a half-plane
+    """
+    xmin, xmax, ymin, ymax = rect
+    c = circle.from_center_radius(complex(xmin + xmax, ymin + ymax) / 2, abs(complex(xmax - xmin, ymax - ymin)) / 2)
+    region = c.transform_sl2(mobius.sl2inv(T))
+    return None if region.contains_infinity else region
+
+class OrbitEnumerator:
+    """
+    Iterating over an OrbitEnumerator yields triples (circle, tag, word)
+    in order of decreasing radius (see the radius attribute), where circle
+    is the image of a base circle under Rho[word] followed by the
+    normalization.  Lines (which contain infinity) come first.
+    """
+    def __init__(self, Rho, base, normalization=None, min_radius=0.00025, max_circles=DEFAULT_MAX_CIRCLES,
+                 alphabet=None, max_depth=None, accept=None, region=None, margin=REGION_MARGIN):
+        """
+        :param Rho: fgrep.FreeGroup of SL(2,C) matrices; its relators (if any) are used to skip repeated elements
+        :param base: list of (circle, tag) pairs; tag is passed through (e.g. the vertex of the circle)
+        :param normalization: SL(2,C) matrix applied to all circles (e.g. mnormKAT)
+        :param min_radius: circles with smaller normalized radius are neither reported nor expanded
+        :param max_circles: stop after reporting this many circles (None for no limit)
+        :param alphabet: letters used to build words (default: all generators and inverses)
+        :param max_depth: optional bound on word length
+        :param accept: optional callable accept(circle, tag, word); if it returns False the
+                       circle is dropped (e.g. a duplicate) and its word is not expanded
+        :param region: optional region (see meets_region) of the circles to report; max_circles
+                       counts the circles meeting it
+        :param margin: with a region, words are only expanded while their circles, enlarged this
+                       many times, meet it; None expands all words
+        """
+        self.Rho = Rho
+        self.base = list(base)
+        if normalization is None:
+            normalization = np.eye(2, dtype='complex')
+        self.N = np.array(normalization, dtype='complex')
+        self.min_radius = min_radius
+        self.max_circles = max_circles
+        self.alphabet = alphabet or Rho.order
+        self.max_depth = max_depth
+        self.accept = accept
+        self.region = region
+        self.margin = margin
+        self.gens = {x: np.array(Rho[x], dtype='complex') for x in self.alphabet}
+
+        self.count = 0
+        # smallest radius of the circles taken from the queue so far (reported or not); it never
+        # grows, and the circles are reported in its order (a circle itself can be larger than the
+        # one before it, if its word extends the word of a smaller circle)
+        self.radius = np.inf
+        self._start_radius = None
+        self._heap = []
+        self._seq = itertools.count()
+        for i, (c, tag) in enumerate(self.base):
+            self._push(i, '', np.eye(2, dtype='complex'))
+
+    def _push(self, i, word, M):
+        c = self.base[i][0].transform_sl2(self.N.dot(M))
+        if c.contains_infinity:
+            key = -np.inf
+        else:
+            r = abs(c.radius)
+            if r < self.min_radius:
+                return
+            if self.region is not None and self.margin is not None and \
+                    not meets_region(c, self.region, self.margin):
+                return
+            key = -r
+        heapq.heappush(self._heap, (key, next(self._seq), i, word, M, c))
+
+    @property
+    def exhausted(self):
+        return not self._heap or (self.max_circles is not None and self.count >= self.max_circles)
+
+    @property
+    def current_radius(self):
+        """Radius of the next circle to be reported (decreases as the search proceeds)"""
+        if not self._heap:
+            return 0.0
+        return -self._heap[0][0]
+
+    @property
+    def progress(self):
+        """Fraction (0 to 1) of the search done, by circle budget or by radius on a log scale"""
+        if self.exhausted:
+            return 1.0
+        done = self.count / self.max_circles if self.max_circles else 0.0
+        r0, r = self._start_radius, self.current_radius
+        if r0 is not None and np.isfinite(r) and r0 > self.min_radius:
+            done = max(done, np.log(r0 / r) / np.log(r0 / self.min_radius))
+        return float(min(1.0, done))
+
+    def __iter__(self):
+        while not self.exhausted:
+            key, _, i, word, M, c = heapq.heappop(self._heap)
+            if self._start_radius is None and np.isfinite(key):
+                self._start_radius = -key
+            self.radius = min(self.radius, -key)
+            tag = self.base[i][1]
+            if self.accept is not None and not self.accept(c, tag, word):
+                continue
+            if self.region is None or c.contains_infinity or meets_region(c, self.region):
+                self.count += 1
+                yield c, tag, word
+            if self.max_depth is not None and len(word) >= self.max_depth:
+                continue
+            for w in self.Rho.extensions(word, self.alphabet):
+                self._push(i, w, M.dot(self.gens[w[-1]]))
+
+def base_circles(D, vchains, X0, c0):
+    """Base circles for a set of vertex chains: the image of c0 under the holonomy of each chain, tagged by vertex"""
+    return [(c0.transform_gl2(D.hol(ch, X0)), ch[-1].src) for ch in vchains]
+
+class SearchControl:
+    """
+    Cooperative pause/resume/cancel flags shared between a running search
+    and the thread controlling it.  The search calls checkpoint() between
+    units of work.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        # a paused search must wake up to notice
+        self._running.set()
+
+    def pause(self):
+        if not self._cancelled.is_set():
+            self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def checkpoint(self):
+        """Block while paused; return False if the search should stop"""
+        self._running.wait()
+        return not self._cancelled.is_set()
+
+# >>> Parallel search <<<
+
+# A search expected to find fewer circles than this runs in one process unless told otherwise:
+# starting a pool of spawned workers (each importing numpy) takes about as long as one process
+# takes to find that many circles
+MIN_PARALLEL_CIRCLES = 10000
+
+def worker_count(processes=None, circles=None):
+    """
+    Number of worker processes to use; None means one per CPU, or 1 for a search expected to
+    find fewer than MIN_PARALLEL_CIRCLES circles
+    :param circles: the number of circles the search is expected to find (None: unknown)
+    """
+    if processes:
+        return processes
+    if circles is not None and circles < MIN_PARALLEL_CIRCLES:
+        return 1
+    return os.cpu_count() or 1
+
+# Per-process state of pool workers, set once by _init_worker
+_worker = {}
+
+# circles per message from a best-first worker
+CHUNK_SIZE = 500
+
+def _init_worker(Rho, normalization, words, params, results=None, cutoff=None):
+    _worker['Rho'] = Rho
+    _worker['N'] = np.array(normalization, dtype='complex')
+    _worker['words'] = words
+    _worker['params'] = params
+    _worker['results'] = results
+    _worker['cutoff'] = cutoff
+
+def _search_shard(task):
+    """Apply the words to one base circle; returns (index, circle matrices, words)"""
+    i, m = task
+    c0 = circle.Circle(m)
+    Rho, N, words = _worker['Rho'], _worker['N'], _worker['words']
+    found = [(c0.transform_sl2(N.dot(Rho[w])), w) for w in words]
+    mats = np.array([c.m for c, w in found], dtype='complex').reshape((-1, 2, 2))
+    return i, mats, [w for c, w in found]
+
+def _search_part(task):
+    """
+    Best-first search of the orbits of some of the base circles, sending chunks of
+    (worker, base indices, circle matrices, words, OrbitEnumerator.radius at each circle)
+    to the results queue, and (worker, None, None, None, None) at the end; stops early once
+    the circles left are smaller than the shared cutoff radius
+    """
+    k, part = task
+    Rho, N, params = _worker['Rho'], _worker['N'], _worker['params']
+    results, cutoff = _worker['results'], _worker['cutoff']
+    try:
+        local = circle.CircleSet(tol=params['tol'])
+        E = OrbitEnumerator(Rho, [(circle.Circle(m), i) for i, m in part], N, min_radius=params['min_radius'],
+                            max_circles=params['max_circles'], alphabet=params['alphabet'],
+                            accept=lambda c, tag, w: local.add(c), region=params['region'],
+                            margin=params['margin'])
+        def send(chunk):
+            idx, mats, words, radii = zip(*chunk)
+            results.put((k, list(idx), np.array(mats), list(words), list(radii)))
+
+        chunk = []
+        for c, i, w in E:
+            chunk.append((i, c.m, w, E.radius))
+            if len(chunk) == CHUNK_SIZE:
+                send(chunk)
+                chunk = []
+                if E.current_radius < cutoff.value:
+                    break
+        if chunk:
+            send(chunk)
+    finally:
+        results.put((k, None, None, None, None))
+
+class ParallelOrbitSearch:
+    """
+    Orbit search with the base circles (vertex chains) spread over a pool
+    of worker processes, giving the same circles as the serial search.
+
+    Best-first search: the circles of different base circles lie in
+    different orbits (those of different vertices), so each worker runs an
+    OrbitEnumerator on its share of the base circles, deduplicating on its
+    own.  The workers stream their circles in the order of their
+    enumerators, with the radius (OrbitEnumerator.radius) by which each
+    enumerator orders them, and this process merges the streams by those
+    radii, as one enumerator over all base circles would order them,
+    counting the circles against one budget (max_circles).  Once it has
+    received max_circles circles, the smallest of their radii is shared with
+    the workers, which stop when their circles come after it.
+
+    Known words: each worker applies the words to one base circle at a time.
+
+    Iterating yields batches of (circle, tag, word) triples that are new
+    (not in known), in the order of the serial search; the circles that were
+    in known are collected in repeated.  Iteration stops early if control is
+    cancelled; resume_point can be passed as start to a new search to
+    continue where this one stopped.
+    """
+    def __init__(self, Rho, base, normalization=None, known=None, words=None, processes=None,
+                 min_radius=0.00025, max_circles=DEFAULT_MAX_CIRCLES, alphabet=None, region=None,
+                 margin=REGION_MARGIN, tol=1e-5, start=0, control=None):
+        """
+        :param Rho, base, normalization, min_radius, max_circles, alphabet, region, margin: as for
+            OrbitEnumerator (region and margin only restrict a best-first search)
+        :param known: circle.CircleSet of circles already found; new circles are added to it
+        :param words: optional list of words to apply instead of a best-first search
+        :param processes: number of worker processes (default: number of CPUs)
+        :param tol: deduplication tolerance
+        :param start: resume point of an earlier search (see resume_point)
+        :param control: optional SearchControl to pause or cancel the search
+        """
+        self.Rho = Rho
+        self.base = list(base)
+        if normalization is None:
+            normalization = np.eye(2, dtype='complex')
+        self.N = np.array(normalization, dtype='complex')
+        self.known = known if known is not None else circle.CircleSet(tol=tol)
+        self.words = None if words is None else list(words)
+        self.processes = worker_count(processes)
+        self.params = {'min_radius': min_radius, 'max_circles': max_circles, 'alphabet': alphabet, 'region': region,
+                       'margin': margin, 'tol': tol}
+        self.control = control if control is not None else SearchControl()
+        # known words: number of base circles done; best-first: number of circles merged
+        self.shards_done = start
+        self.count = start
+        # circles of the search that were in known (best-first search)
+        self.repeated = []
+        self._start_radius = None
+        self._radius = None
+
+    @property
+    def resume_point(self):
+        return self.count if self.words is None else self.shards_done
+
+    @property
+    def progress(self):
+        """Fraction (0 to 1) of the search done (for a best-first search, as for OrbitEnumerator)"""
+        if self.words is not None:
+            return self.shards_done / len(self.base) if self.base else 1.0
+        max_circles, min_radius = self.params['max_circles'], self.params['min_radius']
+        done = self.count / max_circles if max_circles else 0.0
+        r0, r = self._start_radius, self._radius
+        if r0 is not None and r is not None and np.isfinite(r) and r0 > min_radius:
+            done = max(done, np.log(r0 / r) / np.log(r0 / min_radius))
+        return float(min(1.0, done))
+
+    def _wait(self, get):
+        """get(timeout) from a queue or result iterator, checking control; None if stopped"""
+        while self.control.checkpoint():
+            try:
+                return get(timeout=0.1)
+            except (multiprocessing.TimeoutError, queue.Empty):
+                pass
+        return None
+
+    def __iter__(self):
+        if self.words is None:
+            yield from self._best_first()
+        else:
+            yield from self._known_words()
+
+    def _pool(self, n, *args):
+        # spawn, since forking a process with running Qt threads is unsafe
+        ctx = multiprocessing.get_context('spawn')
+        return ctx, ctx.Pool(n, initializer=_init_worker, initargs=(self.Rho, self.N, self.words, self.params) + args)
+
+    def _known_words(self):
+        tasks = [(i, c.m) for i, (c, tag) in enumerate(self.base)][self.shards_done:]
+        if not tasks:
+            return
+        ctx, pool = self._pool(min(self.processes, len(tasks)))
+        try:
+            # ordered, so that shards_done is a deterministic resume point
+            results = pool.imap(_search_shard, tasks)
+            for _ in tasks:
+                r = self._wait(results.next)
+                if r is None:
+                    return
+                i, mats, words = r
+                tag = self.base[i][1]
+                batch = []
+                for c, w in zip(circle.CircleArray(mats, copy=False), words):
+                    if self.known.add(c):
+                        batch.append((c, tag, w))
+                self.shards_done += 1
+                yield batch
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _best_first(self):
+        if not self.base:
+            return
+        n = min(self.processes, len(self.base))
+        max_circles = self.params['max_circles']
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        cutoff = ctx.Value('d', 0.0, lock=False)
+        ctx, pool = self._pool(n, results, cutoff)
+        # base circles are dealt out to the workers in turn
+        tasks = [(k, [(i, c.m) for i, (c, tag) in enumerate(self.base) if i % n == k]) for k in range(n)]
+        done = pool.map_async(_search_part, tasks)
+        try:
+            # circles received from each worker, as (-radius, base index, circle, word)
+            buffers = [collections.deque() for k in range(n)]
+            running = set(range(n))
+            # (key, worker) of the first circle of each nonempty buffer
+            heads = []
+            # number of running workers with an empty buffer: until it is 0, the next circle is unknown
+            starved = n
+            # radii of the largest max_circles circles received (a min-heap), for the cutoff
+            largest = []
+            count = 0
+            while running or heads:
+                if running:
+                    r = self._wait(results.get)
+                    if r is None:
+                        return
+                    k, idx, mats, words, radii = r
+                    if idx is None:
+                        running.discard(k)
+                        if not buffers[k]:
+                            starved -= 1
+                        if done.ready() and not done.successful():
+                            done.get()
+                    elif idx:
+                        cs = circle.CircleArray(mats, copy=False)
+                        if not buffers[k]:
+                            heapq.heappush(heads, (-radii[0], k))
+                            starved -= 1
+                        buffers[k].extend(zip([-r for r in radii], idx, cs, words))
+                        if max_circles is not None:
+                            for rad in radii:
+                                if len(largest) < max_circles:
+                                    heapq.heappush(largest, rad)
+                                elif rad > largest[0]:
+                                    heapq.heapreplace(largest, rad)
+                            if len(largest) == max_circles:
+                                cutoff.value = largest[0]
+
+                # take the largest next circle of all workers, as long as all next circles are known
+                batch = []
+                while heads and not starved and (max_circles is None or count < max_circles):
+                    key, k = heapq.heappop(heads)
+                    key, i, c, w = buffers[k].popleft()
+                    if buffers[k]:
+                        heapq.heappush(heads, (buffers[k][0][0], k))
+                    elif k in running:
+                        starved += 1
+                    count += 1
+                    if self._start_radius is None and np.isfinite(key):
+                        self._start_radius = -key
+                    self._radius = -key
+                    if count > self.count:
+                        if self.known.add(c):
+                            batch.append((c, self.base[i][1], w))
+                        else:
+                            self.repeated.append(c)
+                self.count = max(self.count, count)
+                if batch:
+                    yield batch
+                if max_circles is not None and count >= max_circles:
+                    return
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,217 @@
+"""Offscreen rendering of circle packings to images and SVG"""
+
+# Renders a packing without the GUI: the circles are found with the
+# same orbit search as the viewer, culled and transformed as whole
+# arrays (see tools.visible_mask), and drawn either with QPainter onto
+# a QImage, using the painter paths of the packing view, or written out
+# as SVG, one element at a time.  Only a QGuiApplication is needed (for
+# QImage painting), so this runs on machines without a display, e.g.
+# with QT_QPA_PLATFORM=offscreen, which main() sets by default.
+#
+# Usage:
+#   python3 render.py genus2-family.cpz packing.png
+#   python3 render.py genus2-family.cpz frame-%04d.png --all --size 1920x1080
+#   python3 render.py genus2-family.cpz packing.svg --packing 1.7320508 --dual-graph
+
+import argparse
+import os
+import sys
+from math import isfinite
+
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor, QGuiApplication, QImage, QPainter
+
+import circle
+import cocycles
+import graphics_view
+import mobius
+import openpacking
+import orbits
+import serialization as ser
+import tools
+
+BACKGROUND = QColor(230, 230, 230, 255)
+
+def packing_circles(D, chains, X, normalization=None, min_radius=0.00025, max_circles=orbits.DEFAULT_MAX_CIRCLES,
+                    words=None, tolerance=1e-5):
+    """
+    Circles of a packing, as found by the viewer (see openpacking.FindWordsThread)
+    :param D: the DCEL
+    :param chains: edge chains of the file (for the holonomy)
+    :param X: the packing (cross ratios)
+    :param normalization: SL(2,C) matrix applied to all circles (default: that of the viewer, see
+        openpacking.surface_group())
+    :param min_radius, max_circles: budget of the best-first search (see orbits.OrbitEnumerator)
+    :param words: optional list of words to apply instead of a best-first search
+    :param tolerance: circles whose centers and radii agree to within this are the same
+    :return: tools.CircleStore of [circle, vertex, dual_graph_part]
+    """
+    Rho, N = openpacking.surface_group(D, chains, X)
+    if normalization is not None:
+        N = normalization
+    vchains = sorted(openpacking.vertex_chains(D, chains), key=lambda ch: ch[-1].src.idx)
+
+    c0 = circle.from_point_angle(0, 0)  # Real line is C0 in the "standard interstice"
+    base = orbits.base_circles(D, vchains, X, c0)
+    # the fundamental domain (circles of the dual graph) comes first
+    store = tools.CircleStore([[c.transform_sl2(N), v, True] for c, v in base])
+
+    seen = circle.CircleSet(tol=tolerance)
+    for c, v, d in store:
+        seen.add(c)
+    found = []
+    if words is None:
+        engine = orbits.OrbitEnumerator(Rho, base, N, min_radius=min_radius, max_circles=max_circles,
+                                        accept=lambda c, v, w: w == '' or seen.add(c))
+        found = [[c, v, False] for c, v, w in engine if w != '']
+    else:
+        for c1, v in base:
+            for w in words:
+                c = c1.transform_sl2(Rho[w]).transform_sl2(N)
+                if seen.add(c):
+                    found.append([c, v, False])
+    store.extend(found)
+    return store
+
+def view_params(width, height, zoom=100, pos=(0, 0)):
+    """display_params of a view (see graphics_view.PackingView)"""
+    return {"zoom": zoom, "pos": list(pos), "center": (width / 2, height / 2), "width": width, "height": height}
+
+def visible_circles(store, T, params):
+    """
+    The circles of store that are visible in a view, after transformation by T
+    :param store: tools.CircleStore
+    :param T: mobius transformation of the packing
+    :param params: see view_params()
+    :return: (circle.CircleArray of the transformed circles, list of their [circle, vertex, dual_graph_part])
+    """
+    cs = store.matrices().transform_sl2(mobius.make_sl2(T))
+    keep = np.flatnonzero(tools.visible_mask(cs, store.dual, params["zoom"], params["pos"], params["center"],
+                                             params["width"], params["height"]))
+    return cs[keep], [store[i] for i in keep.tolist()]
+
+def dual_graph(D, cs, circles):
+    """Segments of the dual graph (see graphics_view.dual_graph_segments) of visible_circles()"""
+    v_to_c = graphics_view.parse_circles((c, ci[1], ci[2]) for c, ci in zip(cs, circles))
+    return graphics_view.dual_graph_segments(D, v_to_c)
+
+def render_image(store, width, height, T=None, zoom=100, pos=(0, 0), D=None):
+    """
+    Draw a packing as the packing view would
+    :param store: tools.CircleStore (see packing_circles())
+    :param T: mobius transformation of the packing (default: none)
+    :param zoom, pos: pixels per unit, and the position of 0 relative to the center of the image
+    :param D: the DCEL, to draw the dual graph (default: no dual graph)
+    :return: QImage
+    """
+    if T is None:
+        T = np.eye(2, dtype='complex')
+    params = view_params(width, height, zoom, pos)
+    cs, circles = visible_circles(store, T, params)
+
+    img = QImage(width, height, QImage.Format_ARGB32)
+    img.fill(BACKGROUND)
+    qp = QPainter(img)
+    qp.setRenderHint(QPainter.Antialiasing)
+    paths, lines = graphics_view.build_circle_paths(cs, [ci[1].valence > 6 for ci in circles])
+    graphics_view.draw_circle_paths(qp, paths, lines, zoom, pos, (width, height))
+    if D is not None:
+        qp.translate(width / 2 + pos[0], height / 2 + pos[1])
+        qp.scale(zoom, zoom)
+        qp.setPen(graphics_view.DUAL_GRAPH_PEN)
+        qp.drawLines(graphics_view.segment_lines(dual_graph(D, cs, circles)))
+    qp.end()
+    return img
+
+def _svg_color(color):
+    return 'rgb(%d,%d,%d)' % (color.red(), color.green(), color.blue())
+
+def write_svg(f, store, width, height, T=None, zoom=100, pos=(0, 0), D=None):
+    """
+    Write a packing as SVG to the text file f, one element per circle (see render_image() for
+    the parameters); coordinates are in pixels, with the styles of the packing view
+    """
+    if T is None:
+        T = np.eye(2, dtype='complex')
+    params = view_params(width, height, zoom, pos)
+    cs, circles = visible_circles(store, T, params)
+    x0, y0 = width / 2 + pos[0], height / 2 + pos[1]
+
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">\n'
+            % (width, height, width, height))
+    f.write('<style>\n')
+    for (red, filled), (pen, brush) in graphics_view.CIRCLE_STYLES.items():
+        fill = 'none'
+        if brush.style() != Qt.NoBrush:
+            fill = '%s;fill-opacity:%.3f' % (_svg_color(brush.color()), brush.color().alphaF())
+        f.write('.c%d%d{stroke:%s;stroke-width:1;fill:%s}\n' % (red, filled, _svg_color(pen.color()), fill))
+    f.write('.dual{stroke:%s;stroke-width:1}\n' % _svg_color(graphics_view.DUAL_GRAPH_PEN.color()))
+    f.write('</style>\n')
+    f.write('<rect width="100%%" height="100%%" fill="%s"/>\n' % _svg_color(BACKGROUND))
+
+    if len(cs):
+        inf = cs.contains_infinity
+        center = np.where(inf, 0, cs.center)
+        radius = np.where(inf, 0, cs.radius)
+        for i, (line, z, r) in enumerate(zip(inf.tolist(), center.tolist(), radius.tolist())):
+            red = circles[i][1].valence > 6
+            if line:
+                s = graphics_view.line_segment(cs[i], pos, (width, height))
+                f.write('<line class="c%d0" x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f"/>\n'
+                        % (red, s.x1(), s.y1(), s.x2(), s.y2()))
+            # only draw circles with radius > 1
+            elif abs(zoom * r) > 1 and isfinite(r):
+                f.write('<circle class="c%d%d" cx="%.2f" cy="%.2f" r="%.2f"/>\n'
+                        % (red, r > 0, x0 + zoom * z.real, y0 + zoom * z.imag, abs(zoom * r)))
+
+    if D is not None:
+        for x1, y1, x2, y2 in dual_graph(D, cs, circles).tolist():
+            f.write('<line class="dual" x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f"/>\n'
+                    % (x0 + zoom * x1, y0 + zoom * y1, x0 + zoom * x2, y0 + zoom * y2))
+    f.write('</svg>\n')
+
+def render_file(fn, store, width, height, T=None, zoom=100, pos=(0, 0), D=None):
+    """Render a packing to fn: SVG if its name ends with .svg, otherwise an image format Qt can write"""
+    if fn.lower().endswith('.svg'):
+        with open(fn, 'w') as f:
+            write_svg(f, store, width, height, T, zoom, pos, D)
+    elif not render_image(store, width, height, T, zoom, pos, D).save(fn):
+        raise OSError('Unable to write %s' % fn)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render circle packings of a packing file without a display')
+    parser.add_argument('file', help='packing file (*.cpz, *.cpj or *.cpb)')
+    parser.add_argument('output', help='output file (.png, .jpg, .svg, ...); with --all, a pattern such as '
+                                       'frame-%%04d.png for the index of each packing')
+    parser.add_argument('--packing', help='key of the packing to render (default: the first)')
+    parser.add_argument('--all', action='store_true', help='render every packing of the file')
+    parser.add_argument('--size', default='900x600', help='WIDTHxHEIGHT in pixels (default: %(default)s)')
+    parser.add_argument('--zoom', type=float, default=100, help='pixels per unit (default: %(default)s)')
+    parser.add_argument('--max-circles', type=int, default=orbits.DEFAULT_MAX_CIRCLES,
+                        help='circle budget of the search (default: %(default)s)')
+    parser.add_argument('--words', help='word list to apply instead of a best-first search')
+    parser.add_argument('--dual-graph', action='store_true', help='draw the dual graph')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+
+    width, height = (int(x) for x in args.size.lower().split('x'))
+    meta, D, chains, P = ser.zloadfn(args.file, cls=cocycles.InterstitialDCEL, lazy=True)
+    keys = openpacking.ordered_packing_keys(P)
+    if not args.all:
+        keys = [args.packing if args.packing is not None else keys[0]]
+    words = openpacking.load_words(args.words) if args.words else None
+
+    for i, key in enumerate(keys):
+        # down to circles of a pixel across
+        store = packing_circles(D, chains, openpacking.packing_by_key(P, key), min_radius=orbits.pixel_radius(args.zoom),
+                                max_circles=args.max_circles, words=words)
+        fn = args.output % i if args.all else args.output
+        render_file(fn, store, width, height, zoom=args.zoom, D=D if args.dual_graph else None)
+        print('%s: packing %s, %d circles' % (fn, key, len(store)))
+
+if __name__ == '__main__':
+    main()
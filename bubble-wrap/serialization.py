@@ -1,17 +1,39 @@
-"""JSON-based serialization of circle packing projective structures"""
+"""JSON-based (and binary) serialization of circle packing projective structures"""
 
 # Conventions for filenames used to store circle packings in the
 # format supported by this module:
 
 # Extension "CPJ" = Circle Packing, JSON
 # Extension "CPZ" = Circle Packing, JSON, gzipped
-
+# Extension "CPB" = Circle Packing, Binary: the content of a CPJ file
+#   in a numpy .npz archive, with the DCEL as int32 columns and the
+#   packings as one float64 matrix (see so_columns()).  Converting
+#   between CPJ/CPZ and CPB (see convert()) loses nothing.  The archive
+#   is not compressed, so the packing matrix can be memory-mapped and
+#   only the packings used are read (see PackingStore).
+#
+# CPJ/CPZ files are loaded by zloadfn() with a streaming parser (see
+# stream_columns()), into the same arrays as a CPB file.
+#
+# Usage (conversion, and listing the packings of a file):
+#   python3 serialization.py genus2-family.cpz genus2-family.cpb
+#   python3 serialization.py genus2-family.cpz
+
+import argparse
+import array
 import base64
+import codecs
 import datetime
 import gzip
 import json
 import os
-from collections import OrderedDict, Mapping
+import queue
+import re
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+from collections.abc import Mapping
 
 import numpy as np
 
@@ -155,24 +177,36 @@ def zstorefn(fn,D,edge_lists=None,packings=None,meta=None,force_compression=Fals
     else:
         mode = 'xt'
 
-    if force_compression or fn_ext.lower() == '.cpz':
+    if fn_ext.lower() == '.cpb':
+        return store_columns(fn,so_columns(serialization_object(D,edge_lists=edge_lists,packings=packings,meta=meta)),
+                             clobber=clobber)
+    elif force_compression or fn_ext.lower() == '.cpz':
         with gzip.open(fn,mode,encoding='utf-8') as fp:
             return json.dump(serialization_object(D,edge_lists=edge_lists,packings=packings,meta=meta),fp,cls=CPPSEncoder)
     else:
         with open(fn,mode,encoding='utf-8') as fp:
             return json.dump(serialization_object(D,edge_lists=edge_lists,packings=packings,meta=meta),fp,cls=CPPSEncoder)        
 
-def zloadfn(fn, force_decompression=False, cls=dcel.IndexedDCEL):
-    """Load DCEL and packings from a file by name, transparently decompressing if necessary"""
+def zloadfn(fn, force_decompression=False, cls=dcel.IndexedDCEL, lazy=False):
+    """Load DCEL and packings from a file by name, transparently decompressing
+    if necessary (or reading the binary format, for CPB).  With lazy, the
+    packings of a CPB file are a PackingStore, read as they are used."""
+
+    fn_base, fn_ext = os.path.splitext(fn)
+    if fn_ext.lower() == '.cpb':
+        return deserialize_columns(load_columns(fn,mmap=lazy),cls=cls)
+    # parsed incrementally (see stream_columns()), as the file is decompressed
+    return deserialize_columns(stream_columns(fn,force_decompression=force_decompression),cls=cls)
 
+def zloadso(fn, force_decompression=False):
+    """Load the serialization object of a CPJ or CPZ file by name"""
     fn_base, fn_ext = os.path.splitext(fn)
     if force_decompression or fn_ext.lower() == '.cpz':
         with gzip.open(fn,'rt',encoding='utf-8') as infile:
-            so = json.load(infile,object_hook=json_numpy_obj_hook)
+            return json.load(infile,object_hook=json_numpy_obj_hook)
     else:
         with open(fn,'rt',encoding='utf-8') as infile:
-            so = json.load(infile,object_hook=json_numpy_obj_hook)
-    return deserialize(so,cls=cls)
+            return json.load(infile,object_hook=json_numpy_obj_hook)
 
 def loadfn(fn, cls=dcel.IndexedDCEL):
     """Load DCEL and packings from a file by name"""
@@ -223,26 +257,613 @@ def deserialize(so, cls=dcel.IndexedDCEL, dcel_ref=None):
         e.src = V[es['src']]
         e.face = F[es['face']]
 
-    # Assemble
+    return assemble(meta, dso['uuid'], V, E, F, so.get('edge_lists'), so.get('packings'), cls=cls)
+
+def assemble(meta, uuid, V, E, F, es, packings, cls=dcel.IndexedDCEL):
+    """Index the linked vertices, edges and faces of a DCEL and resolve its
+    edge lists (given as edge indices, in a dict or list); returns
+    metadata, dcel, edge_lists, packings as deserialize() does
+
+    """
     # TODO: fix None from below
     D0 = dcel.ImmutableDCEL(V, E, F)
     # Index, if applicable
-    D = cocycles.EmbeddedDCEL((cls(D0,set_uuid=dso['uuid']), None))
+    Di = cls(D0,set_uuid=uuid)
+    D = cocycles.EmbeddedDCEL((Di, None))
+    # (indexing again gives a new uuid; keep the one of the file)
+    D.uuid = Di.uuid
 
-    if 'edge_lists' not in so or so['edge_lists'] == None:
+    if es == None:
         edge_lists = None
+    elif isinstance(es,Mapping):
+        # edge_lists is a dict-like
+        edge_lists = { k:list_deref(D.E,v) for k,v in es.items() }
+    else:
+        # edge_lists is a list-like
+        edge_lists = [ list_deref(D.E,v) for v in es ]
+
+    return meta, D, edge_lists, packings
+
+# >>> Binary format (CPB) <<<
+
+def _keyed(x):
+    """Keys (or None, for a list) and values of a dict or list"""
+    if isinstance(x,Mapping):
+        return list(x.keys()), list(x.values())
+    return None, list(x)
+
+def _unkeyed(keys,values):
+    if keys is None:
+        return values
+    return OrderedDict(zip(keys,values))
+
+def so_columns(so):
+    """Arrays of the CPB format for a serialization object (as produced by
+    serialization_object() or read from a CPJ file).  Edge lists are
+    concatenated, with their start offsets; a twin of -1 means none.
+
+    """
+    dso = so['dcel']
+    edges = dso['edges']
+    cols = OrderedDict()
+    cols['metadata'] = np.array(json.dumps(so['metadata']))
+    cols['uuid'] = np.array(dso['uuid'])
+    if float(so['metadata']['schema_version']) < 0.2:
+        cols['vertex_leaving'] = np.array(dso['vertices'],dtype=np.int32)
+    else:
+        cols['vertex_leaving'] = np.array([vs['leaving'] for vs in dso['vertices']],dtype=np.int32)
+        coordinates = [vs['coordinates'] for vs in dso['vertices'] if len(vs['coordinates'])]
+        # (vertices without coordinates are stored with empty ones)
+        if coordinates:
+            cols['vertex_coordinates'] = _vertex_coordinates(coordinates,len(dso['vertices']))
+    for k in ('src','next','prev','face'):
+        cols['edge_'+k] = np.array([es[k] for es in edges],dtype=np.int32)
+    cols['edge_twin'] = np.array([-1 if es['twin'] is None else es['twin'] for es in edges],dtype=np.int32)
+    cols['face_edge'] = np.array(dso['faces'],dtype=np.int32)
+
+    if so.get('edge_lists') is not None:
+        _edge_list_columns(cols,so['edge_lists'])
+    if so.get('packings') is not None:
+        keys, packings = _keyed(so['packings'])
+        if len({len(x) for x in packings}) > 1:
+            raise ValueError('Packings of different lengths cannot be stored as a matrix')
+        cols['packing_keys'] = np.array(json.dumps(keys))
+        cols['packings'] = np.array(packings,dtype=np.float64).reshape((len(packings),-1))
+    return cols
+
+def _vertex_coordinates(coordinates,n):
+    """Column of the coordinates of all n vertices"""
+    if len(coordinates) != n:
+        raise ValueError('Coordinates of %d out of %d vertices' % (len(coordinates),n))
+    return np.array(coordinates,dtype=np.float64).reshape((n,3))
+
+def _edge_list_columns(cols,edge_lists):
+    keys, lists = _keyed(edge_lists)
+    cols['edge_list_keys'] = np.array(json.dumps(keys))
+    cols['edge_list_offsets'] = np.cumsum([0] + [len(l) for l in lists]).astype(np.int64)
+    # (edges are indices in a CPJ file, and HalfEdges in serialization_object())
+    cols['edge_list_edges'] = np.array([e.idx if isinstance(e,dcel.HalfEdge) else e for l in lists for e in l],
+                                       dtype=np.int32)
+
+def columns_so(cols):
+    """Serialization object of the arrays of a CPB file (inverse of so_columns())"""
+    meta = json.loads(str(cols['metadata']))
+    dso = OrderedDict()
+    dso['uuid'] = str(cols['uuid'])
+    leaving = cols['vertex_leaving'].tolist()
+    if 'vertex_coordinates' in cols:
+        dso['vertices'] = [ {"leaving":l, "coordinates":c} for l,c in zip(leaving,cols['vertex_coordinates'].tolist()) ]
+    elif float(meta['schema_version']) < 0.2:
+        dso['vertices'] = leaving
     else:
-        es = so['edge_lists']
-        if isinstance(es,Mapping):
-            # edge_lists is a dict-like
-            edge_lists = { k:list_deref(D.E,v) for k,v in es.items() }
+        dso['vertices'] = [ {"leaving":l, "coordinates":[]} for l in leaving ]
+    dso['edges'] = [ { 'src': s, 'next': n, 'prev': p, 'twin': None if t < 0 else t, 'face': f }
+                     for s,n,p,t,f in zip(*(cols['edge_'+k].tolist() for k in ('src','next','prev','twin','face'))) ]
+    dso['faces'] = cols['face_edge'].tolist()
+
+    so = OrderedDict()
+    so['metadata'] = meta
+    so['dcel'] = dso
+    so['edge_lists'] = _edge_lists(cols)
+    so['packings'] = _packings(cols)
+    return so
+
+def _edge_lists(cols):
+    if 'edge_list_keys' not in cols:
+        return None
+    offsets = cols['edge_list_offsets'].tolist()
+    edges = cols['edge_list_edges'].tolist()
+    lists = [ edges[a:b] for a,b in zip(offsets[:-1],offsets[1:]) ]
+    return _unkeyed(json.loads(str(cols['edge_list_keys'])),lists)
+
+def _packings(cols):
+    if 'packing_keys' not in cols:
+        return None
+    keys = json.loads(str(cols['packing_keys']))
+    if isinstance(cols['packings'],np.memmap):
+        return PackingStore(keys,cols['packings'])
+    return _unkeyed(keys,list(cols['packings']))
+
+class PackingStore(Mapping):
+    """Read-only mapping of keys to the packings (rows) of a packing
+    matrix, usually memory-mapped from a CPB file: listing the keys does
+    not touch the matrix, and looking up a packing reads only its row.
+    Packings stored as a list are given the keys "Packing 0", ... (and
+    listed is set, as these keys are in order as they are, not sorted).
+
+    """
+    def __init__(self,keys,matrix):
+        self.listed = keys is None
+        if keys is None:
+            keys = [ "Packing %d" % i for i in range(len(matrix)) ]
+        self.index = OrderedDict((k,i) for i,k in enumerate(keys))
+        self.matrix = matrix
+
+    def __getitem__(self,key):
+        return np.array(self.matrix[self.index[key]])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+def store_columns(fn,cols,clobber=False):
+    """Write the arrays of a CPB file (see so_columns()) to a file by name"""
+    with open(fn,'wb' if clobber else 'xb') as fp:
+        np.savez(fp,**cols)
+
+def load_columns(fn,mmap=False):
+    """Read the arrays of a CPB file by name, as a dict; with mmap, the
+    packing matrix is memory-mapped instead (if it is stored uncompressed)"""
+    with np.load(fn,allow_pickle=False) as npz:
+        names = npz.files
+        if mmap and 'packings' in names:
+            names = [ k for k in names if k != 'packings' ]
+        cols = { k:npz[k] for k in names }
+    if mmap and 'packing_keys' in cols:
+        cols['packings'] = map_npz_member(fn,'packings')
+    return cols
+
+def map_npz_member(fn,name):
+    """Memory-map an array of a .npz file, or read it if it is compressed"""
+    with zipfile.ZipFile(fn) as zf:
+        info = zf.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(fn,allow_pickle=False) as npz:
+            return npz[name]
+    with open(fn,'rb') as fp:
+        # the member data follow its local file header and the .npy header
+        fp.seek(info.header_offset)
+        header = fp.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise ValueError('Bad zip member header in %s' % fn)
+        name_len, extra_len = struct.unpack('<HH',header[26:30])
+        fp.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(fp)
+        if version == (1,0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
         else:
-            # edge_lists is a list-like
-            edge_lists = [ list_deref(D.E,v) for v in es ]
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+        offset = fp.tell()
+    if not np.prod(shape):
+        # (an empty file region cannot be mapped)
+        return np.zeros(shape,dtype=dtype)
+    return np.memmap(fn,dtype=dtype,mode='r',offset=offset,shape=shape,order='F' if fortran_order else 'C')
 
-    if 'packings' not in so:
-        packings = None
-    else:        
-        packings = so['packings']
+def deserialize_columns(cols, cls=dcel.IndexedDCEL):
+    """Like deserialize(), for the arrays of a CPB file: the DCEL is linked
+    directly from the columns, without building a serialization object.
 
-    return so['metadata'], D, edge_lists, packings
+    Returns: metadata, dcel, edge_lists, packings
+
+    """
+    meta = json.loads(str(cols['metadata']))
+    E = [dcel.HalfEdge() for _ in range(len(cols['edge_src']))]
+    leaving = list_deref(E,cols['vertex_leaving'].tolist())
+    if 'vertex_coordinates' in cols:
+        if len(cols['vertex_coordinates']) != len(leaving):
+            raise ValueError('Coordinates of %d out of %d vertices' % (len(cols['vertex_coordinates']),len(leaving)))
+        V = [dcel.CoordinateVertex(coords=c, leaving=l) for c,l in zip(cols['vertex_coordinates'],leaving)]
+    else:
+        V = [dcel.Vertex(leaving=l) for l in leaving]
+    F = [dcel.Face(edge=e) for e in list_deref(E,cols['face_edge'].tolist())]
+    for e,s,n,p,t,f in zip(E,*(cols['edge_'+k].tolist() for k in ('src','next','prev','twin','face'))):
+        if t >= 0:
+            e.twin = E[t]
+        e.next = E[n]
+        e.prev = E[p]
+        e.src = V[s]
+        e.face = F[f]
+
+    return assemble(meta, str(cols['uuid']), V, E, F, _edge_lists(cols), _packings(cols), cls=cls)
+
+# >>> Streaming loader (CPJ/CPZ) <<<
+
+# Large CPJ/CPZ files are parsed incrementally rather than with
+# json.load: a background thread reads (and decompresses) the file in
+# chunks while the main thread parses them, and the arrays of the DCEL
+# and the packings are decoded one element at a time straight into the
+# columns of the CPB format.  Memory use is bounded by the columns and
+# a few chunks of text, rather than the whole object tree of the file.
+# Values that are not needed are skipped by scanning, without building
+# them, so the metadata and packing keys can be read on their own (see
+# load_index()).
+
+CHUNK_SIZE = 2**16
+# number of chunks read ahead of the parser
+READ_AHEAD = 8
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# text up to the next bracket that is not in a string
+_SKIP = re.compile(r'[^"\\\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\\\[\]{}]*)*',re.S)
+# text that could still be part of a number (including NaN and Infinity)
+_NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*')
+_NUMBERS = re.compile(r'[0-9.eE+\-NaIfinty, \t\n\r]*')
+
+class _ChunkReader:
+    """Text chunks of a binary file object, read in a background thread
+    (which does the decompression of a gzip file, without the GIL)"""
+    def __init__(self,fp,size=None):
+        self.fp = fp
+        self.size = size or CHUNK_SIZE
+        self.queue = queue.Queue(maxsize=READ_AHEAD)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._read,daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        while not self.stop.is_set():
+            try:
+                b = self.fp.read(self.size)
+            except Exception as e:
+                b = e
+            while not self.stop.is_set():
+                try:
+                    self.queue.put(b,timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if not b or isinstance(b,Exception):
+                return
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            b = self.queue.get()
+            if isinstance(b,Exception):
+                raise b
+            text = decoder.decode(b,final=not b)
+            if text:
+                yield text
+            if not b:
+                return
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+class JSONStream:
+    """Incremental parser for a JSON text arriving in chunks.  Containers
+    are walked with members() and items(); their elements are parsed with
+    value() or skipped with skip()."""
+    _decoder = json.JSONDecoder()
+
+    def __init__(self,chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+
+    def _more(self,grow=False):
+        """Append the next chunk to the buffer, dropping the text already parsed.
+        With grow, append as many chunks as to (at least) double the text left to
+        parse, so that parsing a value over and over as it arrives stays linear.
+
+        """
+        want = len(self.buf) - self.pos if grow else 0
+        chunks, size = [], 0
+        for chunk in self.chunks:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= want:
+                break
+        if not chunks:
+            return False
+        self.buf = self.buf[self.pos:] + ''.join(chunks)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next character that is not whitespace (None at the end), without consuming it"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf,self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return None
+
+    def expect(self,c):
+        if self.peek() != c:
+            raise ValueError('Expected %r in JSON, found %r' % (c,self.peek()))
+        self.pos += 1
+
+    def value(self,decoder=None):
+        """Parse the next value"""
+        decoder = decoder or self._decoder
+        self.peek()
+        while True:
+            try:
+                v, end = decoder.raw_decode(self.buf,self.pos)
+            except json.JSONDecodeError:
+                # the value may continue in the next chunk
+                if not self._more(grow=True):
+                    raise
+                continue
+            # a number may go on in the next chunk (e.g. "1." of "1.5")
+            if _NUMBER_TAIL.match(self.buf,end).end() == len(self.buf) and self._more(grow=True):
+                continue
+            self.pos = end
+            return v
+
+    def numbers(self):
+        """Parse the next value, if it is an array of numbers, as a float64 array,
+        converting the text of a chunk at a time; otherwise return None, having
+        consumed nothing
+
+        """
+        self.expect('[')
+        if self.peek() in ('[','{','"'):
+            # (put the bracket back, which peek() may have dropped from the buffer)
+            self.buf = '[' + self.buf[self.pos:]
+            self.pos = 0
+            return None
+        parts = []
+        while True:
+            end = _NUMBERS.match(self.buf,self.pos).end()
+            if end == len(self.buf):
+                # the array goes on in the next chunk: convert up to the last comma
+                cut = self.buf.rfind(',',self.pos,end)
+                if cut >= 0:
+                    parts.append(_floats(self.buf[self.pos:cut]))
+                    self.pos = cut + 1
+                if not self._more():
+                    raise ValueError('Unexpected end of JSON')
+                continue
+            if self.buf[end] != ']':
+                raise ValueError('Unexpected %r in an array of numbers in JSON' % self.buf[end])
+            text = self.buf[self.pos:end]
+            self.pos = end + 1
+            if text.strip():
+                parts.append(_floats(text))
+            return np.concatenate(parts) if parts else np.zeros(0)
+
+    def skip(self):
+        """Skip the next value, only scanning its text"""
+        if self.peek() not in ('[','{'):
+            self.value()
+            return
+        depth = 0
+        while True:
+            self.pos = _SKIP.match(self.buf,self.pos).end()
+            # (stopped at the end of the buffer, or at a string that continues in the next chunk)
+            if self.pos == len(self.buf) or self.buf[self.pos] == '"':
+                if not self._more(grow=True):
+                    raise ValueError('Unexpected end of JSON')
+                continue
+            c = self.buf[self.pos]
+            self.pos += 1
+            if c in '[{':
+                depth += 1
+            elif c in ']}':
+                depth -= 1
+                if depth == 0:
+                    return
+            else:
+                raise ValueError('Unexpected %r in JSON' % c)
+
+    def _elements(self,close):
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            c = self.peek()
+            self.pos += 1
+            if c == close:
+                return
+            if c != ',':
+                raise ValueError('Expected %r or %r in JSON, found %r' % (',',close,c))
+
+    def members(self):
+        """Iterate over the keys of an object; the value of each is to be read before the next"""
+        self.expect('{')
+        for _ in self._elements('}'):
+            key = self.value()
+            self.expect(':')
+            yield key
+
+    def items(self):
+        """Iterate over the elements of an array (yielding their indices), each to be read before the next"""
+        self.expect('[')
+        for i, _ in enumerate(self._elements(']')):
+            yield i
+
+    def null(self):
+        """Consume a null value, if that is what comes next"""
+        if self.peek() == 'n':
+            self.value()
+            return True
+        return False
+
+def _floats(text):
+    """float64 array of comma-separated JSON numbers"""
+    return np.array(text.split(','),dtype=np.float64)
+
+class _open_stream:
+    """Context manager giving a JSONStream of a CPJ or CPZ file by name"""
+    def __init__(self,fn,force_decompression=False):
+        fn_base, fn_ext = os.path.splitext(fn)
+        if force_decompression or fn_ext.lower() == '.cpz':
+            self.fp = gzip.open(fn,'rb')
+        else:
+            self.fp = open(fn,'rb')
+        self.reader = _ChunkReader(self.fp)
+
+    def __enter__(self):
+        return JSONStream(self.reader)
+
+    def __exit__(self,*exc):
+        self.reader.close()
+        self.fp.close()
+
+def _stream_dcel(s,cols):
+    """Read the DCEL of a CPJ file into the columns of the CPB format"""
+    leaving, coordinates = array.array('i'), array.array('d')
+    edges = { k:array.array('i') for k in ('src','next','prev','twin','face') }
+    faces = array.array('i')
+    for key in s.members():
+        if key == 'uuid':
+            cols['uuid'] = np.array(s.value())
+        elif key == 'vertices':
+            for _ in s.items():
+                vs = s.value()
+                if isinstance(vs,int):
+                    leaving.append(vs)
+                else:
+                    leaving.append(vs['leaving'])
+                    # (vertices without coordinates are stored with empty ones)
+                    coordinates.extend(vs['coordinates'])
+        elif key == 'edges':
+            for _ in s.items():
+                es = s.value()
+                for k in ('src','next','prev','face'):
+                    edges[k].append(es[k])
+                edges['twin'].append(-1 if es['twin'] is None else es['twin'])
+        elif key == 'faces':
+            for _ in s.items():
+                faces.append(s.value())
+        else:
+            s.skip()
+    cols['vertex_leaving'] = np.frombuffer(leaving,dtype=np.intc).astype(np.int32)
+    if len(coordinates):
+        cols['vertex_coordinates'] = _vertex_coordinates(np.frombuffer(coordinates,dtype=np.float64).reshape((-1,3)),
+                                                         len(leaving))
+    for k in ('src','next','prev','face','twin'):
+        cols['edge_'+k] = np.frombuffer(edges[k],dtype=np.intc).astype(np.int32)
+    cols['face_edge'] = np.frombuffer(faces,dtype=np.intc).astype(np.int32)
+
+def _stream_packings(s,cols):
+    """Read the packings of a CPJ file into a matrix, one packing at a time"""
+    decoder = json.JSONDecoder(object_hook=json_numpy_obj_hook)
+    if s.null():
+        return
+    keys = [] if s.peek() == '{' else None
+    entries = s.members() if keys is not None else s.items()
+    matrix, n = None, 0
+    for key in entries:
+        # (plain lists are converted without building a float object per number)
+        x = s.numbers() if s.peek() == '[' else None
+        if x is None:
+            x = np.asarray(s.value(decoder),dtype=np.float64).reshape(-1)
+        if keys is not None:
+            keys.append(key)
+        if matrix is None:
+            matrix = np.empty((16,len(x)))
+        elif len(x) != matrix.shape[1]:
+            raise ValueError('Packings of different lengths cannot be stored as a matrix')
+        elif n == len(matrix):
+            matrix = np.concatenate((matrix,np.empty_like(matrix)))
+        matrix[n] = x
+        n += 1
+    cols['packing_keys'] = np.array(json.dumps(keys))
+    cols['packings'] = matrix[:n] if matrix is not None else np.zeros((0,0))
+
+def stream_columns(fn,force_decompression=False):
+    """Arrays of the CPB format (see so_columns()) of a CPJ or CPZ file by
+    name, parsed incrementally (see the comment above)"""
+    cols = OrderedDict()
+    with _open_stream(fn,force_decompression) as s:
+        for key in s.members():
+            if key == 'metadata':
+                cols['metadata'] = np.array(json.dumps(s.value()))
+            elif key == 'dcel':
+                _stream_dcel(s,cols)
+            elif key == 'edge_lists':
+                if not s.null():
+                    _edge_list_columns(cols,s.value())
+            elif key == 'packings':
+                _stream_packings(s,cols)
+            else:
+                s.skip()
+    return cols
+
+def load_index(fn,force_decompression=False):
+    """Metadata and packing keys (or None, if there are no packings) of a
+    file by name, without loading its DCEL or packings; packings stored as
+    a list are given the keys "Packing 0", ... (as by PackingStore)
+
+    """
+    fn_base, fn_ext = os.path.splitext(fn)
+    if fn_ext.lower() == '.cpb':
+        with np.load(fn,allow_pickle=False) as npz:
+            meta = json.loads(str(npz['metadata']))
+            if 'packing_keys' not in npz.files:
+                return meta, None
+            return meta, list(PackingStore(json.loads(str(npz['packing_keys'])),
+                                           map_npz_member(fn,'packings')))
+
+    meta, keys = None, None
+    with _open_stream(fn,force_decompression) as s:
+        for key in s.members():
+            if key == 'metadata':
+                meta = s.value()
+            elif key == 'packings' and not s.null():
+                keys = []
+                if s.peek() == '{':
+                    for k in s.members():
+                        keys.append(k)
+                        s.skip()
+                else:
+                    for i in s.items():
+                        keys.append("Packing %d" % i)
+                        s.skip()
+            else:
+                s.skip()
+    return meta, keys
+
+def convert(src, dst, clobber=False):
+    """Convert a file between CPJ/CPZ and CPB (by the extensions of the file
+    names), keeping its metadata and contents as they are
+
+    """
+    fn_base, fn_ext = os.path.splitext(dst)
+    if os.path.splitext(src)[1].lower() == '.cpb':
+        so = columns_so(load_columns(src))
+    elif fn_ext.lower() == '.cpb':
+        store_columns(dst,stream_columns(src),clobber=clobber)
+        return
+    else:
+        so = zloadso(src)
+
+    if fn_ext.lower() == '.cpb':
+        store_columns(dst,so_columns(so),clobber=clobber)
+    else:
+        mode = 'wt' if clobber else 'xt'
+        opener = gzip.open if fn_ext.lower() == '.cpz' else open
+        with opener(dst,mode,encoding='utf-8') as fp:
+            json.dump(so,fp,cls=CPPSEncoder)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert circle packing files between CPJ/CPZ and CPB')
+    parser.add_argument('src', help='input file (*.cpj, *.cpz or *.cpb)')
+    parser.add_argument('dst', nargs='?', help='output file (*.cpj, *.cpz or *.cpb); if omitted, the metadata '
+                                               'and packing keys of src are listed')
+    parser.add_argument('-f', '--force', action='store_true', help='overwrite dst if it exists')
+    args = parser.parse_args()
+    if args.dst is None:
+        meta, keys = load_index(args.src)
+        print(json.dumps(meta, indent=2))
+        for k in keys or []:
+            print(k)
+    else:
+        convert(args.src, args.dst, clobber=args.force)
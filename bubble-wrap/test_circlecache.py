@@ -0,0 +1,50 @@
+# Run with: python3 -m pytest test_circlecache.py (from this directory)
+
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import circle
+import circlecache
+import cocycles
+import openpacking
+import orbits
+import serialization as ser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample-data', 'genus2-family.cpz')
+
+def load_key(fn, packing):
+    """(DCEL, cache key of a best-first search) of a packing of a file, as FindWordsThread makes them"""
+    meta, D, chains, P = ser.zloadfn(fn, cls=cocycles.InterstitialDCEL)
+    X = openpacking.packing_by_key(P, packing)
+    Rho, N = openpacking.surface_group(D, chains, X)
+    return D, circlecache.packing_key(D, packing, circlecache.packing_hash(X, Rho, N),
+                                      circlecache.word_source(None), (1e-3, 1000))
+
+def test_key_survives_reloading():
+    D1, k1 = load_key(SAMPLE, '50.0')
+    D2, k2 = load_key(SAMPLE, '50.0')
+    assert D1.uuid == D2.uuid
+    assert k1 == k2
+
+def test_key_depends_on_packing_values(tmp_path):
+    """Files of the same triangulation, with list packings under the same keys"""
+    meta, D, chains, P = ser.zloadfn(SAMPLE)
+    keys = openpacking.ordered_packing_keys(P)
+    for i, order in enumerate((keys, keys[::-1])):
+        ser.zstorefn(str(tmp_path / ('%d.cpz' % i)), D, edge_lists=chains, packings=[P[k] for k in order])
+    (D1, k1), (D2, k2) = load_key(str(tmp_path / '0.cpz'), 'Packing 0'), load_key(str(tmp_path / '1.cpz'), 'Packing 0')
+    assert D1.uuid == D2.uuid
+    assert k1 != k2
+
+def test_hit_after_reloading(tmp_path):
+    meta, D, chains, P = ser.zloadfn(SAMPLE, cls=cocycles.InterstitialDCEL)
+    vchains = sorted(openpacking.vertex_chains(D, chains), key=lambda ch: ch[-1].src.idx)
+    circles = [[c, v, True] for c, v in orbits.base_circles(D, vchains, P['50.0'], circle.from_point_angle(0, 0))]
+    cache = circlecache.CircleCache(str(tmp_path))
+    cache.store(load_key(SAMPLE, '50.0')[1], circles)
+
+    D2, key = load_key(SAMPLE, '50.0')
+    loaded = cache.load(key, D2)
+    assert loaded is not None
+    assert [v.idx for c, v, d in loaded] == [v.idx for c, v, d in circles]
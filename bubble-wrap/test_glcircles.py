@@ -0,0 +1,133 @@
+# Run with: python3 -m pytest test_glcircles.py (from this directory)
+#
+# Draws with Mesa's software renderer into an offscreen framebuffer, through a surfaceless
+# EGL context; skipped where there is none.
+
+import ctypes
+import os
+
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
+
+import numpy as np
+import pytest
+
+import circle
+import mobius
+
+SIZE = 64
+BACKGROUND = 230
+
+@pytest.fixture(scope='module')
+def gl():
+    """OpenGL 3.3 context with a SIZE x SIZE framebuffer"""
+    try:
+        from OpenGL import EGL, GL, platform
+        if not type(platform.PLATFORM).__name__.startswith('EGL'):
+            pytest.skip('PyOpenGL was loaded for another platform')
+        dpy = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not EGL.eglInitialize(dpy, None, None):
+            pytest.skip('no EGL display')
+    except Exception as e:
+        pytest.skip('no EGL: %s' % e)
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    cfg, n = EGL.EGLConfig(), EGL.EGLint()
+    attrs = (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                             EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_NONE)
+    EGL.eglChooseConfig(dpy, attrs, ctypes.pointer(cfg), 1, ctypes.pointer(n))
+    ctx_attrs = (EGL.EGLint * 5)(EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3, EGL.EGL_NONE)
+    ctx = EGL.eglCreateContext(dpy, cfg, EGL.EGL_NO_CONTEXT, ctx_attrs) if n.value else None
+    if not ctx or not EGL.eglMakeCurrent(dpy, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, ctx):
+        pytest.skip('no OpenGL 3.3 context')
+
+    fbo = GL.glGenFramebuffers(1)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+    rb = GL.glGenRenderbuffers(1)
+    GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, rb)
+    GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGBA8, SIZE, SIZE)
+    GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, rb)
+    GL.glViewport(0, 0, SIZE, SIZE)
+    yield GL
+    EGL.eglMakeCurrent(dpy, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+    EGL.eglDestroyContext(dpy, ctx)
+
+@pytest.fixture
+def renderer(gl):
+    import glcircles
+    r = glcircles.CircleRenderer(capacity=2)
+    yield r
+    r.delete()
+
+def draw(gl, renderer, T, zoom, center):
+    """The image drawn by renderer, with the view center in the middle, as (y, x, rgb) array"""
+    gl.glClearColor(BACKGROUND / 255, BACKGROUND / 255, BACKGROUND / 255, 1)
+    gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+    renderer.draw(T, zoom, center, (SIZE / 2, SIZE / 2), (SIZE, SIZE))
+    data = gl.glReadPixels(0, 0, SIZE, SIZE, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE)
+    return np.frombuffer(data, dtype=np.uint8).reshape(SIZE, SIZE, 4)[::-1, :, :3].astype(int)
+
+def circles(*pairs):
+    return circle.CircleArray.from_circles(circle.from_center_radius(c, r) for c, r in pairs)
+
+# in a view of zoom 64 centered at 0: a black disc in the middle, a small red one top left, and
+# the outside of a circle bottom right
+DISCS = ((0, 0.2), (-0.3 - 0.3j, 0.08), (0.3 + 0.3j, -0.08))
+STYLES = (0, 1, 0)
+
+def assert_disc(image, x, y, radius, filled=True, color=(0, 0, 0)):
+    """A circle centered at pixel x, y: outlined in color, and filled or not"""
+    inside = np.abs(image[int(y), int(x)] - BACKGROUND).max()
+    assert inside > 30 if filled else inside == 0
+    # (the outline may fall between two pixels)
+    outline = image[int(y), int(x + radius) - 1:int(x + radius) + 2]
+    assert np.abs(outline - color).max(axis=1).min() < 120
+    assert np.all(image[int(y), int(x + radius) + 3] == BACKGROUND)
+
+def assert_discs(image):
+    assert_disc(image, 32, 32, 12.8)
+    assert_disc(image, 12.8, 12.8, 5.12, color=(255, 0, 0))
+    assert_disc(image, 51.2, 51.2, 5.12, filled=False)
+
+def test_draws_circles(gl, renderer):
+    I = np.eye(2)
+    renderer.set_frame(I, 0)
+    # more circles than the capacity, in batches
+    renderer.append(circles(*DISCS[:2]), STYLES[:2])
+    renderer.append(circles(*DISCS[2:]), STYLES[2:])
+    assert renderer.count == 3 and renderer.capacity >= 3
+    assert_discs(draw(gl, renderer, I, 64, 0))
+
+    # panning and zooming only change the transformation passed to draw()
+    image = draw(gl, renderer, I, 128, 0.05)
+    assert_disc(image, 32 - 0.05 * 128, 32, 25.6)
+
+def test_deep_zoom(gl, renderer):
+    I = np.eye(2)
+    z, r, zoom = 0.3 + 0.1j, 2e-8, 1e9
+    renderer.set_frame(I, z + 1e-7)
+    renderer.append(circles((z, r)), [0])
+    assert renderer.frame_offset(I, zoom, z) == pytest.approx(100)
+    assert_disc(draw(gl, renderer, I, zoom, z), 32, 32, 20)
+    assert_disc(draw(gl, renderer, I, zoom, z + 5e-9), 27, 32, 20)
+    # a view far from the anchor needs a new frame
+    assert renderer.frame_offset(I, zoom, 0) > 1e8
+
+def test_mobius(gl, renderer):
+    # the circles that the transformation takes to DISCS
+    T = mobius.make_sl2(np.array(((1, 0.2j), (0.5, 1.2))))
+    renderer.set_frame(np.eye(2), 0.1)
+    renderer.append(circles(*DISCS).transform_sl2(mobius.sl2inv(T)), STYLES)
+    assert_discs(draw(gl, renderer, T, 64, 0))
+
+def test_lines_are_left_out(gl, renderer):
+    I = np.eye(2)
+    renderer.set_frame(I, 0)
+    renderer.append(circles((0, 0.1)), [0])
+    renderer.append(circle.CircleArray.from_circles([circle.from_point_angle(0, 0.3)]), [0])
+    np.testing.assert_array_equal(renderer.lines, [1])
+    assert_disc(draw(gl, renderer, I, 64, 0), 32, 32, 6.4)
+    # the circle is too large to be drawn precisely
+    assert np.all(draw(gl, renderer, I, 1e8, 0.1) == BACKGROUND)
+    renderer.clear()
+    assert np.all(draw(gl, renderer, I, 64, 0) == BACKGROUND)
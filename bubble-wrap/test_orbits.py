@@ -0,0 +1,160 @@
+# Run with: python3 -m pytest test_orbits.py (from this directory)
+
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+import pytest
+
+import circle
+import cocycles
+import mobius
+import openpacking
+import orbits
+import serialization as ser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample-data', 'genus2-family.cpz')
+
+@pytest.fixture(scope='module')
+def genus2():
+    meta, D, chains, P = ser.zloadfn(SAMPLE, cls=cocycles.InterstitialDCEL)
+    X = P['50.0']
+    Rho, N = openpacking.surface_group(D, chains, X)
+    vchains = sorted(openpacking.vertex_chains(D, chains), key=lambda ch: ch[-1].src.idx)
+    base = orbits.base_circles(D, vchains, X, circle.from_point_angle(0, 0))
+    fundamental = [c.transform_sl2(N) for c, v in base]
+    return Rho, N, base, fundamental
+
+def serial_search(Rho, N, base, fundamental, **kw):
+    """Circles of the serial search of FindWordsThread"""
+    seen = circle.CircleSet(tol=1e-5)
+    for c in fundamental:
+        seen.add(c)
+    engine = orbits.OrbitEnumerator(Rho, base, N, accept=lambda c, v, w: w == '' or seen.add(c), **kw)
+    return [(c, v) for c, v, w in engine if w != '']
+
+def parallel_search(Rho, N, base, fundamental, **kw):
+    known = circle.CircleSet(tol=1e-5)
+    for c in fundamental:
+        known.add(c)
+    search = orbits.ParallelOrbitSearch(Rho, base, N, known=known, processes=3, tol=1e-5, **kw)
+    return [(c, v) for batch in search for c, v, w in batch]
+
+@pytest.mark.parametrize('budget', [dict(min_radius=1e-3, max_circles=1500),
+                                    dict(min_radius=5e-3, max_circles=None),
+                                    dict(min_radius=5e-4, max_circles=200,
+                                         region=circle.from_center_radius(0.6 - 0.5j, 0.08))])
+def test_parallel_matches_serial(genus2, budget):
+    serial = serial_search(*genus2, **budget)
+    parallel = parallel_search(*genus2, **budget)
+    assert len(parallel) == len(serial)
+    found = circle.CircleSet(tol=1e-9)
+    for c, v in serial:
+        found.add(c)
+    assert not any(found.add(c) for c, v in parallel)
+    # the same circles for the same vertices, in the same order
+    assert [v.idx for c, v in parallel] == [v.idx for c, v in serial]
+
+def test_parallel_resume(genus2):
+    budget = dict(min_radius=1e-3, max_circles=1500)
+    serial = serial_search(*genus2, **budget)
+    Rho, N, base, fundamental = genus2
+    known = circle.CircleSet(tol=1e-5)
+    for c in fundamental:
+        known.add(c)
+    first = orbits.ParallelOrbitSearch(Rho, base, N, known=known, processes=3, **budget)
+    it = iter(first)
+    head = [(c, v) for c, v, w in next(it)]
+    it.close()
+    rest = orbits.ParallelOrbitSearch(Rho, base, N, known=known, processes=3, start=first.resume_point, **budget)
+    tail = [(c, v) for batch in rest for c, v, w in batch]
+    assert [v.idx for c, v in head + tail] == [v.idx for c, v in serial]
+
+REGION_BUDGET = dict(min_radius=5e-4, max_circles=None)
+
+@pytest.fixture(scope='module')
+def full_search(genus2):
+    return serial_search(*genus2, **REGION_BUDGET)
+
+@pytest.mark.parametrize('center, radius', [(0.6 - 0.5j, 0.08), (0.9, 0.05), (0.7j, 0.02), (-0.5 + 0.1j, -0.9)])
+def test_region_search(genus2, full_search, center, radius):
+    """A search restricted to a region finds the circles of the full search meeting it"""
+    region = circle.from_center_radius(center, abs(radius))
+    if radius < 0:
+        # the outside of the circle
+        region = circle.Circle(-region.m)
+    inside = [c for c, v in full_search if c.contains_infinity or orbits.meets_region(c, region)]
+    found = serial_search(*genus2, region=region, **REGION_BUDGET)
+    assert len(found) == len(inside)
+    s = circle.CircleSet(tol=1e-9)
+    for c, v in found:
+        s.add(c)
+    assert not any(s.add(c) for c in inside)
+
+def test_region_margin(genus2):
+    """Circles outside a region have images in it: too small a margin misses them, as missed_circles tells"""
+    budget = dict(min_radius=5e-3, max_circles=None)
+    region = circle.from_center_radius(0.6 - 0.5j, 0.08)
+    full = [c for c, v in serial_search(*genus2, **budget)]
+    narrow = [c for c, v in serial_search(*genus2, region=region, margin=4, **budget)]
+    missed = orbits.missed_circles(full, narrow, region, budget['min_radius'])
+    assert missed and all(orbits.meets_region(c, region) for c in missed)
+    for margin in orbits.REGION_MARGINS:
+        found = [c for c, v in serial_search(*genus2, region=region, margin=margin, **budget)]
+        assert not orbits.missed_circles(full, found, region, budget['min_radius'])
+
+    # a parallel search collects the circles it finds again
+    Rho, N, base, fundamental = genus2
+    known = circle.CircleSet(tol=1e-5)
+    for c in fundamental + full:
+        known.add(c)
+    for margin, missing in ((4, len(missed)), (None, 0)):
+        search = orbits.ParallelOrbitSearch(Rho, base, N, known=known, processes=3, region=region, margin=margin,
+                                            **budget)
+        assert not [c for batch in search for c, v, w in batch]
+        assert len(orbits.missed_circles(full, search.repeated, region, budget['min_radius'])) == missing
+
+def test_view_region():
+    T = np.array([[1, 0.3], [0.8 + 0.5j, 1.24]], dtype='complex')
+    T = T / np.sqrt(np.linalg.det(T))
+    rect = (-0.2, 0.4, -0.1, 0.25)
+    region = orbits.view_region(rect, T)
+    assert region.radius > 0
+    # points of the rectangle pulled back by T lie in the region (its corners on the boundary),
+    # points outside the circle around the rectangle do not
+    for x, y in [(-0.2, -0.1), (0.4, 0.25), (0.1, 0.0), (0.4, -0.1)]:
+        z = mobius.transform_point(mobius.sl2inv(T), complex(x, y))
+        assert abs(z - region.center) < region.radius * (1 + 1e-9)
+    z = mobius.transform_point(mobius.sl2inv(T), complex(2, 0))
+    assert abs(z - region.center) > region.radius
+
+    # a view around the image of infinity covers the outside of a circle
+    w = T[0, 0] / T[1, 0]
+    rect = (w.real - 0.1, w.real + 0.1, w.imag - 0.1, w.imag + 0.1)
+    region = orbits.view_region(rect, T)
+    assert region.radius < 0
+    for z in [1e6, -1e6j, mobius.transform_point(mobius.sl2inv(T), w + 0.1 + 0.1j)]:
+        assert abs(z - region.center) > -region.radius
+    assert abs(mobius.transform_point(mobius.sl2inv(T), w + 1) - region.center) < -region.radius
+
+def test_region_contains():
+    big, small = circle.from_center_radius(0, 1), circle.from_center_radius(0.5, 0.25)
+    far = circle.from_center_radius(3, 0.5)
+    outside = lambda c: circle.Circle(-c.m)
+    assert orbits.region_contains(None, small)
+    assert not orbits.region_contains(small, None)
+    assert orbits.region_contains(big, small) and not orbits.region_contains(small, big)
+    assert orbits.region_contains(outside(big), far) and not orbits.region_contains(outside(big), small)
+    assert orbits.region_contains(outside(small), outside(big))
+    assert not orbits.region_contains(outside(big), outside(small))
+    assert not orbits.region_contains(big, outside(small))
+    assert orbits.region_contains(big, big)
+
+def test_worker_count():
+    cpus = os.cpu_count() or 1
+    assert orbits.worker_count() == cpus
+    assert orbits.worker_count(3) == orbits.worker_count(3, 10) == 3
+    # small searches run in one process, unless told otherwise
+    assert orbits.worker_count(None, orbits.MIN_PARALLEL_CIRCLES - 1) == 1
+    assert orbits.worker_count(None, orbits.MIN_PARALLEL_CIRCLES) == cpus
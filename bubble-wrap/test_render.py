@@ -0,0 +1,78 @@
+# Run with: python3 -m pytest test_render.py (from this directory)
+
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+from PyQt5.QtGui import QGuiApplication, QImage
+
+import cocycles
+import openpacking
+import orbits
+import render
+import serialization as ser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample-data', 'genus2-family.cpz')
+
+def test_list_packings_by_key(tmp_path):
+    """Packings stored as a list are rendered by index, also past "Packing 9" (not in sorted key order)"""
+    meta, D, chains, P = ser.zloadfn(SAMPLE)
+    X = np.asarray(next(iter(P.values())), dtype=np.float64)
+    fn = str(tmp_path / 'list.cpz')
+    ser.zstorefn(fn, D, edge_lists=chains, packings=[X + i for i in range(12)])
+    ser.convert(fn, str(tmp_path / 'list.cpb'))
+    for fn, lazy in ((fn, False), (str(tmp_path / 'list.cpb'), True)):
+        P = ser.zloadfn(fn, lazy=lazy)[3]
+        keys = openpacking.ordered_packing_keys(P)
+        assert keys == ['Packing %d' % i for i in range(12)]
+        for i, key in enumerate(keys):
+            assert np.array_equal(openpacking.packing_by_key(P, key), X + i)
+
+WIDTH, HEIGHT, ZOOM = 160, 120, 50
+
+@pytest.fixture(scope='module')
+def packing():
+    """A QGuiApplication (for painting), the DCEL and the circles of a small packing"""
+    app = QGuiApplication.instance() or QGuiApplication([])
+    meta, D, chains, P = ser.zloadfn(SAMPLE, cls=cocycles.InterstitialDCEL)
+    store = render.packing_circles(D, chains, P['50.0'], min_radius=orbits.pixel_radius(ZOOM), max_circles=500)
+    return app, D, store
+
+def image_pixels(img):
+    """The pixels of a QImage, as (y, x) array of 0xAARRGGBB"""
+    img = img.convertToFormat(QImage.Format_ARGB32)
+    data = np.frombuffer(img.constBits().asstring(img.sizeInBytes()), dtype=np.uint32)
+    return data.reshape(img.height(), -1)[:, :img.width()]
+
+@pytest.mark.parametrize('dual', [False, True])
+def test_render_png(tmp_path, packing, dual):
+    app, D, store = packing
+    fn = str(tmp_path / 'packing.png')
+    render.render_file(fn, store, WIDTH, HEIGHT, zoom=ZOOM, D=D if dual else None)
+    img = QImage(fn)
+    assert (img.width(), img.height()) == (WIDTH, HEIGHT)
+    pixels = image_pixels(img)
+    drawn = np.count_nonzero(pixels != render.BACKGROUND.rgba())
+    assert 0.05 * pixels.size < drawn < pixels.size
+    # the same as drawn directly
+    assert np.array_equal(pixels, image_pixels(render.render_image(store, WIDTH, HEIGHT, zoom=ZOOM,
+                                                                   D=D if dual else None)))
+
+def test_render_svg(tmp_path, packing):
+    app, D, store = packing
+    fn = str(tmp_path / 'packing.svg')
+    render.render_file(fn, store, WIDTH, HEIGHT, zoom=ZOOM, pos=(10, -5))
+    root = ET.parse(fn).getroot()
+    ns = {'svg': 'http://www.w3.org/2000/svg'}
+    assert (root.get('width'), root.get('height')) == (str(WIDTH), str(HEIGHT))
+    # one element per visible circle at least a pixel across
+    cs, circles = render.visible_circles(store, np.eye(2), render.view_params(WIDTH, HEIGHT, ZOOM, (10, -5)))
+    radius = np.abs(cs.radius[~cs.contains_infinity])
+    expected = np.count_nonzero(np.isfinite(radius) & (ZOOM * radius > 1))
+    assert expected > 10
+    assert len(root.findall('svg:circle', ns)) == expected
+    assert len(root.findall('svg:line', ns)) == np.count_nonzero(cs.contains_infinity)
@@ -0,0 +1,81 @@
+# Run with: python3 -m pytest test_serialization.py (from this directory)
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import serialization as ser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample-data', 'genus2-family.cpz')
+
+def assert_same_columns(a, b):
+    assert list(a) == list(b)
+    for k in a:
+        assert a[k].dtype == b[k].dtype, k
+        assert np.array_equal(a[k], b[k]), k
+
+@pytest.fixture(scope='module')
+def plain_cpj(tmp_path_factory):
+    """The sample file as CPJ, with plain-list packings and a top-level float after them"""
+    so = ser.zloadso(SAMPLE)
+    so['packings'] = [np.asarray(x, dtype=np.float64).tolist() for x in so['packings'].values()]
+    so['zversion'] = 12345.678
+    fn = str(tmp_path_factory.mktemp('cpj') / 'plain.cpj')
+    with open(fn, 'w') as fp:
+        json.dump(so, fp, cls=ser.CPPSEncoder)
+    return fn
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 23, 100, 2**16])
+def test_stream_plain_lists(plain_cpj, chunk_size, monkeypatch):
+    expected = ser.so_columns(ser.zloadso(plain_cpj))
+    monkeypatch.setattr(ser, 'CHUNK_SIZE', chunk_size)
+    assert_same_columns(expected, ser.stream_columns(plain_cpj))
+    meta, keys = ser.load_index(plain_cpj)
+    assert keys == ['Packing %d' % i for i in range(len(expected['packings']))]
+
+@pytest.mark.parametrize('chunk_size', [1, 23, 2**16])
+def test_stream_sample(chunk_size, monkeypatch):
+    expected = ser.so_columns(ser.zloadso(SAMPLE))
+    monkeypatch.setattr(ser, 'CHUNK_SIZE', chunk_size)
+    assert_same_columns(expected, ser.stream_columns(SAMPLE))
+    meta, keys = ser.load_index(SAMPLE)
+    assert meta == json.loads(str(expected['metadata']))
+    assert keys == json.loads(str(expected['packing_keys']))
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5])
+@pytest.mark.parametrize('text', ['12345.678', '-1.5e-7', '0', '1E+20', 'NaN', '-Infinity', 'true', 'null', '"x\\"]"'])
+def test_scalars(text, chunk_size):
+    doc = '{"a": %s, "b": [%s, %s], "c": 1}' % (text, text, text)
+    s = ser.JSONStream(doc[i:i + chunk_size] for i in range(0, len(doc), chunk_size))
+    expected = json.loads(doc)
+    values = {}
+    for key in s.members():
+        values[key] = s.value()
+    assert json.dumps(values) == json.dumps(expected)
+
+def test_numbers_fall_back(monkeypatch):
+    doc = '[[1, 2], [3.5, 4e1]]'
+    for n in (1, 2, 100):
+        s = ser.JSONStream(doc[i:i + n] for i in range(0, len(doc), n))
+        assert s.numbers() is None
+        assert s.value() == [[1, 2], [3.5, 40.0]]
+        s = ser.JSONStream(doc[i:i + n] for i in range(0, len(doc), n))
+        rows = [s.numbers().tolist() for _ in s.items()]
+        assert rows == [[1, 2], [3.5, 40.0]]
+
+def test_vertices_without_coordinates(tmp_path):
+    so = ser.zloadso(SAMPLE)
+    so['metadata']['schema_version'] = '0.2'
+    so['dcel']['vertices'] = [{'leaving': l, 'coordinates': []} for l in so['dcel']['vertices']]
+    fn = str(tmp_path / 'nocoords.cpj')
+    with open(fn, 'w') as fp:
+        json.dump(so, fp, cls=ser.CPPSEncoder)
+    cols = ser.stream_columns(fn)
+    assert 'vertex_coordinates' not in cols
+    assert_same_columns(ser.so_columns(so), cols)
+
+    so['dcel']['vertices'][0]['coordinates'] = [0.0, 1.0, 2.0]
+    with pytest.raises(ValueError):
+        ser.so_columns(so)
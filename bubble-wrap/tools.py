@@ -3,6 +3,11 @@ tools.py
 """
 
 import datetime
+import queue
+import threading
+
+import circle
+import circlecache
 import mobius
 import numpy as np
 
@@ -134,8 +139,14 @@ class UnifiedEmbeddedCirclePacking:
         self.pure_dual_graph_circles = []
         self.circles = []
         self.circles_optimize = [[]]
+        # batches of newly found circles, on their way from the word search to the packing view
+        self.circle_stream = CircleStream()
+        # circles of finished word searches, on disk
+        self.circle_cache = circlecache.CircleCache()
         self.all_packings = None
         self.chains = None
+        # running word search (openpacking.FindWordsThread), cancelled when another one starts
+        self.search_job = None
         self.dual_graph = False
         self.mobius_trans_mode = False
         self.packing_trans = [np.array(((1, 0), (0, 1)), dtype='complex')]
@@ -148,18 +159,193 @@ class UnifiedEmbeddedCirclePacking:
         self.opened_dcel = None
         self.circles = []
         self.circles_optimize = [[]]
+        self.circle_stream.reset()
         self.opened_metadata = {"schema_version": "0.2", "schema": "cpj",
                                            "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'}
 
+class CircleStream:
+    """
+    Bounded queue carrying batches of circles (lists of [circle, vertex, dual_graph_part])
+    from a word search to the packing view, which consumes only the new batches.
+
+    Each search starts a new generation with reset(); batches are tagged with their
+    generation so that the consumer can tell when to drop the circles it already has.
+    """
+    def __init__(self, maxsize=256):
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def reset(self):
+        """Start a new generation, discarding batches not yet consumed; returns the new generation"""
+        with self._lock:
+            self.generation += 1
+            self.drain()
+            return self.generation
+
+    def put(self, generation, batch, control=None):
+        """
+        Add a batch, waiting while the queue is full
+        :param control: optional SearchControl; give up if it is cancelled
+        :return: True if the batch was queued
+        """
+        while control is None or not control.cancelled:
+            try:
+                self._queue.put((generation, batch), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def drain(self):
+        """Remove and return all waiting (generation, batch) pairs, oldest first"""
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+class CircleStore:
+    """
+    Append-only list of circles ([circle, vertex, dual_graph_part] lists) that also keeps the
+    circle matrices and dual graph flags in arrays, so that all circles can be processed in one
+    vectorized pass.  Appending never changes the existing entries, so snapshot() is cheap and
+    stays valid while more circles arrive.
+    """
+    def __init__(self, circles=(), capacity=1024):
+        self.circles = []
+        self._m = np.empty((capacity, 2, 2), dtype='complex')
+        self._dual = np.empty(capacity, dtype=bool)
+        self.extend(circles)
+
+    def __len__(self):
+        return len(self.circles)
+
+    def __getitem__(self, i):
+        return self.circles[i]
+
+    def __iter__(self):
+        return iter(self.circles)
+
+    def extend(self, batch):
+        batch = list(batch)
+        n, k = len(self.circles), len(batch)
+        if n + k > len(self._m):
+            capacity = max(2 * len(self._m), n + k)
+            m = np.empty((capacity, 2, 2), dtype='complex')
+            m[:n] = self._m[:n]
+            dual = np.empty(capacity, dtype=bool)
+            dual[:n] = self._dual[:n]
+            # (arrays of earlier snapshots keep the old buffers)
+            self._m, self._dual = m, dual
+        if k:
+            self._m[n:n + k] = [ci[0].m for ci in batch]
+            self._dual[n:n + k] = [ci[2] for ci in batch]
+        self.circles.extend(batch)
+
+    def matrices(self):
+        """The circles as a circle.CircleArray (sharing memory with the store)"""
+        return circle.CircleArray(self._m[:len(self.circles)], copy=False)
+
+    @property
+    def dual(self):
+        """Boolean array of the dual graph flags"""
+        return self._dual[:len(self.circles)]
+
+    def snapshot(self):
+        """A CircleStore with the circles stored so far, unaffected by later appends"""
+        s = CircleStore.__new__(CircleStore)
+        s.circles = self.circles[:]
+        s._m = self._m[:len(s.circles)]
+        s._dual = self._dual[:len(s.circles)]
+        return s
+
+# margin threshold (change this parameter to allow more/less circles to be included off frame)
+CULL_MARGIN = 50
+
+def visible_rect(zoom, offset, center, width, height):
+    """
+    Rectangle (xmin, xmax, ymin, ymax) in packing coordinates covering the view and its margin
+    """
+    xs = sorted(((-CULL_MARGIN - center[0] - offset[0]) / zoom, (width + CULL_MARGIN - center[0] - offset[0]) / zoom))
+    ys = sorted(((-CULL_MARGIN - center[1] - offset[1]) / zoom, (height + CULL_MARGIN - center[1] - offset[1]) / zoom))
+    return xs[0], xs[1], ys[0], ys[1]
+
+def visible_mask(circles, dualgraph_part, zoom, offset, center, width, height):
+    """
+    Decide which (transformed) circles should be kept for drawing in a view
+    :param circles: circle.CircleArray in packing coordinates, after the mobius transformation
+    :param dualgraph_part: boolean array; circles of the dual graph are always kept
+    :return: boolean array
+    """
+    lines = circles.contains_infinity
+    r = np.where(lines, 0.0, circles.radius)
+    c = np.where(lines, 0.0, circles.center)
+    big = ~lines & (np.abs(zoom * r) > 1)
+
+    mt = CULL_MARGIN
+
+    lc = center[0] + offset[0] + zoom * (c.real - r)
+    tc = center[1] + offset[1] + zoom * (c.imag - r)
+    dia = zoom * (r * 2)
+    in_frame = (lc < width + mt) & (lc + dia > -mt) & (tc < height + mt) & (tc + dia > -mt) & (dia > 2)
+
+    return np.where(big, in_frame | dualgraph_part, lines | dualgraph_part)
+
+def cull_circles(circles, T, display_params):
+    """
+    Select the circles of a list that are visible after transformation by T
+    :param circles: list of [circle, vertex, dual_graph_part]
+    :param T: mobius transformation
+    :param display_params: view parameters (zoom, pos, center, width, height)
+    :return: list of [circle, vertex, dual_graph_part], circles untransformed
+    """
+    if not circles:
+        return []
+    cs = circle.CircleArray.from_circles(ci[0] for ci in circles).transform_sl2(mobius.make_sl2(T))
+    dual = np.array([ci[2] for ci in circles], dtype=bool)
+    keep = visible_mask(cs, dual, display_params["zoom"], display_params["pos"], display_params["center"],
+                        display_params["width"], display_params["height"])
+    return [circles[i] for i in np.flatnonzero(keep)]
+
+def transform_circles(circles, T):
+    """
+    Transform the circles of a list by T
+    :param circles: list of [circle, vertex, dual_graph_part]
+    :param T: mobius transformation in SL(2,C)
+    :return: list of (circle, vertex, dual_graph_part)
+    """
+    if not circles:
+        return []
+    cs = circle.CircleArray.from_circles(ci[0] for ci in circles).transform_sl2(T)
+    return [(c, ci[1], ci[2]) for c, ci in zip(cs, circles)]
+
 # >>> Threading Tools used for Enhanced Performance <<<
 class OptimizeCirclesThread(QThread):
-    def __init__(self, parent, circles, out_circles, mobius_transform=None, display_params=None):
+    """
+    Select the circles to draw for the current transformation and view.
+
+    The transformed circles are kept in a circle.CircleIndex (in self.index), which can be
+    passed to the next optimization: as long as the transformation is the same (e.g. the
+    view was only panned, zoomed or resized), culling is a range query on the index.
+
+    The work is done in a few vectorized passes over all circles.  Progress is only written
+    to uecp.progressValue; it is up to the view to repaint while the thread runs.
+    """
+    def __init__(self, parent, circles, out_circles, mobius_transform=None, display_params=None, index=None):
+        """
+        :param circles: CircleStore (or list) of [circle, vertex, dual_graph_part]
+        :param out_circles: list whose first element is set to the selected circles when done
+        :param index: index made by an earlier optimization, used if it is still valid
+        """
         super().__init__(parent)
 
-        self.C = circles
+        self.C = circles if isinstance(circles, CircleStore) else CircleStore(circles)
         self.OC = out_circles
         self.T = mobius_transform
         self.P = display_params
+        self.index = index
         self.cancel = False
 
     def run(self):
@@ -168,47 +354,33 @@ class OptimizeCirclesThread(QThread):
         center = (self.P["center"][0], self.P["center"][1])
         width = self.P["width"]
         height = self.P["height"]
+        progress = self.parent().delegate.uecp.progressValue
 
-        outCir = []
-        # transform circles
-        m_circles = []
         T = mobius.make_sl2(self.T)
-        for ci in self.C:
+        dual = self.C.dual
+
+        index = self.index
+        if index is None or len(index) != len(self.C) or not np.array_equal(index.T, T):
+            # transform all circles at once, and index them
+            progress[0] = 0
+            index = circle.CircleIndex(self.C.matrices().transform_sl2(T))
+            index.T = T
+            self.index = index
             if self.cancel:
                 return
-            m_circles.append((ci[0].transform_sl2(T), ci[1], ci[2]))
-
-        dgraphcount = 0
-        for i, c in enumerate(m_circles):
-            if self.cancel:
-                return
-
-            cir = c[0]
-            v = c[1]
-            dualgraph_part = c[2]
-
-            if dualgraph_part:
-                dgraphcount += 1
-
-            if not cir.contains_infinity and np.abs(zoom * cir.radius) > 1:
-                # mt: margin_threshold (change this parameter to allow more/less circles to be included off frame)
-                mt = 50
-
-                lc = center[0] + offset[0] + zoom * (cir.center.real - cir.radius)
-                tc = center[1] + offset[1] + zoom * (cir.center.imag - cir.radius)
-                dia = zoom * (cir.radius * 2)
-
-                if lc < width + mt and lc + dia > -mt and tc < height + mt and tc + dia > -mt and dia > 2 or dualgraph_part:
-                    outCir.append([self.C[i][0], v, dualgraph_part])
-
-            elif cir.contains_infinity or dualgraph_part:
-                outCir.append([self.C[i][0], v, dualgraph_part])
-
-            if i % 50 == 0:
-                self.parent().delegate.uecp.progressValue[0] = 100 * (i+1) / len(m_circles)
-                self.parent().draw_trigger.emit()
 
-        self.OC[0] = outCir.copy()
-        self.parent().delegate.uecp.progressValue[0] = 100
-        print("Done! Optimized %d circles." % len(self.OC[0]), "d-graph:", dgraphcount)
+        # circles that may be visible, then the exact test for those
+        progress[0] = 75
+        candidates = np.union1d(index.query(*visible_rect(zoom, offset, center, width, height),
+                                            min_radius=1 / abs(zoom)),
+                                np.flatnonzero(dual))
+        keep = candidates[visible_mask(index.circles[candidates], dual[candidates], zoom, offset, center, width, height)]
+        circles = self.C.circles
+        outCir = [circles[i] for i in keep.tolist()]
+        if self.cancel:
+            return
+
+        self.OC[0] = outCir
+        progress[0] = 100
+        print("Done! Optimized %d circles." % len(self.OC[0]), "d-graph:", int(dual.sum()))
         self.parent().draw_trigger.emit()
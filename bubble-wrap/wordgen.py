@@ -0,0 +1,173 @@
+"""Generate shortlex normal forms of surface group elements"""
+
+# This replaces the MAGMA scripts in data/words: a shortlex rewriting
+# system for the presentation is found by Knuth-Bendix completion
+# (fgrep.RewritingSystem), turned into a finite automaton accepting
+# the irreducible words, and the automaton is run breadth first on
+# blocks of words stored as NumPy arrays.
+#
+# Usage:
+#   python3 wordgen.py g2-commgen 8 data/words/g2-commgen-words-depth8.txt.bz2
+#
+# The output has the format of the MAGMA generated lists: one word per
+# line, identity (empty line) first, then by length and within each
+# length in lexicographic order for a < A < b < B < ...
+
+import bz2
+import sys
+
+import numpy as np
+
+import fgrep
+
+# name: (shortlex order of letters, relators)
+PRESENTATIONS = {
+    'g2-commgen': ('aAbBcCdDkK', ('KabAB', 'kcdCD')),
+    'g2': ('aAbBcCdD', ('abABcdCD',)),
+    'g1': ('aAbB', ('abAB',)),
+}
+
+_BLOCK_SIZE = 1 << 16
+
+class WordAutomaton:
+    """Automaton accepting the words that contain no left hand side of a
+    rule of a rewriting system (Aho-Corasick construction).
+
+    Attributes:
+    order -- the alphabet, in shortlex order
+    delta -- transition table, shape (number of states, len(order));
+             entry -1 means the word became reducible.  State 0 is the
+             start state.
+    """
+    def __init__(self, rws):
+        self.order = rws.order
+        pos = {x: i for i, x in enumerate(self.order)}
+        n = len(self.order)
+
+        # Trie of left hand sides
+        children = [{}]
+        dead = [False]
+        for lhs in rws.rules:
+            s = 0
+            for x in lhs:
+                i = pos[x]
+                if i not in children[s]:
+                    children[s][i] = len(children)
+                    children.append({})
+                    dead.append(False)
+                s = children[s][i]
+            dead[s] = True
+
+        # Failure links, breadth first, completing the transition table
+        delta = np.zeros((len(children), n), dtype=np.int32)
+        fail = [0] * len(children)
+        queue = []
+        for i in range(n):
+            t = children[0].get(i, 0)
+            delta[0, i] = t
+            if t:
+                queue.append(t)
+        for s in queue:
+            dead[s] = dead[s] or dead[fail[s]]
+            for i in range(n):
+                t = children[s].get(i)
+                if t is None:
+                    delta[s, i] = delta[fail[s], i]
+                else:
+                    fail[t] = delta[fail[s], i]
+                    delta[s, i] = t
+                    queue.append(t)
+
+        dead = np.array(dead)
+        delta[dead[delta]] = -1
+        self.delta = delta
+        self._letters = np.frombuffer(self.order.encode('ascii'), dtype=np.uint8)
+
+    def accepts(self, w):
+        s = 0
+        for x in w:
+            s = self.delta[s, self.order.index(x)]
+            if s < 0:
+                return False
+        return True
+
+    def _blocks(self, states, words, steps, block_size):
+        """Extend words (array of letter indices, one row per word) by
+        steps letters, yielding the results in blocks in shortlex order"""
+        if steps == 0:
+            yield words
+            return
+        nxt = self.delta[states]
+        # row-major nonzero keeps (parent, letter) order, hence shortlex order
+        rows, cols = np.nonzero(nxt >= 0)
+        states = nxt[rows, cols]
+        words = np.hstack((words[rows], cols[:, None].astype(np.uint8)))
+        for i in range(0, len(states), block_size):
+            for b in self._blocks(states[i:i+block_size], words[i:i+block_size], steps - 1, block_size):
+                yield b
+
+    def level_blocks(self, length, block_size=_BLOCK_SIZE):
+        """Generate the accepted words of the given length as arrays of
+        letter indices, in blocks of at most block_size rows"""
+        states = np.zeros(1, dtype=np.int32)
+        words = np.zeros((1, 0), dtype=np.uint8)
+        return self._blocks(states, words, length, block_size)
+
+    def block_strings(self, block):
+        """Convert an array of letter indices to a list of strings"""
+        if block.shape[1] == 0:
+            return [''] * len(block)
+        b = np.ascontiguousarray(self._letters[block])
+        return [s.decode('ascii') for s in b.view('S%d' % block.shape[1]).ravel()]
+
+    def words(self, depth, block_size=_BLOCK_SIZE):
+        """Generate the accepted words of length at most depth in
+        shortlex (BFS) order, starting with the empty word"""
+        for n in range(depth + 1):
+            for block in self.level_blocks(n, block_size):
+                for w in self.block_strings(block):
+                    yield w
+
+
+def automaton(order, relators, depth, maxrules=100000):
+    """Automaton for shortlex normal forms of words of length up to depth.
+
+    Completion is truncated at rules of length 2*max(depth, relator
+    length); for the presentations above this is far more than
+    needed, since longer rules cannot apply to words of length
+    depth."""
+    maxlen = 2 * max([depth] + [len(r) for r in relators])
+    rws = fgrep.RewritingSystem(order, relators, maxrules=maxrules, maxlen=maxlen)
+    if not rws.confluent:
+        print('Note: rewriting system truncated at rule length %d (%d rules).' % (maxlen, len(rws.rules)),
+              file=sys.stderr)
+    return WordAutomaton(rws)
+
+def write_wordfile(fn, A, depth, block_size=_BLOCK_SIZE):
+    """Write the words of length at most depth accepted by automaton A to
+    a bz2 word list; returns the number of words written"""
+    count = 0
+    with bz2.open(fn, 'wb') as outfile:
+        for n in range(depth + 1):
+            for block in A.level_blocks(n, block_size):
+                b = np.ascontiguousarray(A._letters[block])
+                lines = np.full((len(block), n + 1), ord('\n'), dtype=np.uint8)
+                lines[:, :n] = b
+                outfile.write(lines.tobytes())
+                count += len(block)
+    return count
+
+def main(argv):
+    if len(argv) != 4 or argv[1] not in PRESENTATIONS:
+        print('Usage: %s PRESENTATION DEPTH OUTFILE.txt.bz2' % argv[0], file=sys.stderr)
+        print('Known presentations: %s' % ', '.join(sorted(PRESENTATIONS)), file=sys.stderr)
+        return 1
+    order, relators = PRESENTATIONS[argv[1]]
+    depth = int(argv[2])
+    A = automaton(order, relators, depth)
+    n = write_wordfile(argv[3], A, depth)
+    print('Wrote %d words to %s' % (n, argv[3]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))